@@ -0,0 +1,1644 @@
+#!/usr/bin/env python3
+"""Local micro-benchmarks for the threeserver send path.
+
+Nothing here talks to Bilibili. Run from the repository root, for example:
+
+    python scripts/bench_threeserver.py queue
+    python scripts/bench_threeserver.py backends --provider-latency-ms 40
+    python scripts/bench_threeserver.py status
+    python scripts/bench_threeserver.py journal
+    python scripts/bench_threeserver.py coalesce
+    python scripts/bench_threeserver.py window
+    python scripts/bench_threeserver.py admission
+    python scripts/bench_threeserver.py rooms
+    python scripts/bench_threeserver.py accounts
+    python scripts/bench_threeserver.py warmup
+    python scripts/bench_threeserver.py dns
+    python scripts/bench_threeserver.py bag
+    python scripts/bench_threeserver.py roommeta
+    python scripts/bench_threeserver.py payload
+    python scripts/bench_threeserver.py timeouts
+    python scripts/bench_threeserver.py hedge
+    python scripts/bench_threeserver.py breaker
+    python scripts/bench_threeserver.py danmaku
+    python scripts/bench_threeserver.py planner
+    python scripts/bench_threeserver.py serving
+    python scripts/bench_threeserver.py events
+    python scripts/bench_threeserver.py results
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "workers", "bilibili"))
+
+from send_queue import LANE_GIFT, SendQueue  # noqa: E402
+from dns_cache import DnsCache, install_urllib3  # noqa: E402
+from event_server import PARKING_ENVIRON_KEY, EventLoopServer  # noqa: E402
+from gift_protocol import FORM_CONTENT_TYPE, SendGiftForm, plan_bag_sends, sendgift_payload  # noqa: E402
+from hedge import Hedger  # noqa: E402
+from journal import SendJournal, replay_journal  # noqa: E402
+from latency import LatencyTracker  # noqa: E402
+from room_meta import RoomMetaCache  # noqa: E402
+from status_store import StatusStore  # noqa: E402
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize_ms(label, samples_s):
+    samples = [value * 1000.0 for value in samples_s]
+    print(
+        f"{label}: n={len(samples)} p50={percentile(samples, 0.50):.3f}ms "
+        f"p99={percentile(samples, 0.99):.3f}ms max={max(samples or [0]):.3f}ms "
+        f"mean={statistics.fmean(samples) if samples else 0:.3f}ms"
+    )
+
+
+class PollingQueue:
+    """The pre-condition-variable design: deque + lock + 1 ms sleep poll."""
+
+    def __init__(self, max_depth):
+        self.max_depth = max_depth
+        self.items = deque()
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        with self.lock:
+            if len(self.items) >= self.max_depth:
+                return False
+            self.items.append(item)
+            return True
+
+    def consume(self, handle, stop):
+        while not stop.is_set():
+            if self.items:
+                with self.lock:
+                    items = list(self.items)
+                    self.items.clear()
+                for item in items:
+                    handle(item)
+            else:
+                time.sleep(0.001)
+
+
+class BlockingQueue:
+    def __init__(self, max_depth):
+        self.queue = SendQueue({LANE_GIFT: max_depth})
+
+    def put(self, item):
+        return self.queue.put(item)
+
+    def consume(self, handle, stop):
+        while not stop.is_set():
+            for item in self.queue.drain(timeout=0.5):
+                handle(item)
+
+
+def bench_queue(args):
+    for name, factory in (("polling", PollingQueue), ("blocking", BlockingQueue)):
+        queue = factory(100)
+        stop = threading.Event()
+        latencies = []
+        done = threading.Event()
+
+        def handle(item):
+            latencies.append(time.perf_counter() - item["received"])
+            if len(latencies) >= args.samples:
+                done.set()
+
+        consumer = threading.Thread(target=queue.consume, args=(handle, stop), daemon=True)
+        consumer.start()
+        time.sleep(0.1)
+
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        time.sleep(args.idle_seconds)
+        idle_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+
+        for _ in range(args.samples):
+            time.sleep(random.uniform(0.002, 0.01))
+            queue.put({"received": time.perf_counter()})
+        done.wait(timeout=10)
+        stop.set()
+        if isinstance(queue, BlockingQueue):
+            queue.queue.close()
+        consumer.join(timeout=2)
+
+        print(f"[{name}] idle CPU over {args.idle_seconds:.1f}s: {idle_cpu * 100:.2f}% of one core")
+        summarize_ms(f"[{name}] received->sending wake latency", latencies)
+
+
+class StandInProvider(BaseHTTPRequestHandler):
+    """Loopback stand-in for the provider endpoints the HTTP backends call."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency_s = 0.0
+    # When set, called for every POST / GET instead of latency_s / get_latency_s.
+    latency_sampler = None
+    get_latency_sampler = None
+    # Stand-ins for a TLS handshake (per new connection) and for the
+    # room info / bag list round-trips; both 0 unless a bench sets them.
+    connect_latency_s = 0.0
+    get_latency_s = 0.0
+    send_calls = 0
+    send_calls_lock = threading.Lock()
+    # sendGift calls whose csrf form field was not the bili_jct of the
+    # cookie they carried, i.e. one account's request with another's cookie.
+    cookie_mismatches = 0
+    # A bag with this many of gift 31036 (None: empty bag). Bag sends beyond
+    # the stock are rejected like the provider does; direct sends are paid.
+    bag_stock = None
+    bag_gets = 0
+    bag_sends = 0
+    bag_rejections = 0
+    direct_sends = 0
+    # msg/send answers after danmaku_latency_s and notes when each arrived.
+    danmaku_latency_s = 0.0
+    danmaku_arrivals = {}
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        time.sleep(self.connect_latency_s)
+
+    def _reply(self, body):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        sampler = StandInProvider.get_latency_sampler
+        time.sleep(sampler() if sampler is not None else self.get_latency_s)
+        if self.path.startswith("/room/v1/Room/get_info"):
+            self._reply({"code": 0, "data": {"uid": 1}})
+            return
+        with StandInProvider.send_calls_lock:
+            StandInProvider.bag_gets += 1
+            stock = StandInProvider.bag_stock
+        items = [{"bag_id": 1, "gift_id": 31036, "gift_num": stock}] if stock else []
+        self._reply({"code": 0, "data": {"list": items}})
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if "msg/send" in self.path:
+            form = urllib.parse.parse_qs(raw.decode("utf-8", "replace"))
+            StandInProvider.danmaku_arrivals[form.get("msg", [""])[0]] = time.perf_counter()
+            time.sleep(self.danmaku_latency_s)
+            self._reply({"code": 0, "data": {}})
+            return
+        if "sendGift" in self.path:
+            form = urllib.parse.parse_qs(raw.decode("utf-8", "replace"))
+            cookies = dict(
+                part.strip().split("=", 1) for part in (self.headers.get("Cookie") or "").split(";") if "=" in part
+            )
+            with StandInProvider.send_calls_lock:
+                StandInProvider.send_calls += 1
+                if form.get("csrf", [""])[0] != cookies.get("bili_jct"):
+                    StandInProvider.cookie_mismatches += 1
+        sampler = StandInProvider.latency_sampler
+        time.sleep(sampler() if sampler is not None else self.latency_s)
+        if "sendGift" in self.path and StandInProvider.bag_stock is not None:
+            num = int(form.get("num", ["1"])[0])
+            with StandInProvider.send_calls_lock:
+                if form.get("bag_id", ["0"])[0] == "0":
+                    StandInProvider.direct_sends += 1
+                elif StandInProvider.bag_stock >= num:
+                    StandInProvider.bag_stock -= num
+                    StandInProvider.bag_sends += 1
+                else:
+                    StandInProvider.bag_rejections += 1
+                    self._reply({"code": 200028, "message": "bag item not enough"})
+                    return
+        self._reply({"code": 0, "data": {"tid": f"{time.time_ns()}"}})
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stand_in_provider(latency_ms):
+    StandInProvider.latency_s = latency_ms / 1000.0
+    provider = ThreadingHTTPServer(("127.0.0.1", 0), StandInProvider)
+    provider.daemon_threads = True
+    threading.Thread(target=provider.serve_forever, daemon=True).start()
+    return provider, f"http://127.0.0.1:{provider.server_address[1]}"
+
+
+def post_send(base, token, payload):
+    started = time.perf_counter()
+    request = urllib.request.Request(
+        base + "/send", data=json.dumps(payload).encode("utf-8"), method="POST",
+        headers={"Content-Type": "application/json", "X-Local-Sender-Token": token},
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        ok = json.loads(response.read()).get("success") is True
+    return ok, time.perf_counter() - started
+
+
+def start_threeserver(backend, provider_url, workdir, token, concurrency, extra_env=None):
+    port = free_port()
+    cookie_path = os.path.join(workdir, "cookie.txt")
+    config_path = os.path.join(workdir, "config.json")
+    with open(cookie_path, "w", encoding="utf-8") as handle:
+        handle.write("SESSDATA\tbench\nbili_jct\tbench\n")
+    os.chmod(cookie_path, 0o600)
+    with open(config_path, "w", encoding="utf-8") as handle:
+        json.dump({"送礼房间配置": {"送礼房间": "1"}, "登录配置": {"Cookie文件路径": cookie_path}}, handle, ensure_ascii=False)
+    env = dict(
+        os.environ,
+        LOCALAPPDATA=workdir,
+        BILIPK_CONFIG=config_path,
+        THREESERVER_PORT=str(port),
+        THREESERVER_LOCAL_TOKEN=token,
+        THREESERVER_ALLOWED_GIFT_IDS="31036",
+        THREESERVER_BACKEND=backend,
+        THREESERVER_PROVIDER_BASE_URL=provider_url,
+        THREESERVER_DISPATCH_CONCURRENCY=str(concurrency),
+        THREESERVER_ASYNC_MAX_STREAMS=str(concurrency),
+        THREESERVER_JOURNAL="0",
+        **(extra_env or {}),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "threeserver.py"], cwd=os.path.join(ROOT, "workers", "bilibili"), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(urllib.request.Request(base + "/", headers={"X-Local-Sender-Token": token}), timeout=1).read()
+            return process, base
+        except Exception:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"threeserver ({backend}) did not start")
+
+
+def bench_backends(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True}
+
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as workdir:
+            process, base = start_threeserver(backend, provider_url, workdir, token, args.concurrency)
+            try:
+                def send_one(_):
+                    return post_send(base, token, payload)
+
+                with ThreadPoolExecutor(args.clients) as clients:
+                    list(clients.map(send_one, range(args.clients)))  # warm-up
+                    wall_start = time.perf_counter()
+                    outcomes = list(clients.map(send_one, range(args.requests)))
+                    wall = time.perf_counter() - wall_start
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+        failures = sum(1 for ok, _ in outcomes if not ok)
+        print(f"[{backend}] {args.requests} sends, {args.clients} clients, concurrency {args.concurrency}: "
+              f"{args.requests / wall:.1f} req/s, failures={failures}")
+        summarize_ms(f"[{backend}] /send latency", [latency for _, latency in outcomes])
+    provider.shutdown()
+
+
+class ScanningStatus:
+    """The pre-StatusStore design: dict of dicts, full TTL scan per admission."""
+
+    def __init__(self, capacity, ttl_seconds):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.records = {}
+
+    def create(self, request_id, **fields):
+        current = time.time()
+        with self.lock:
+            expired = [
+                key for key, state in self.records.items()
+                if current - float(state.get("updated_ts") or state.get("created_ts") or current) > self.ttl_seconds
+            ]
+            for key in expired:
+                self.records.pop(key, None)
+            if len(self.records) >= self.capacity:
+                return None
+            self.records[request_id] = {
+                "status": "queued", "results": [], "created_ts": current, "updated_ts": current,
+                "received_ts": current, "sending_ts": None, "done_ts": None, **fields,
+            }
+            return self.records[request_id]
+
+    def finish(self, request_id, results):
+        with self.lock:
+            state = self.records[request_id]
+            state.update(status="done", results=results, done_ts=time.time(), updated_ts=time.time())
+
+
+def bench_status(args):
+    results = [{"id": "31036", "count": 1, "success": True, "status_code": 200, "mode": "direct",
+                "provider_transaction_id": "1", "outcome_uncertain": False}]
+    fields = {"backend": "http", "confirm": "api", "deadline": None, "total": 1}
+    for name, factory in (("scan", ScanningStatus), ("store", StatusStore)):
+        for fill in args.fill:
+            store = factory(fill + args.samples + 1, 3600)
+            for index in range(fill):
+                store.create(f"fill-{index}", **fields)
+                store.finish(f"fill-{index}", list(results))
+            samples = []
+            for index in range(args.samples):
+                started = time.perf_counter()
+                store.create(f"new-{index}", **fields)
+                samples.append(time.perf_counter() - started)
+            summarize_ms(f"[{name}] admission with {fill} live records", samples)
+    store = StatusStore(5000, 3600)
+    for index in range(5000):
+        store.create(f"r-{index}", **fields)
+        store.finish(f"r-{index}", list(results))
+    print(f"[store] 5000 done records: approx_bytes={store.stats()['approx_bytes']}")
+
+
+def bench_journal(args):
+    results = [{"id": "31036", "count": 1, "success": True, "status_code": 200, "mode": "direct",
+                "provider_transaction_id": "1", "outcome_uncertain": False}]
+    fields = {"backend": "http", "confirm": "api", "deadline": None, "total": 1}
+    with tempfile.TemporaryDirectory() as workdir:
+        for threads in args.threads:
+            for label in ("off", "on"):
+                store = StatusStore(args.requests + 1, 3600)
+                journal = None
+                if label == "on":
+                    journal = SendJournal(os.path.join(workdir, f"overhead-{threads}.jsonl"))
+                    store.journal = journal
+                samples = []
+                samples_lock = threading.Lock()
+
+                def lifecycle(index):
+                    started = time.perf_counter()
+                    request_id = f"r-{index}"
+                    store.create(request_id, **fields)
+                    store.mark_sending(request_id)
+                    store.finish(request_id, list(results))
+                    with samples_lock:
+                        samples.append(time.perf_counter() - started)
+
+                with ThreadPoolExecutor(threads) as pool:
+                    list(pool.map(lifecycle, range(args.requests)))
+                summarize_ms(f"[journal {label}, {threads} threads] queued->sending->done bookkeeping", samples)
+                if journal is not None:
+                    journal.flush()
+                    stats = journal.stats()
+                    print(f"    commits={stats['commits']} entries/commit={stats['entries_per_commit']} "
+                          f"fsync p50={stats['fsync_p50_ms']}ms")
+                    journal.close()
+
+        path = os.path.join(workdir, "recovery.jsonl")
+        journal = SendJournal(path, fsync=False)
+        now = time.time()
+        for index in range(args.recovery_entries):
+            request_id = f"req-{index:06d}"
+            journal.append({"id": request_id, "status": "queued", "ts": now, "created_ts": now, **fields})
+            journal.append({"id": request_id, "status": "sending", "ts": now, "sending_ts": now})
+            if index % 10:
+                journal.append({"id": request_id, "status": "done", "ts": now, "done_ts": now, "results": results})
+        journal.close()
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        for capacity in (5000, args.recovery_entries):
+            started = time.perf_counter()
+            states = replay_journal(path)
+            replayed = time.perf_counter() - started
+            store = StatusStore(capacity, 3600)
+            restored = store.restore(states.values())
+            total = time.perf_counter() - started
+            print(f"[recovery] {len(states)} requests ({size_mb:.1f} MB journal), capacity {capacity}: "
+                  f"replay {replayed * 1000:.0f}ms, replay+restore {total * 1000:.0f}ms, restored={restored}")
+
+
+def bench_coalesce(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True}
+    for label, flag in (("coalesce off", "0"), ("coalesce on", "1")):
+        with tempfile.TemporaryDirectory() as workdir:
+            process, base = start_threeserver(
+                "http", provider_url, workdir, token, args.concurrency, {"THREESERVER_COALESCE": flag},
+            )
+            try:
+                post_send(base, token, payload)
+                StandInProvider.send_calls = 0
+                outcomes = []
+                wall_start = time.perf_counter()
+                with ThreadPoolExecutor(args.burst) as clients:
+                    for _ in range(args.bursts):
+                        outcomes.extend(clients.map(lambda _: post_send(base, token, payload), range(args.burst)))
+                wall = time.perf_counter() - wall_start
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+        failures = sum(1 for ok, _ in outcomes if not ok)
+        print(f"[{label}] {len(outcomes)} requests in bursts of {args.burst}: "
+              f"{StandInProvider.send_calls} sendGift calls, {len(outcomes) / wall:.1f} req/s, failures={failures}")
+        summarize_ms(f"[{label}] /send latency", [latency for _, latency in outcomes])
+    provider.shutdown()
+
+
+def fetch_health(base, token):
+    request = urllib.request.Request(base + "/", headers={"X-Local-Sender-Token": token})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def bench_window(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True}
+    for window_ms in args.windows:
+        for label, rate in (("idle", None), (f"{args.rate:g} req/s", args.rate)):
+            with tempfile.TemporaryDirectory() as workdir:
+                process, base = start_threeserver(
+                    "http", provider_url, workdir, token, args.concurrency,
+                    {"THREESERVER_COALESCE": "1", "THREESERVER_BATCH_WINDOW_MS": str(window_ms)},
+                )
+                try:
+                    for _ in range(5):
+                        post_send(base, token, payload)
+                    StandInProvider.send_calls = 0
+                    if rate is None:
+                        outcomes = []
+                        for _ in range(args.idle_requests):
+                            outcomes.append(post_send(base, token, payload))
+                            time.sleep(0.05)
+                    else:
+                        # Open-loop Poisson arrivals.
+                        with ThreadPoolExecutor(128) as clients:
+                            futures = []
+                            for _ in range(args.requests):
+                                futures.append(clients.submit(post_send, base, token, payload))
+                                time.sleep(random.expovariate(rate))
+                            outcomes = [future.result() for future in futures]
+                    window_stats = fetch_health(base, token)["batch_window"]
+                finally:
+                    process.terminate()
+                    process.wait(timeout=5)
+            failures = sum(1 for ok, _ in outcomes if not ok)
+            print(f"[window {window_ms:g}ms, {label}] {len(outcomes)} requests, "
+                  f"{StandInProvider.send_calls} sendGift calls, failures={failures}")
+            summarize_ms(f"[window {window_ms:g}ms, {label}] /send latency", [latency for _, latency in outcomes])
+            batches = {k: v for k, v in window_stats["batch_size_histogram"].items() if v}
+            added = {k: v for k, v in window_stats["added_latency_ms_histogram"].items() if v}
+            print(f"    batch sizes {batches} added ms {added}")
+    provider.shutdown()
+
+
+def post_send_status(base, token, payload):
+    """Like ``post_send`` but returns (HTTP status, JSON body, seconds)."""
+    started = time.perf_counter()
+    request = urllib.request.Request(
+        base + "/send", data=json.dumps(payload).encode("utf-8"), method="POST",
+        headers={"Content-Type": "application/json", "X-Local-Sender-Token": token},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            status, body = response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        status, body = error.code, json.loads(error.read() or b"{}")
+    return status, body, time.perf_counter() - started
+
+
+def bench_admission(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "b" * 40
+    for label, target_ms in (("depth only", "1000000000"), (f"target {args.target_ms:g}ms", str(args.target_ms))):
+        with tempfile.TemporaryDirectory() as workdir:
+            process, base = start_threeserver(
+                "http", provider_url, workdir, token, args.concurrency,
+                {"THREESERVER_QUEUE_TARGET_MS": target_ms, "THREESERVER_QUEUE_INTERVAL_MS": str(args.interval_ms)},
+            )
+            try:
+                post_send(base, token, {"gifts": [{"id": "31036", "count": 1}], "wait": True})
+                StandInProvider.send_calls = 0
+                with ThreadPoolExecutor(256) as clients:
+                    futures = []
+                    stop_at = time.perf_counter() + args.seconds
+                    while time.perf_counter() < stop_at:
+                        payload = {
+                            "gifts": [{"id": "31036", "count": 1}], "wait": True,
+                            "deadline": time.time() + args.deadline_s,
+                        }
+                        futures.append(clients.submit(post_send_status, base, token, payload))
+                        time.sleep(random.expovariate(args.rate))
+                    outcomes = [future.result() for future in futures]
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+        sent = [seconds for status, body, seconds in outcomes if status == 200 and body.get("success") is True]
+        expired = sum(1 for status, body, _ in outcomes if body.get("error") == "deadline_expired"
+                      or body.get("status") == "expired")
+        refused = [(status, body, seconds) for status, body, seconds in outcomes if status == 503]
+        overloaded = sum(1 for _, body, _ in refused if body.get("error") == "sender_overloaded")
+        print(f"[{label}] offered {len(outcomes)} ({args.rate:g} req/s for {args.seconds:g}s, "
+              f"deadline {args.deadline_s:g}s): sent={len(sent)} expired_in_queue={expired} "
+              f"503={len(refused)} (overloaded={overloaded}) sendGift calls={StandInProvider.send_calls}")
+        summarize_ms(f"[{label}] latency of sent requests", sent)
+        summarize_ms(f"[{label}] latency of 503 responses", [seconds for _, _, seconds in refused])
+    provider.shutdown()
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status", encoding="ascii") as handle:
+        for line in handle:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def bench_rooms(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "b" * 40
+    rooms = [str(room) for room in range(1, args.rooms + 1)]
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in (*rooms, "shared"):
+            os.makedirs(os.path.join(workdir, name))
+        servers = {}
+        try:
+            for label in ("process per room", "one process, sharded"):
+                for process, _base in servers.values():
+                    process.terminate()
+                    process.wait(timeout=5)
+                servers = {}
+                if label == "process per room":
+                    servers = {
+                        room: start_threeserver(
+                            "http", provider_url, os.path.join(workdir, room), token, args.concurrency,
+                            {"THREESERVER_ROOM_ID": room},
+                        )
+                        for room in rooms
+                    }
+                else:
+                    # Same total provider concurrency as the per-room processes.
+                    servers = {"shared": start_threeserver(
+                        "http", provider_url, os.path.join(workdir, "shared"), token, args.concurrency * len(rooms),
+                        {"THREESERVER_ROOM_ID": rooms[0], "THREESERVER_ROOM_IDS": ",".join(rooms[1:])},
+                    )}
+
+                def base_for(room):
+                    return servers[room][1] if room in servers else servers["shared"][1]
+
+                def send(room):
+                    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True, "room_id": room}
+                    return room, post_send(base_for(room), token, payload)
+
+                for room in rooms:
+                    send(room)
+                per_room = {room: [] for room in rooms}
+                wall_start = time.perf_counter()
+                with ThreadPoolExecutor(args.clients * len(rooms)) as clients:
+                    for room, outcome in clients.map(send, rooms * args.requests):
+                        per_room[room].append(outcome)
+                wall = time.perf_counter() - wall_start
+                rss = {name: rss_mb(process.pid) for name, (process, _base) in servers.items()}
+                failures = sum(1 for outcomes in per_room.values() for ok, _ in outcomes if not ok)
+                print(f"[{label}] {len(rooms)} rooms x {args.requests} requests in {wall:.2f}s, failures={failures}, "
+                      f"RSS total {sum(rss.values()):.1f} MB ({sum(rss.values()) / len(rooms):.1f} MB/room)")
+                for room in rooms:
+                    latencies = [latency for _, latency in per_room[room]]
+                    print(f"    room {room}: {len(latencies) / wall:.1f} req/s "
+                          f"p50={percentile(latencies, 0.5) * 1000:.1f}ms p99={percentile(latencies, 0.99) * 1000:.1f}ms")
+        finally:
+            for process, _base in servers.values():
+                process.terminate()
+                process.wait(timeout=5)
+    provider.shutdown()
+
+
+def bench_accounts(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "b" * 40
+    account_ids = [f"creator{index:03d}" for index in range(args.accounts)]
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as workdir:
+            accounts_dir = os.path.join(workdir, "accounts")
+            os.makedirs(accounts_dir)
+            for account_id in account_ids:
+                path = os.path.join(accounts_dir, f"{account_id}.txt")
+                with open(path, "w", encoding="utf-8") as handle:
+                    handle.write(f"SESSDATA\t{account_id}\nbili_jct\tcsrf-{account_id}\n")
+                os.chmod(path, 0o600)
+            process, base = start_threeserver(
+                backend, provider_url, workdir, token, args.concurrency,
+                {"THREESERVER_ACCOUNTS_DIR": accounts_dir, "THREESERVER_ACCOUNT_IDLE_SECONDS": str(args.idle_seconds)},
+            )
+            try:
+                rss_idle = rss_mb(process.pid)
+                StandInProvider.send_calls = 0
+                StandInProvider.cookie_mismatches = 0
+
+                def send(account_id):
+                    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True, "account": account_id}
+                    return account_id, post_send_status(base, token, payload)
+
+                wall_start = time.perf_counter()
+                with ThreadPoolExecutor(args.clients) as clients:
+                    outcomes = list(clients.map(send, account_ids * args.requests))
+                wall = time.perf_counter() - wall_start
+                stats = fetch_health(base, token)["accounts"]
+                rss_loaded = rss_mb(process.pid)
+                deadline = time.time() + args.idle_seconds + 45
+                while time.time() < deadline and fetch_health(base, token)["accounts"]["active"] > 1:
+                    time.sleep(1)
+                after = fetch_health(base, token)["accounts"]
+                rss_after = rss_mb(process.pid)
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+        ok = sum(1 for _, (status, body, _) in outcomes if status == 200 and body.get("success") is True)
+        latencies = [seconds for _, (_, _, seconds) in outcomes]
+        warmed = sum(1 for account in stats["accounts"].values() if account["warmed"])
+        print(f"[{backend}] {len(account_ids)} accounts x {args.requests} requests: ok={ok}/{len(outcomes)} "
+              f"{len(outcomes) / wall:.1f} req/s, cookie/csrf mismatches={StandInProvider.cookie_mismatches}, "
+              f"warmed={warmed}")
+        summarize_ms(f"[{backend}] /send latency", latencies)
+        print(f"    RSS idle {rss_idle:.1f} MB, with {stats['active']} accounts loaded {rss_loaded:.1f} MB, "
+              f"after idle eviction ({after['active']} active, {after['evicted']} evicted) {rss_after:.1f} MB")
+    provider.shutdown()
+
+
+def bench_warmup(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    StandInProvider.connect_latency_s = args.connect_latency_ms / 1000.0
+    StandInProvider.get_latency_s = args.get_latency_ms / 1000.0
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True, "lane": "pk"}
+    for backend in args.backends:
+        for label, flag in (("warm-up off", "0"), ("warm-up on", "1")):
+            first, second, startup = [], [], []
+            for _ in range(args.runs):
+                with tempfile.TemporaryDirectory() as workdir:
+                    started = time.perf_counter()
+                    process, base = start_threeserver(
+                        backend, provider_url, workdir, token, 4, {"THREESERVER_WARMUP": flag},
+                    )
+                    try:
+                        # What the listener does: poll / until ready is not false.
+                        while fetch_health(base, token).get("ready") is False:
+                            time.sleep(0.05)
+                        startup.append(time.perf_counter() - started)
+                        time.sleep(args.idle_s)
+                        first.append(post_send(base, token, payload)[1])
+                        second.append(post_send(base, token, payload)[1])
+                    finally:
+                        process.terminate()
+                        process.wait(timeout=5)
+            print(f"[{backend}, {label}] {args.runs} starts: ready after p50 {percentile(startup, 0.5) * 1000:.0f}ms, "
+                  f"first /send p50 {percentile(first, 0.5) * 1000:.1f}ms max {max(first) * 1000:.1f}ms, "
+                  f"second /send p50 {percentile(second, 0.5) * 1000:.1f}ms")
+    provider.shutdown()
+
+
+def bench_bag(args):
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    StandInProvider.get_latency_s = args.get_latency_ms / 1000.0
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True, "lane": "pk"}
+    for backend in args.backends:
+        StandInProvider.bag_stock = args.stock
+        StandInProvider.bag_gets = StandInProvider.bag_sends = 0
+        StandInProvider.bag_rejections = StandInProvider.direct_sends = 0
+        with tempfile.TemporaryDirectory() as workdir:
+            process, base = start_threeserver(
+                backend, provider_url, workdir, token, 4, {"BILI_BAG_CACHE_TTL": str(args.ttl)},
+            )
+            try:
+                while fetch_health(base, token).get("ready") is False:
+                    time.sleep(0.05)
+                samples = []
+                for _ in range(args.requests):
+                    time.sleep(args.spacing_ms / 1000.0)
+                    samples.append(post_send(base, token, payload)[1])
+                rooms = fetch_health(base, token).get("rooms") or {}
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+        summarize_ms(f"[{backend}] /send, bag TTL {args.ttl}s, {args.spacing_ms:.0f}ms apart", samples)
+        print(f"[{backend}] stock {args.stock}: bag sends {StandInProvider.bag_sends}, "
+              f"rejected bag sends {StandInProvider.bag_rejections}, paid direct sends {StandInProvider.direct_sends}, "
+              f"bag list GETs {StandInProvider.bag_gets}")
+        bag = ((rooms.get("rooms") or {}).get("1") or {}).get("bag")
+        if bag:
+            print(f"[{backend}] cache: {json.dumps(bag, sort_keys=True)}")
+    StandInProvider.bag_stock = None
+    provider.shutdown()
+
+
+def bench_roommeta(args):
+    """Room/get_info lookups over PK cycles, each worker process with its own cache instance."""
+    # The lookups one PK makes today, in order: checkpk's live check, normalpk
+    # at start and again in check_final_result, checkpk's result check, and
+    # threeserver resolving the ruid for the first send.
+    lifecycle = [
+        ("checkpk", "live_status"), ("normalpk", "uid"), ("normalpk", "uid"),
+        ("checkpk", "uid"), ("threeserver", "uid"),
+    ]
+    info = {"uid": 1, "live_status": 1}
+
+    def provider_fetch():
+        calls["count"] += 1
+        time.sleep(args.get_latency_ms / 1000.0)
+        return info
+
+    for label, cached in (("no cache", False), ("shared cache", True)):
+        calls = {"count": 0}
+        lookup_s = []
+        # PKs are minutes apart; a virtual clock stands in for the wait.
+        clock = {"now": time.time()}
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(args.cycles):
+                caches = {}
+                for process, field in lifecycle:
+                    started = time.perf_counter()
+                    if cached:
+                        cache = caches.setdefault(process, RoomMetaCache(directory, clock=lambda: clock["now"]))
+                        getattr(cache, field)("1", provider_fetch)
+                    else:
+                        provider_fetch()
+                    lookup_s.append(time.perf_counter() - started)
+                clock["now"] += args.pk_interval_s
+        print(f"[{label}] {args.cycles} PK cycles: {calls['count']} Room/get_info calls "
+              f"({calls['count'] / args.cycles:.1f} per PK), lookup time per PK "
+              f"{sum(lookup_s) / args.cycles * 1000:.1f}ms")
+        summarize_ms(f"[{label}] per lookup", lookup_s)
+
+
+def bench_payload(args):
+    """CPU per sendGift request built and encoded, up to the bytes handed to the socket layer."""
+    import httpx
+    import requests
+
+    url = "https://api.live.bilibili.com/xlive/revenue/v1/gift/sendGift"
+    csrf, room_id, ruid, gift_id = "0123456789abcdef0123456789abcdef", "4795936", 1234567, "31036"
+    session = requests.Session()
+    session.headers.update({"User-Agent": "bench", "Referer": f"https://live.bilibili.com/{room_id}"})
+    session.cookies.update({"SESSDATA": "x" * 200, "bili_jct": csrf})
+    async_headers = {"User-Agent": "bench", "Cookie": f"SESSDATA={'x' * 200}; bili_jct={csrf}"}
+    form = SendGiftForm(csrf=csrf, room_id=room_id, ruid=ruid, gift_id=gift_id)
+    async_form = SendGiftForm(
+        csrf=csrf, room_id=room_id, ruid=ruid, gift_id=gift_id,
+        headers={**async_headers, "Content-Type": FORM_CONTENT_TYPE},
+    )
+
+    def dict_payload(index):
+        # What each send did before: env lookup, a fresh 11-field dict.
+        str(os.getenv("BILI_GIFTSEND_PREFER_BAG", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
+        return sendgift_payload(csrf=csrf, room_id=room_id, ruid=ruid, gift_id=gift_id, num=index % 9 + 1, bag_id=index % 3)
+
+    cases = (
+        ("requests, dict payload", lambda i: session.prepare_request(requests.Request("POST", url, data=dict_payload(i)))),
+        ("requests, compiled form", lambda i: session.prepare_request(
+            requests.Request("POST", url, data=form.post(i % 9 + 1, i % 3).body, headers=form.headers))),
+        ("httpx, dict payload", lambda i: httpx.Request("POST", url, data=dict_payload(i), headers=async_headers)),
+        ("httpx, compiled form", lambda i: httpx.Request(
+            "POST", url, content=async_form.post(i % 9 + 1, i % 3).body, headers=async_form.headers)),
+        ("body only, dict + urlencode", lambda i: urllib.parse.urlencode(dict_payload(i)).encode()),
+        ("body only, compiled form", lambda i: form.post(i % 9 + 1, i % 3).body),
+    )
+    for label, build in cases:
+        for index in range(1000):
+            build(index)
+        started = time.process_time()
+        for index in range(args.sends):
+            build(index)
+        per_send_us = (time.process_time() - started) / args.sends * 1e6
+        print(f"[{label}] {args.sends} sends: {per_send_us:.2f} us CPU per send")
+
+
+def bench_dns(args):
+    """New-connection GETs to a stand-in host whose lookups are usually fast, sometimes slow."""
+    import requests
+    from urllib3.util import connection as urllib3_connection
+
+    provider, provider_url = start_stand_in_provider(0)
+    port = urllib.parse.urlsplit(provider_url).port
+    url = f"http://provider.bench:{port}/room/v1/Room/get_info?room_id=1"
+    original = urllib3_connection.create_connection
+    rng = random.Random(7)
+    lookups = {"count": 0}
+
+    def lookup_delay():
+        lookups["count"] += 1
+        slow = rng.random() < args.slow_fraction
+        time.sleep((args.slow_resolve_ms if slow else args.resolve_ms) / 1000.0)
+
+    def stand_in_resolver(answer, answers=None):
+        served = {"count": 0}
+
+        def resolve(host, port_, *rest):
+            lookup_delay()
+            if answers is not None and served["count"] >= answers:
+                raise socket.gaierror("resolver down")
+            served["count"] += 1
+            return [info for ip in answer for info in socket.getaddrinfo(ip, port_, *rest)]
+        return resolve
+
+    def system_path(address, *rest, **kwargs):
+        # What urllib3 does today: a blocking lookup for every new connection.
+        lookup_delay()
+        return original(("127.0.0.1", address[1]), *rest, **kwargs)
+
+    def run(label, count):
+        samples, failures = [], 0
+        for _ in range(count):
+            time.sleep(args.spacing_ms / 1000.0)
+            started = time.perf_counter()
+            try:
+                requests.get(url, headers={"Connection": "close"}, timeout=5).raise_for_status()
+            except requests.RequestException:
+                failures += 1
+                continue
+            samples.append(time.perf_counter() - started)
+        summarize_ms(f"[{label}] {count} new connections, {failures} failed", samples)
+
+    try:
+        urllib3_connection.create_connection = system_path
+        lookups["count"] = 0
+        run("system resolver", args.requests)
+        print(f"[system resolver] lookups on the send path: {lookups['count']}")
+
+        scenarios = (
+            ("pinned", ["127.0.0.1"], None),
+            ("pinned, first address dead", ["127.0.0.2", "127.0.0.1"], None),
+            ("pinned, resolver down after start", ["127.0.0.1"], 1),
+        )
+        for label, answer, answers in scenarios:
+            cache = DnsCache(["provider.bench"], ttl=args.ttl, resolver=stand_in_resolver(answer, answers))
+            cache.refresh("provider.bench")
+            urllib3_connection.create_connection = original
+            install_urllib3(cache)
+            cache.start()
+            run(label, args.requests)
+            host = cache.stats()["hosts"]["provider.bench"]
+            print(f"[{label}] resolutions {host['resolutions']} (failed {host['resolve_failures']}, "
+                  f"p50 {host['resolve_ms_p50']}ms max {host['resolve_ms_max']}ms, off the send path), "
+                  f"hits {host['hits']} stale {host['stale_hits']} misses {host['misses']}, "
+                  f"connect failures {host['connect_failures']} failovers {host['failovers']}, order {host['addresses']}")
+    finally:
+        urllib3_connection.create_connection = original
+        provider.shutdown()
+
+
+def bench_timeouts(args):
+    """sendGift outcomes and stuck time with the fixed (1.2, 3.0) timeouts vs adaptive ones."""
+    provider, provider_url = start_stand_in_provider(0)
+    # Replies to sends threeserver already gave up on hit a closed socket.
+    provider.handle_error = lambda *_: None
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True}
+    scenarios = {
+        # Slow network: most sends take 0.8-1.6 s, a tail goes past the fixed 3 s read timeout.
+        "slow": lambda rng: rng.uniform(3.2, 4.0) if rng.random() < args.tail_fraction else rng.uniform(0.8, 1.6),
+        # Healthy network where now and then a socket never answers.
+        "dead sockets": lambda rng: 30.0 if rng.random() < args.dead_fraction else rng.uniform(0.02, 0.05),
+    }
+    for name, sample in scenarios.items():
+        for adaptive in ("0", "1"):
+            rng = random.Random(11)
+            lock = threading.Lock()
+
+            def sampler():
+                with lock:
+                    return sample(rng)
+
+            StandInProvider.latency_sampler = sampler
+            label = f"{name}, {'adaptive' if adaptive == '1' else 'fixed'}"
+            with tempfile.TemporaryDirectory() as workdir:
+                process, base = start_threeserver(
+                    "http", provider_url, workdir, token, args.clients, {"BILI_ADAPTIVE_TIMEOUTS": adaptive},
+                )
+                try:
+                    with ThreadPoolExecutor(args.clients) as clients:
+                        outcomes = list(clients.map(lambda _: post_send(base, token, payload), range(args.requests)))
+                    latency = (fetch_health(base, token).get("latency") or {}).get("endpoints", {}).get("sendGift") or {}
+                finally:
+                    process.terminate()
+                    process.wait(timeout=5)
+            failed = [seconds for ok, seconds in outcomes if not ok]
+            print(f"[{label}] {args.requests} sends: {len(failed)} outcome_uncertain, "
+                  f"stuck {sum(failed):.1f}s in failed sends (mean {statistics.mean(failed) if failed else 0.0:.2f}s), "
+                  f"sendGift p99 {latency.get('p99_ms')}ms, recent timeouts {latency.get('recent_timeouts')}")
+            summarize_ms(f"[{label}] /send", [seconds for _, seconds in outcomes])
+    StandInProvider.latency_sampler = None
+    provider.shutdown()
+
+
+def bench_hedge(args):
+    """Sequential bag_list reads, as a PK worker polls, against a provider that sometimes stalls."""
+    import requests
+
+    provider, provider_url = start_stand_in_provider(0)
+    provider.handle_error = lambda *_: None
+    url = f"{provider_url}/xlive/revenue/v1/gift/bag_list?room_id=1"
+    for enabled in (False, True):
+        rng = random.Random(5)
+        lock = threading.Lock()
+
+        def sampler():
+            with lock:
+                stalled = rng.random() < args.stall_fraction
+                return args.stall_ms / 1000.0 if stalled else rng.uniform(0.02, 0.04)
+
+        StandInProvider.get_latency_sampler = sampler
+        StandInProvider.bag_gets = 0
+        tracker = LatencyTracker(timeout_errors=(requests.Timeout,))
+        hedger = Hedger(tracker.p95, enabled=enabled, budget_ratio=args.budget)
+        session = requests.Session()
+
+        def attempt():
+            with tracker.timing("bag_list"):
+                return session.get(url, timeout=tracker.timeout("bag_list", 5))
+
+        samples = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            hedger.call("bag_list", attempt).raise_for_status()
+            samples.append(time.perf_counter() - started)
+        label = "hedged" if enabled else "plain"
+        summarize_ms(f"[{label}] {args.requests} reads, {args.stall_fraction:.0%} stall {args.stall_ms:.0f}ms", samples)
+        stats = hedger.stats()
+        print(f"[{label}] provider GETs {StandInProvider.bag_gets} ({StandInProvider.bag_gets / args.requests - 1:+.1%}), "
+              f"hedged {stats['hedged']} won {stats['hedge_wins']} budget denied {stats['budget_denied']}")
+    StandInProvider.get_latency_sampler = None
+    provider.shutdown()
+
+
+def blackhole_listener():
+    """A port that accepts no more connections: new connects hang until their timeout."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(0)
+    # Fill the accept queue; later SYNs are dropped.
+    fillers = []
+    for _ in range(4):
+        filler = socket.socket()
+        filler.setblocking(False)
+        filler.connect_ex(server.getsockname())
+        fillers.append(filler)
+    return server, fillers
+
+
+def bench_breaker(args):
+    """A burst of queued sends against a provider that stopped accepting connections, then recovery."""
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True}
+    for enabled in ("0", "1"):
+        label = "breaker" if enabled == "1" else "no breaker"
+        server, fillers = blackhole_listener()
+        port = server.getsockname()[1]
+        with tempfile.TemporaryDirectory() as workdir:
+            # The room's ruid is already known (room cache), as after any earlier send.
+            RoomMetaCache(os.path.join(workdir, "BiliPKTool", "cache", "rooms", "loopback")).store("1", {"uid": 1})
+            process, base = start_threeserver(
+                "http", f"http://127.0.0.1:{port}", workdir, token, args.concurrency,
+                {"BILI_BREAKER": enabled, "BILI_GIFTSEND_PREFER_BAG": "0", "BILI_BREAKER_COOLDOWN_SECONDS": str(args.cooldown)},
+            )
+            try:
+                started = time.perf_counter()
+
+                def send_one(_):
+                    request = urllib.request.Request(
+                        base + "/send", data=json.dumps(payload).encode("utf-8"), method="POST",
+                        headers={"Content-Type": "application/json", "X-Local-Sender-Token": token},
+                    )
+                    try:
+                        with urllib.request.urlopen(request, timeout=30) as response:
+                            body = json.loads(response.read())
+                    except urllib.error.HTTPError as error:
+                        body = json.loads(error.read())
+                    return body, time.perf_counter() - started
+
+                with ThreadPoolExecutor(args.requests) as clients:
+                    answers = list(clients.map(send_one, range(args.requests)))
+                outcomes = {}
+                for body, _ in answers:
+                    key = "provider_unavailable" if body.get("status") == "provider_unavailable" else (
+                        "outcome_uncertain" if body.get("outcome_uncertain") else str(body.get("status") or body.get("error")))
+                    outcomes[key] = outcomes.get(key, 0) + 1
+                print(f"[{label}] {args.requests} queued sends, provider not accepting connections: "
+                      f"all answered after {max(seconds for _, seconds in answers):.2f}s, {outcomes}")
+                summarize_ms(f"[{label}] /send", [seconds for _, seconds in answers])
+
+                # The provider comes back on the same port.
+                for filler in fillers:
+                    filler.close()
+                server.close()
+                StandInProvider.latency_s = 0.0
+                provider = ThreadingHTTPServer(("127.0.0.1", port), StandInProvider)
+                provider.daemon_threads = True
+                threading.Thread(target=provider.serve_forever, daemon=True).start()
+                back = time.perf_counter()
+                attempts = 0
+                while True:
+                    attempts += 1
+                    body, _ = send_one(None)
+                    if body.get("success"):
+                        break
+                    time.sleep(0.1)
+                breakers = fetch_health(base, token).get("breakers") or {}
+                print(f"[{label}] provider back: first success after {time.perf_counter() - back:.2f}s "
+                      f"({attempts} tries), sendGift breaker {json.dumps((breakers.get('endpoints') or {}).get('sendGift'))}")
+                provider.shutdown()
+                provider.server_close()
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+
+
+def bench_danmaku(args):
+    """Danmaku delivery delay while a gift burst keeps the send queue busy."""
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    StandInProvider.danmaku_latency_s = args.danmaku_latency_ms / 1000.0
+    token = "b" * 40
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True}
+    for backend in args.backends:
+        with tempfile.TemporaryDirectory() as workdir:
+            process, base = start_threeserver(
+                backend, provider_url, workdir, token, args.concurrency, {"BILI_GIFTSEND_PREFER_BAG": "0"},
+            )
+            try:
+                stop = threading.Event()
+                gift_latencies = []
+
+                def gift_client():
+                    while not stop.is_set():
+                        try:
+                            gift_latencies.append(post_send(base, token, payload)[1])
+                        except Exception:
+                            pass
+
+                clients = [threading.Thread(target=gift_client, daemon=True) for _ in range(args.clients)]
+                for client in clients:
+                    client.start()
+                time.sleep(0.5)
+                posted = {}
+                refused = 0
+                for index in range(args.messages):
+                    text = f"{backend}-{index}"
+                    request = urllib.request.Request(
+                        base + "/danmaku", data=json.dumps({"text": text}).encode("utf-8"), method="POST",
+                        headers={"Content-Type": "application/json", "X-Local-Sender-Token": token},
+                    )
+                    posted_at = time.perf_counter()
+                    try:
+                        urllib.request.urlopen(request, timeout=10).read()
+                        posted[text] = posted_at
+                    except urllib.error.HTTPError:
+                        refused += 1
+                    time.sleep(args.spacing_s)
+                time.sleep(2.0)
+                stop.set()
+                for client in clients:
+                    client.join(timeout=10)
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+        arrivals = StandInProvider.danmaku_arrivals
+        delays = [arrivals[text] - posted_at for text, posted_at in posted.items() if text in arrivals]
+        print(f"[{backend}] {len(delays)}/{args.messages} danmaku delivered, {refused} refused with 503, "
+              f"during a {args.clients}-client gift burst ({len(gift_latencies)} gift sends)")
+        summarize_ms(f"[{backend}] /danmaku -> provider", delays)
+        summarize_ms(f"[{backend}] /send during the burst", gift_latencies)
+    provider.shutdown()
+
+
+def provider_order_plan(bag_items, gift_id, count):
+    """The pre-planner walk: every matching bag entry in provider order, rescanned per gift."""
+    plan = []
+    remaining = count
+    for item in bag_items:
+        if remaining <= 0:
+            break
+        if str(item.get("gift_id")) != str(gift_id):
+            continue
+        gift_num = int(item.get("gift_num") or 0)
+        if gift_num <= 0:
+            continue
+        n = min(remaining, gift_num)
+        plan.append((str(item["bag_id"]), n))
+        remaining -= n
+    return plan
+
+
+def bench_planner(args):
+    """sendGift calls and planning time per batch: provider-order walk vs the bag planner."""
+    rng = random.Random(7)
+    gift_ids = [str(31000 + index) for index in range(args.gift_kinds)]
+    cases = []
+    for _ in range(args.batches):
+        # Small stacks from daily tasks next to a few big ones, like a real bag.
+        bag = [
+            {"gift_id": int(rng.choice(gift_ids)), "bag_id": index + 1,
+             "gift_num": rng.choice((1, 1, 2, 3, 5, 10, 50, 100)), "expire_at": rng.choice((0, 1000, 2000, 3000))}
+            for index in range(args.stacks)
+        ]
+        batch = [(rng.choice(gift_ids), rng.randint(1, args.max_count)) for _ in range(args.batch_size)]
+        cases.append((bag, batch))
+
+    for label in ("provider order", "planner"):
+        calls = 0
+        started = time.perf_counter()
+        for bag, batch in cases:
+            if label == "planner":
+                plans = plan_bag_sends(bag, batch)
+            else:
+                plans = [provider_order_plan(bag, gift_id, count) for gift_id, count in batch]
+            for (gift_id, count), plan in zip(batch, plans):
+                covered = sum(n for _bag_id, n in plan)
+                calls += len(plan) + (1 if covered < count else 0)
+        elapsed = time.perf_counter() - started
+        print(f"[{label}] {args.batches} batches of {args.batch_size} gifts, {args.stacks} bag stacks: "
+              f"{calls / args.batches:.2f} sendGift calls per batch, {elapsed / args.batches * 1e6:.1f}us planning per batch")
+
+
+def thread_count(pid):
+    with open(f"/proc/{pid}/status", encoding="ascii") as handle:
+        for line in handle:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+def waiting_app(delay_s):
+    """A WSGI app whose every request waits ``delay_s`` for a producer thread, like /send with wait=true."""
+    pending = []
+    lock = threading.Condition()
+
+    def producer():
+        while True:
+            with lock:
+                while not pending:
+                    lock.wait()
+                due, event = pending[0]
+                if due > time.monotonic():
+                    lock.wait(due - time.monotonic())
+                    continue
+                pending.pop(0)
+            event.set()
+
+    threading.Thread(target=producer, daemon=True).start()
+
+    def app(environ, start_response):
+        parking = environ.get(PARKING_ENVIRON_KEY)
+        event = parking.event() if parking is not None else threading.Event()
+        with lock:
+            pending.append((time.monotonic() + delay_s, event))
+            lock.notify()
+        body = b'{"success": true}'
+        if parking is not None:
+            parking.defer(delay_s + 10, lambda completed: ({"success": completed}, 200))
+        elif not event.wait(delay_s + 10):
+            body = b'{"success": false}'
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    return app
+
+
+async def waiting_clients(port, count):
+    """``count`` simultaneous POSTs from one thread; (ok, seconds) per request."""
+    request = (b"POST /wait HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+               b"Content-Length: 2\r\nConnection: close\r\n\r\n{}")
+
+    async def one():
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), 30)
+            writer.write(request)
+            response = await asyncio.wait_for(reader.read(), 30)
+            writer.close()
+            return b'"success": true' in response, time.perf_counter() - started
+        except Exception:
+            return False, time.perf_counter() - started
+
+    return await asyncio.gather(*(one() for _ in range(count)))
+
+
+def bench_serving(args):
+    """Hundreds of simultaneous waiting /send calls: Flask dev server vs the event-loop server."""
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    # The serving layer alone: requests that only wait, so nothing but the
+    # server decides how many can wait at once.
+    for server in args.servers:
+        app = waiting_app(args.provider_latency_ms / 1000.0)
+        if server == "async":
+            front = EventLoopServer(app, max_connections=args.layer_waiters + 10, max_waiting=args.layer_waiters)
+            front.start()
+            port = front.port
+        else:
+            # What app.run() builds: one thread per request.
+            front = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=front.serve_forever, daemon=True).start()
+            port = front.server_port
+        threads_idle = threading.active_count()
+        peak = [threads_idle]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.is_set():
+                peak[0] = max(peak[0], threading.active_count())
+                time.sleep(0.01)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        wall_start = time.perf_counter()
+        outcomes = asyncio.run(waiting_clients(port, args.layer_waiters))
+        wall = time.perf_counter() - wall_start
+        stop.set()
+        sampler.join()
+        if server == "async":
+            front.stop()
+        else:
+            front.shutdown()
+        ok = sum(1 for success, _ in outcomes if success)
+        print(f"[{server} layer] {args.layer_waiters} simultaneous requests waiting {args.provider_latency_ms:.0f}ms: "
+              f"ok={ok} failed={len(outcomes) - ok} in {wall:.2f}s, threads {threads_idle} idle -> peak {peak[0] - 1}")
+        summarize_ms(f"[{server} layer] latency", [seconds for success, seconds in outcomes if success])
+
+    # The whole sender: threeserver's own admission limits apply.
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "b" * 40
+    account_ids = [f"creator{index:03d}" for index in range(args.accounts)]
+    for server in args.servers:
+        with tempfile.TemporaryDirectory() as workdir:
+            accounts_dir = os.path.join(workdir, "accounts")
+            os.makedirs(accounts_dir)
+            for account_id in account_ids:
+                path = os.path.join(accounts_dir, f"{account_id}.txt")
+                with open(path, "w", encoding="utf-8") as handle:
+                    handle.write(f"SESSDATA\t{account_id}\nbili_jct\tcsrf-{account_id}\n")
+                os.chmod(path, 0o600)
+            # Coalescing (with the widest batch window) lets every waiting
+            # request be in flight at once, and the delay target is raised,
+            # so the wait is on the provider rather than on admission.
+            process, base = start_threeserver(
+                args.backend, provider_url, workdir, token, args.concurrency,
+                {"THREESERVER_SERVER": server, "THREESERVER_ACCOUNTS_DIR": accounts_dir, "THREESERVER_COALESCE": "1",
+                 "THREESERVER_BATCH_WINDOW_MS": "50", "THREESERVER_QUEUE_TARGET_MS": "10000"},
+            )
+            try:
+                threads_idle = thread_count(process.pid)
+                peak = {"threads": threads_idle, "rss": rss_mb(process.pid)}
+                stop = threading.Event()
+
+                def sample():
+                    while not stop.is_set():
+                        try:
+                            peak["threads"] = max(peak["threads"], thread_count(process.pid))
+                            peak["rss"] = max(peak["rss"], rss_mb(process.pid))
+                        except OSError:
+                            return
+                        time.sleep(0.02)
+
+                sampler = threading.Thread(target=sample, daemon=True)
+                sampler.start()
+                start = threading.Barrier(args.waiters)
+
+                def send(index):
+                    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": True,
+                               "account": account_ids[index % len(account_ids)]}
+                    start.wait()
+                    try:
+                        return post_send_status(base, token, payload)
+                    except Exception as error:
+                        return 0, {"error": type(error).__name__}, 0.0
+
+                wall_start = time.perf_counter()
+                with ThreadPoolExecutor(args.waiters) as clients:
+                    outcomes = list(clients.map(send, range(args.waiters)))
+                wall = time.perf_counter() - wall_start
+                stop.set()
+                sampler.join()
+                serving = fetch_health(base, token).get("serving") or {}
+            finally:
+                process.terminate()
+                process.wait(timeout=5)
+        ok = sum(1 for status, body, _ in outcomes if status == 200 and body.get("success") is True)
+        errors = {}
+        for status, body, _ in outcomes:
+            if not (status == 200 and body.get("success") is True):
+                key = f"{status} {body.get('error') or body.get('status')}"
+                errors[key] = errors.get(key, 0) + 1
+        print(f"[{server}] {args.waiters} simultaneous waiting /send, provider {args.provider_latency_ms:.0f}ms: "
+              f"ok={ok} other={errors or 0} in {wall:.2f}s")
+        print(f"[{server}] server threads idle {threads_idle}, peak {peak['threads']}; peak RSS {peak['rss']:.1f} MB"
+              + (f"; peak parked {serving.get('peak_waiting')}, peak connections {serving.get('peak_connections')}"
+                 if serving.get("server") == "event_loop" else ""))
+        summarize_ms(f"[{server}] /send", [seconds for status, _, seconds in outcomes if status])
+    provider.shutdown()
+
+
+def bench_events(args):
+    """Completion notice for wait=false sends: polling /result/<id> vs one /events stream."""
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "e" * 40
+    headers = {"X-Local-Sender-Token": token}
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": False}
+    for server in args.servers:
+        for client in ("poll", "stream"):
+            with tempfile.TemporaryDirectory() as workdir:
+                process, base = start_threeserver("http", provider_url, workdir, token, 8, {"THREESERVER_SERVER": server})
+                port = int(base.rsplit(":", 1)[1])
+                pending, notices = {}, []
+                lock = threading.Lock()
+                sent_all = threading.Event()
+                lookups = [0]
+
+                def notice(request_id, status):
+                    with lock:
+                        if request_id in pending and status.get("status") not in ("queued", "sending"):
+                            pending.pop(request_id)
+                            notices.append(time.time() - status["done_ts"])
+
+                def poller():
+                    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+                    while not (sent_all.is_set() and not pending):
+                        with lock:
+                            request_ids = list(pending)
+                        for request_id in request_ids:
+                            connection.request("GET", f"/result/{request_id}", headers=headers)
+                            notice(request_id, json.loads(connection.getresponse().read()))
+                            lookups[0] += 1
+                        time.sleep(args.poll_ms / 1000.0)
+                    connection.close()
+
+                def streamer(subscribed):
+                    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                    connection.request("GET", "/events?timeout=60", headers=headers)
+                    response = connection.getresponse()
+                    lookups[0] += 1
+                    subscribed.set()
+                    event = None
+                    while not (sent_all.is_set() and not pending):
+                        line = response.readline().decode("utf-8").rstrip("\n")
+                        if not line:
+                            continue
+                        if line.startswith("event: "):
+                            event = line[7:]
+                        elif line.startswith("data: ") and event == "status":
+                            status = json.loads(line[6:])
+                            notice(status["request_id"], status)
+                    connection.close()
+
+                try:
+                    if client == "poll":
+                        reader = threading.Thread(target=poller, daemon=True)
+                    else:
+                        subscribed = threading.Event()
+                        reader = threading.Thread(target=streamer, args=(subscribed,), daemon=True)
+                    reader.start()
+                    if client == "stream":
+                        subscribed.wait(5)
+                    for _ in range(args.requests):
+                        status, body, _ = post_send_status(base, token, payload)
+                        if status == 202:
+                            with lock:
+                                pending[body["request_id"]] = True
+                        time.sleep(args.gap_ms / 1000.0)
+                    sent_all.set()
+                    reader.join(timeout=60)
+                finally:
+                    process.terminate()
+                    process.wait(timeout=5)
+            print(f"[{server} {client}] {len(notices)}/{args.requests} completions noticed, "
+                  f"{lookups[0]} status requests" + (f" ({args.poll_ms:.0f}ms poll)" if client == "poll" else ""))
+            summarize_ms(f"[{server} {client}] done -> noticed", notices)
+    provider.shutdown()
+
+
+def bench_results(args):
+    """Reconciling a burst: one GET /result/<id> per request vs one POST /results."""
+    provider, provider_url = start_stand_in_provider(args.provider_latency_ms)
+    token = "r" * 40
+    headers = {"X-Local-Sender-Token": token, "Content-Type": "application/json"}
+    payload = {"gifts": [{"id": "31036", "count": 1}], "wait": False}
+    with tempfile.TemporaryDirectory() as workdir:
+        process, base = start_threeserver("http", provider_url, workdir, token, 8)
+        port = int(base.rsplit(":", 1)[1])
+        try:
+            request_ids = []
+            while len(request_ids) < args.requests:
+                status, body, _ = post_send_status(base, token, payload)
+                if status == 202:
+                    request_ids.append(body["request_id"])
+                else:
+                    time.sleep(0.05)
+            time.sleep(1.0)
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            per_id, batched = [], []
+            for _ in range(args.rounds):
+                started = time.perf_counter()
+                for request_id in request_ids:
+                    connection.request("GET", f"/result/{request_id}", headers=headers)
+                    json.loads(connection.getresponse().read())
+                per_id.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                connection.request("POST", "/results", body=json.dumps({"request_ids": request_ids}), headers=headers)
+                answer = json.loads(connection.getresponse().read())
+                batched.append(time.perf_counter() - started)
+            connection.close()
+        finally:
+            process.terminate()
+            process.wait(timeout=5)
+    done = sum(1 for item in answer["results"] if item.get("status") == "done")
+    print(f"[reconcile] {len(request_ids)} requests ({done} done), {args.rounds} rounds over one keep-alive connection")
+    summarize_ms(f"[per-id] {len(request_ids)} x GET /result", per_id)
+    summarize_ms("[batch] 1 x POST /results", batched)
+    provider.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    queue_parser = commands.add_parser("queue", help="idle CPU and wake latency of the send queue")
+    queue_parser.add_argument("--idle-seconds", type=float, default=3.0)
+    queue_parser.add_argument("--samples", type=int, default=500)
+    queue_parser.set_defaults(handler=bench_queue)
+    backends_parser = commands.add_parser("backends", help="/send throughput and latency per backend against a stand-in provider")
+    backends_parser.add_argument("--backends", nargs="+", default=["http", "async"])
+    backends_parser.add_argument("--requests", type=int, default=400)
+    backends_parser.add_argument("--clients", type=int, default=32)
+    backends_parser.add_argument("--concurrency", type=int, default=4)
+    backends_parser.add_argument("--provider-latency-ms", type=float, default=40.0)
+    backends_parser.set_defaults(handler=bench_backends)
+    status_parser = commands.add_parser("status", help="/send admission cost of the request status store")
+    status_parser.add_argument("--fill", type=int, nargs="+", default=[0, 1000, 5000])
+    status_parser.add_argument("--samples", type=int, default=2000)
+    status_parser.set_defaults(handler=bench_status)
+    journal_parser = commands.add_parser("journal", help="send journal overhead and restart recovery time")
+    journal_parser.add_argument("--requests", type=int, default=5000)
+    journal_parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    journal_parser.add_argument("--recovery-entries", type=int, default=100000)
+    journal_parser.set_defaults(handler=bench_journal)
+    coalesce_parser = commands.add_parser("coalesce", help="provider calls and latency for same-gift bursts")
+    coalesce_parser.add_argument("--bursts", type=int, default=20)
+    coalesce_parser.add_argument("--burst", type=int, default=20)
+    coalesce_parser.add_argument("--concurrency", type=int, default=4)
+    coalesce_parser.add_argument("--provider-latency-ms", type=float, default=40.0)
+    coalesce_parser.set_defaults(handler=bench_coalesce)
+    window_parser = commands.add_parser("window", help="adaptive batch window: idle vs Poisson load, coalescing on")
+    window_parser.add_argument("--windows", type=float, nargs="+", default=[0.0, 5.0])
+    window_parser.add_argument("--rate", type=float, default=150.0)
+    window_parser.add_argument("--requests", type=int, default=600)
+    window_parser.add_argument("--idle-requests", type=int, default=40)
+    window_parser.add_argument("--concurrency", type=int, default=4)
+    window_parser.add_argument("--provider-latency-ms", type=float, default=40.0)
+    window_parser.set_defaults(handler=bench_window)
+    admission_parser = commands.add_parser("admission", help="depth-only vs delay-based admission under overload")
+    admission_parser.add_argument("--rate", type=float, default=40.0)
+    admission_parser.add_argument("--seconds", type=float, default=15.0)
+    admission_parser.add_argument("--deadline-s", type=float, default=3.0)
+    admission_parser.add_argument("--target-ms", type=float, default=500.0)
+    admission_parser.add_argument("--interval-ms", type=float, default=500.0)
+    admission_parser.add_argument("--concurrency", type=int, default=1)
+    admission_parser.add_argument("--provider-latency-ms", type=float, default=100.0)
+    admission_parser.set_defaults(handler=bench_admission)
+    rooms_parser = commands.add_parser("rooms", help="N rooms: one process per room vs one sharded process")
+    rooms_parser.add_argument("--rooms", type=int, default=4)
+    rooms_parser.add_argument("--requests", type=int, default=200)
+    rooms_parser.add_argument("--clients", type=int, default=8)
+    rooms_parser.add_argument("--concurrency", type=int, default=4)
+    rooms_parser.add_argument("--provider-latency-ms", type=float, default=40.0)
+    rooms_parser.set_defaults(handler=bench_rooms)
+    accounts_parser = commands.add_parser("accounts", help="many accounts in one process: isolation, memory, eviction")
+    accounts_parser.add_argument("--backends", nargs="+", default=["http", "async"])
+    accounts_parser.add_argument("--accounts", type=int, default=40)
+    accounts_parser.add_argument("--requests", type=int, default=10)
+    accounts_parser.add_argument("--clients", type=int, default=32)
+    accounts_parser.add_argument("--concurrency", type=int, default=8)
+    accounts_parser.add_argument("--idle-seconds", type=float, default=10.0)
+    accounts_parser.add_argument("--provider-latency-ms", type=float, default=40.0)
+    accounts_parser.set_defaults(handler=bench_accounts)
+    warmup_parser = commands.add_parser("warmup", help="first /send latency after startup, warm-up off vs on")
+    warmup_parser.add_argument("--backends", nargs="+", default=["http", "async"])
+    warmup_parser.add_argument("--runs", type=int, default=5)
+    warmup_parser.add_argument("--idle-s", type=float, default=0.5)
+    warmup_parser.add_argument("--connect-latency-ms", type=float, default=60.0)
+    warmup_parser.add_argument("--get-latency-ms", type=float, default=40.0)
+    warmup_parser.add_argument("--provider-latency-ms", type=float, default=40.0)
+    warmup_parser.set_defaults(handler=bench_warmup)
+    bag_parser = commands.add_parser("bag", help="/send latency and bag accounting with an expiring bag cache")
+    bag_parser.add_argument("--backends", nargs="+", default=["http", "async"])
+    bag_parser.add_argument("--requests", type=int, default=200)
+    bag_parser.add_argument("--stock", type=int, default=150)
+    bag_parser.add_argument("--ttl", type=float, default=0.2)
+    bag_parser.add_argument("--spacing-ms", type=float, default=50.0)
+    bag_parser.add_argument("--get-latency-ms", type=float, default=40.0)
+    bag_parser.add_argument("--provider-latency-ms", type=float, default=20.0)
+    bag_parser.set_defaults(handler=bench_bag)
+    roommeta_parser = commands.add_parser("roommeta", help="Room/get_info calls per PK with and without the shared room cache")
+    roommeta_parser.add_argument("--cycles", type=int, default=20)
+    roommeta_parser.add_argument("--pk-interval-s", type=float, default=300.0)
+    roommeta_parser.add_argument("--get-latency-ms", type=float, default=60.0)
+    roommeta_parser.set_defaults(handler=bench_roommeta)
+    payload_parser = commands.add_parser("payload", help="per-send CPU to build the sendGift request, dict vs compiled form")
+    payload_parser.add_argument("--sends", type=int, default=50000)
+    payload_parser.set_defaults(handler=bench_payload)
+    dns_parser = commands.add_parser("dns", help="new-connection latency: system resolver vs pinned DNS cache")
+    dns_parser.add_argument("--requests", type=int, default=400)
+    dns_parser.add_argument("--resolve-ms", type=float, default=2.0)
+    dns_parser.add_argument("--slow-resolve-ms", type=float, default=300.0)
+    dns_parser.add_argument("--slow-fraction", type=float, default=0.05)
+    dns_parser.add_argument("--ttl", type=float, default=1.0)
+    dns_parser.add_argument("--spacing-ms", type=float, default=5.0)
+    dns_parser.set_defaults(handler=bench_dns)
+    timeouts_parser = commands.add_parser("timeouts", help="sendGift timeouts: fixed vs derived from observed latency")
+    timeouts_parser.add_argument("--requests", type=int, default=400)
+    timeouts_parser.add_argument("--clients", type=int, default=16)
+    timeouts_parser.add_argument("--tail-fraction", type=float, default=0.03)
+    timeouts_parser.add_argument("--dead-fraction", type=float, default=0.02)
+    timeouts_parser.set_defaults(handler=bench_timeouts)
+    hedge_parser = commands.add_parser("hedge", help="read tail latency with and without hedging past the p95")
+    hedge_parser.add_argument("--requests", type=int, default=500)
+    hedge_parser.add_argument("--stall-fraction", type=float, default=0.03)
+    hedge_parser.add_argument("--stall-ms", type=float, default=1000.0)
+    hedge_parser.add_argument("--budget", type=float, default=0.1)
+    hedge_parser.set_defaults(handler=bench_hedge)
+    breaker_parser = commands.add_parser("breaker", help="queued sends against an unreachable provider, with and without breakers")
+    breaker_parser.add_argument("--requests", type=int, default=24)
+    breaker_parser.add_argument("--concurrency", type=int, default=4)
+    breaker_parser.add_argument("--cooldown", type=float, default=2.0)
+    breaker_parser.set_defaults(handler=bench_breaker)
+    danmaku_parser = commands.add_parser("danmaku", help="danmaku delivery delay during a gift burst")
+    danmaku_parser.add_argument("--backends", nargs="+", default=["http", "async"])
+    danmaku_parser.add_argument("--messages", type=int, default=10)
+    danmaku_parser.add_argument("--spacing-s", type=float, default=1.2)
+    danmaku_parser.add_argument("--clients", type=int, default=32)
+    danmaku_parser.add_argument("--concurrency", type=int, default=4)
+    danmaku_parser.add_argument("--provider-latency-ms", type=float, default=150.0)
+    danmaku_parser.add_argument("--danmaku-latency-ms", type=float, default=30.0)
+    danmaku_parser.set_defaults(handler=bench_danmaku)
+    planner_parser = commands.add_parser("planner", help="sendGift calls per batch: provider-order bag walk vs planner")
+    planner_parser.add_argument("--batches", type=int, default=2000)
+    planner_parser.add_argument("--batch-size", type=int, default=5)
+    planner_parser.add_argument("--stacks", type=int, default=60)
+    planner_parser.add_argument("--gift-kinds", type=int, default=6)
+    planner_parser.add_argument("--max-count", type=int, default=60)
+    planner_parser.set_defaults(handler=bench_planner)
+    serving_parser = commands.add_parser("serving", help="simultaneous waiting /send: Flask dev server vs event-loop server")
+    serving_parser.add_argument("--servers", nargs="+", default=["flask", "async"])
+    serving_parser.add_argument("--backend", default="http")
+    serving_parser.add_argument("--layer-waiters", type=int, default=1000)
+    serving_parser.add_argument("--waiters", type=int, default=500)
+    serving_parser.add_argument("--accounts", type=int, default=8)
+    serving_parser.add_argument("--concurrency", type=int, default=32)
+    serving_parser.add_argument("--provider-latency-ms", type=float, default=2000.0)
+    serving_parser.set_defaults(handler=bench_serving)
+    events_parser = commands.add_parser("events", help="completion notice for wait=false sends: /result polling vs /events stream")
+    events_parser.add_argument("--servers", nargs="+", default=["flask", "async"])
+    events_parser.add_argument("--requests", type=int, default=40)
+    events_parser.add_argument("--gap-ms", type=float, default=25.0)
+    events_parser.add_argument("--poll-ms", type=float, default=100.0)
+    events_parser.add_argument("--provider-latency-ms", type=float, default=200.0)
+    events_parser.set_defaults(handler=bench_events)
+    results_parser = commands.add_parser("results", help="reconciling a burst: per-id GET /result vs one POST /results")
+    results_parser.add_argument("--requests", type=int, default=300)
+    results_parser.add_argument("--rounds", type=int, default=20)
+    results_parser.add_argument("--provider-latency-ms", type=float, default=5.0)
+    results_parser.set_defaults(handler=bench_results)
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+class FakeClock:
+    """可手动拨动的单调时钟：测试里直接改 ``now``。"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
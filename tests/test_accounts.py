@@ -0,0 +1,90 @@
+import threading
+import unittest
+
+from workers.bilibili.accounts import DEFAULT_ACCOUNT, AccountRegistry
+
+from fake_clock import FakeClock
+
+
+def make_registry(clock, known=("alice", "bob", "carol"), **kwargs):
+    paths = {DEFAULT_ACCOUNT: "cookie.txt", **{name: f"{name}.txt" for name in known}}
+    return AccountRegistry(
+        paths.get,
+        lambda path: {"bili_jct": f"csrf-{path}"},
+        lambda account: f"shards-{account.account_id}",
+        clock=clock,
+        **kwargs,
+    )
+
+
+class AccountRegistryTests(unittest.TestCase):
+    def test_accounts_load_once_with_their_own_cookies(self):
+        registry = make_registry(FakeClock())
+        alice = registry.get("alice")
+
+        self.assertIs(registry.get("alice"), alice)
+        self.assertEqual(alice.cookie_kv, {"bili_jct": "csrf-alice.txt"})
+        self.assertEqual(alice.shards, "shards-alice")
+        self.assertEqual(registry.get().account_id, DEFAULT_ACCOUNT)
+        self.assertIsNone(registry.get("mallory"))
+        self.assertIsNone(registry.get("../cookie"))
+
+    def test_queue_quota_is_per_account(self):
+        registry = make_registry(FakeClock(), max_queued=1)
+        alice, bob = registry.get("alice"), registry.get("bob")
+
+        self.assertTrue(registry.admit(alice))
+        self.assertFalse(registry.admit(alice))
+        self.assertTrue(registry.admit(bob))
+        registry.release(alice, [{"success": True}, {"success": False, "outcome_uncertain": True}])
+        self.assertTrue(registry.admit(alice))
+
+        stats = registry.stats()["accounts"]["alice"]
+        self.assertEqual((stats["rejected"], stats["succeeded"], stats["uncertain"]), (1, 1, 1))
+
+    def test_exempt_sends_are_admitted_past_the_quota(self):
+        registry = make_registry(FakeClock(), max_queued=1)
+        alice = registry.get("alice")
+
+        self.assertTrue(registry.admit(alice))
+        self.assertTrue(registry.admit(alice, exempt=True))
+        self.assertFalse(registry.admit(alice))
+        registry.release(alice)
+        registry.release(alice)
+        self.assertTrue(registry.admit(alice))
+
+    def test_idle_accounts_are_evicted_unless_they_have_queued_work(self):
+        clock = FakeClock()
+        registry = make_registry(clock, idle_seconds=60)
+        registry.get()
+        alice, bob = registry.get("alice"), registry.get("bob")
+        registry.admit(bob)
+        clock.now += 61
+
+        self.assertEqual(registry.evict_idle(), 1)
+        self.assertIsNone(registry.peek("alice"))
+        self.assertIs(registry.peek("bob"), bob)
+        self.assertIsNotNone(registry.peek())
+        self.assertIsNot(registry.get("alice"), alice)
+
+    def test_full_registry_evicts_least_recently_used_idle_account(self):
+        registry = make_registry(FakeClock(), max_accounts=2)
+        registry.get("alice")
+        registry.admit(registry.get("bob"))
+
+        self.assertIsNotNone(registry.get("carol"))
+        self.assertIsNone(registry.peek("alice"))
+        # bob has queued work and carol is the only other one: no room left.
+        registry.admit(registry.get("carol"))
+        self.assertIsNone(registry.get("alice"))
+
+    def test_warm_runs_once_in_the_background(self):
+        warmed = threading.Event()
+        registry = make_registry(FakeClock(), warm=lambda account: warmed.set() or True)
+        registry.get("alice")
+
+        self.assertTrue(warmed.wait(timeout=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+from workers.bilibili.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakers, ProviderUnavailable
+
+from fake_clock import FakeClock
+
+
+class Refused(ConnectionError):
+    pass
+
+
+class BreakerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breakers = CircuitBreakers(
+            lambda error: isinstance(error, Refused), failure_threshold=3, cooldown=5, clock=self.clock,
+        )
+
+    def call(self, endpoint="sendGift", error=None):
+        with self.breakers.guard(endpoint):
+            if error is not None:
+                raise error
+
+    def fail(self, times, endpoint="sendGift"):
+        for _ in range(times):
+            with self.assertRaises(Refused):
+                self.call(endpoint, Refused())
+
+    def state(self, endpoint="sendGift"):
+        return self.breakers.stats()["endpoints"][endpoint]["state"]
+
+    def test_opens_after_consecutive_connect_failures_only(self):
+        self.fail(2)
+        with self.assertRaises(TimeoutError):
+            # Connected, then the read timed out: not a connect failure.
+            self.call(error=TimeoutError())
+        self.fail(2)
+        self.assertEqual(self.state(), CLOSED)
+
+        self.fail(1)
+        self.assertEqual(self.state(), OPEN)
+        with self.assertRaises(ProviderUnavailable) as raised:
+            self.call()
+        self.assertEqual(raised.exception.retry_after, 5)
+        self.assertEqual(self.breakers.retry_after("sendGift"), 5)
+        # Other endpoints keep their own breaker.
+        self.call("get_info")
+
+    def test_half_open_lets_one_probe_through_and_recovers(self):
+        self.fail(3)
+        self.clock.now += 5
+        self.assertIsNone(self.breakers.retry_after("sendGift"))
+
+        with self.breakers.guard("sendGift"):
+            self.assertEqual(self.state(), HALF_OPEN)
+            with self.assertRaises(ProviderUnavailable):
+                self.call()
+        self.assertEqual(self.state(), CLOSED)
+        self.call()
+
+    def test_failed_probe_reopens_with_a_longer_cooldown(self):
+        self.fail(3)
+        self.clock.now += 5
+        self.fail(1)
+        stats = self.breakers.stats()["endpoints"]["sendGift"]
+        self.assertEqual((stats["state"], stats["cooldown_seconds"], stats["opens"]), (OPEN, 10, 2))
+
+    def test_disabled_breakers_never_reject(self):
+        breakers = CircuitBreakers(lambda error: True, failure_threshold=1, enabled=False)
+        for _ in range(3):
+            with self.assertRaises(Refused):
+                with breakers.guard("sendGift"):
+                    raise Refused()
+        self.assertIsNone(breakers.retry_after("sendGift"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from workers.bilibili.coalesce import coalesce_requests, group_jobs, split_result
+
+
+class CoalesceTests(unittest.TestCase):
+    def test_same_gift_entries_merge_in_request_order_up_to_cap(self):
+        merged = coalesce_requests([[("1", 40)], [("2", 1), ("1", 50)], [("1", 20)]], 100)
+
+        self.assertEqual([(gift.gift_id, gift.count) for gift in merged], [("1", 90), ("2", 1), ("1", 20)])
+        self.assertEqual([(s.request_index, s.entry_index) for s in merged[0].shares], [(0, 0), (1, 1)])
+
+    def test_requests_in_different_lanes_or_deadlines_never_share_a_job(self):
+        account = object()
+        lane_rank = {"pk": 0, "gift": 1}
+        pk = {"gifts": ["1"], "lane": "pk", "account": account, "deadline": 100.0}
+        gift = {"gifts": ["1"], "lane": "gift", "account": account}
+        later = {"gifts": ["1"], "lane": "gift", "account": account, "deadline": 200.0}
+        same = {"gifts": ["1"], "lane": "gift", "account": account}
+        control = {"danmaku": "hi"}
+
+        jobs = group_jobs([gift, pk, later, control, same], lane_rank, "gift")
+
+        self.assertIs(jobs[0], pk)
+        self.assertEqual(jobs[1], [gift, same])
+        self.assertEqual(jobs[2:], [later, control])
+
+    def test_confirmed_units_are_credited_to_earliest_shares(self):
+        gift = coalesce_requests([[("1", 2)], [("1", 3)]], 100)[0]
+        result = {
+            "id": "1", "count": 5, "success": False, "mode": "split", "outcome_uncertain": False,
+            "parts": [
+                {"count": 2, "success": True, "mode": "bag", "provider_transaction_id": "t1", "outcome_uncertain": False},
+                {"count": 3, "success": False, "mode": "direct", "status_code": 200, "outcome_uncertain": False},
+            ],
+        }
+        first, second = split_result(result, gift)
+
+        self.assertTrue(first["success"])
+        self.assertEqual(first["provider_transaction_id"], "t1")
+        self.assertFalse(second["success"])
+        self.assertEqual(second["sent_count"], 0)
+        self.assertEqual(second["coalesced"], {"requests": 2, "count": 5})
+
+    def test_uncertain_result_marks_every_share_uncertain(self):
+        gift = coalesce_requests([[("1", 1)], [("1", 1)]], 100)[0]
+        shares = split_result({"id": "1", "count": 2, "success": False, "mode": "direct", "outcome_uncertain": True}, gift)
+
+        self.assertTrue(all(share["outcome_uncertain"] and not share["success"] for share in shares))
+
+
+if __name__ == "__main__":
+    unittest.main()
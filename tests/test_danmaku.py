@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+
+from workers.bilibili.danmaku import DanmakuLane
+
+
+class DanmakuLaneTests(unittest.TestCase):
+    def test_messages_go_out_in_order_and_paced(self):
+        sent = []
+        done = threading.Event()
+
+        def send(text):
+            sent.append((text, time.monotonic()))
+            if len(sent) == 3:
+                done.set()
+            return {"success": True}
+
+        lane = DanmakuLane(send, min_interval=0.05, log=lambda line: None)
+        lane.start()
+        for text in ("a", "b", "c"):
+            self.assertTrue(lane.offer(text))
+        self.assertTrue(done.wait(2))
+        lane.close()
+
+        self.assertEqual([text for text, _ in sent], ["a", "b", "c"])
+        gaps = [later - earlier for (_, earlier), (_, later) in zip(sent, sent[1:])]
+        self.assertTrue(all(gap >= 0.045 for gap in gaps), gaps)
+        self.assertEqual(lane.stats()["sent"], 3)
+
+    def test_full_lane_refuses_instead_of_queueing(self):
+        lane = DanmakuLane(lambda text: {"success": True}, max_pending=2, log=lambda line: None)
+        self.assertTrue(lane.offer("a"))
+        self.assertTrue(lane.offer("b"))
+        self.assertFalse(lane.offer("c"))
+        self.assertEqual((len(lane), lane.stats()["dropped"]), (2, 1))
+
+    def test_rate_limited_message_is_retried_once_with_a_longer_interval(self):
+        answers = [{"success": False, "rate_limited": True}, {"success": True}]
+        calls = []
+
+        def send(text):
+            calls.append(text)
+            return answers.pop(0)
+
+        now = [100.0]
+        lane = DanmakuLane(send, min_interval=0.0, log=lambda line: None, clock=lambda: now[0])
+        lane.offer("hi")
+        lane.run_once()
+        self.assertEqual(lane.stats()["interval_seconds"], 0.5)
+        self.assertEqual(len(lane), 1)
+
+        now[0] += 0.5
+        lane.run_once()
+        stats = lane.stats()
+        self.assertEqual(calls, ["hi", "hi"])
+        self.assertEqual((stats["sent"], stats["rate_limited"], stats["interval_seconds"]), (1, 1, 0.0))
+
+    def test_a_failing_send_does_not_stop_the_lane(self):
+        def send(text):
+            if text == "boom":
+                raise ConnectionError
+            return {"success": True}
+
+        lane = DanmakuLane(send, min_interval=0.0, log=lambda line: None)
+        lane.offer("boom")
+        lane.offer("ok")
+        lane.run_once()
+        lane.run_once()
+        stats = lane.stats()
+        self.assertEqual((stats["failed"], stats["sent"], stats["pending"]), (1, 1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import threading
+import unittest
+
+from workers.bilibili.dispatch_pool import PriorityPool
+
+
+class PriorityPoolTests(unittest.TestCase):
+    def test_queued_tasks_run_lowest_priority_value_first(self):
+        pool = PriorityPool(1)
+        release = threading.Event()
+        order = []
+        blocker = pool.submit(1, release.wait)
+        futures = [
+            pool.submit(1, order.append, "wish-1"),
+            pool.submit(1, order.append, "wish-2"),
+            pool.submit(0, order.append, "pk"),
+        ]
+        release.set()
+        for future in [blocker, *futures]:
+            future.result(timeout=2)
+        pool.shutdown()
+
+        self.assertEqual(order, ["pk", "wish-1", "wish-2"])
+
+    def test_concurrency_is_bounded_by_worker_count(self):
+        pool = PriorityPool(2)
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+        release = threading.Event()
+
+        def task():
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            release.wait(timeout=2)
+            with lock:
+                state["running"] -= 1
+
+        futures = [pool.submit(1, task) for _ in range(5)]
+        threading.Timer(0.05, release.set).start()
+        for future in futures:
+            future.result(timeout=2)
+        pool.shutdown()
+
+        self.assertEqual(state["peak"], 2)
+        self.assertEqual(pool.stats()["completed"], 5)
+
+    def test_exceptions_are_delivered_through_the_future(self):
+        pool = PriorityPool(1)
+        future = pool.submit(0, int, "not-a-number")
+        with self.assertRaises(ValueError):
+            future.result(timeout=2)
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
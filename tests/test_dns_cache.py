@@ -0,0 +1,83 @@
+import socket
+import threading
+import unittest
+
+from workers.bilibili.dns_cache import DnsCache
+
+from fake_clock import FakeClock
+
+
+def answer(*ips):
+    return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (ip, 0)) for ip in ips]
+
+
+class DnsCacheTests(unittest.TestCase):
+    def test_addresses_are_kept_and_served_stale_when_refresh_fails(self):
+        clock = FakeClock()
+        replies = [answer("10.0.0.1", "10.0.0.2")]
+
+        def resolver(*_args):
+            if not replies:
+                raise socket.gaierror("resolver down")
+            return replies.pop()
+
+        cache = DnsCache(["API.example.com", "127.0.0.1"], ttl=10, resolver=resolver, clock=clock)
+        self.assertNotIn("127.0.0.1", cache)
+        self.assertIsNone(cache.addresses("api.example.com"))
+        self.assertTrue(cache.refresh("api.example.com"))
+
+        clock.now += 30
+        self.assertFalse(cache.refresh("api.example.com"))
+        pinned = cache.addresses("api.example.com")
+        self.assertEqual([address[3][0] for address in pinned], ["10.0.0.1", "10.0.0.2"])
+
+        stats = cache.stats()["hosts"]["api.example.com"]
+        self.assertTrue(stats["stale"])
+        self.assertEqual((stats["resolutions"], stats["resolve_failures"]), (1, 1))
+        self.assertEqual((stats["misses"], stats["stale_hits"]), (1, 1))
+
+    def test_refresh_due_follows_half_the_ttl(self):
+        clock = FakeClock()
+        calls = []
+        cache = DnsCache(["a.example"], ttl=10, resolver=lambda *args: calls.append(args) or answer("10.0.0.1"), clock=clock)
+
+        self.assertEqual(cache.refresh_due(), 5.0)
+        clock.now += 4
+        cache.refresh_due()
+        clock.now += 1
+        cache.refresh_due()
+        self.assertEqual(len(calls), 2)
+
+    def test_connection_fails_over_and_demotes_the_dead_address(self):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(4)
+        self.addCleanup(server.close)
+        port = server.getsockname()[1]
+        # Nothing listens on 127.0.0.2, so the first address is refused.
+        cache = DnsCache(["provider.test"], resolver=lambda *args: answer("127.0.0.2", "127.0.0.1"))
+        cache.refresh("provider.test")
+
+        for _ in range(2):
+            cache.create_connection(("provider.test", port), 1.0, fallback=None).close()
+
+        stats = cache.stats()["hosts"]["provider.test"]
+        self.assertEqual(stats["addresses"], ["127.0.0.1", "127.0.0.2"])
+        self.assertEqual((stats["connect_failures"], stats["failovers"]), (1, 1))
+
+    def test_unpinned_or_unresolved_hosts_use_the_fallback(self):
+        cache = DnsCache(["provider.test"], resolver=lambda *args: [])
+        calls = []
+        cache.create_connection(("provider.test", 443), 1.0, fallback=lambda *a, **k: calls.append(a[0]))
+        cache.create_connection(("other.test", 443), 1.0, fallback=lambda *a, **k: calls.append(a[0]))
+        self.assertEqual(calls, [("provider.test", 443), ("other.test", 443)])
+
+    def test_background_thread_resolves_on_start(self):
+        resolved = threading.Event()
+        cache = DnsCache(["a.example"], resolver=lambda *args: resolved.set() or answer("10.0.0.1"))
+        cache.start()
+        self.assertTrue(resolved.wait(timeout=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import http.client
+import json
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from workers.bilibili.event_server import PARKING_ENVIRON_KEY, EventLoopServer
+
+
+class EventLoopServerTests(unittest.TestCase):
+    def start(self, app, **kwargs):
+        server = EventLoopServer(app, **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def request(self, server, method="GET", path="/", body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def test_plain_wsgi_responses_pass_through_on_a_kept_alive_connection(self):
+        def app(environ, start_response):
+            body = json.dumps({
+                "path": environ["PATH_INFO"], "query": environ["QUERY_STRING"],
+                "body": environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"])).decode(),
+            }).encode()
+            start_response("201 Created", [("Content-Type", "application/json")])
+            return [body]
+
+        server = self.start(app)
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+        self.addCleanup(connection.close)
+        for index in range(2):
+            connection.request("POST", f"/send?n={index}", body=b'{"a": 1}')
+            response = connection.getresponse()
+            self.assertEqual(response.status, 201)
+            self.assertEqual(json.loads(response.read()), {"path": "/send", "query": f"n={index}", "body": '{"a": 1}'})
+        self.assertEqual(server.stats()["peak_connections"], 1)
+
+    def test_parked_requests_do_not_hold_the_app_thread(self):
+        waiters = []
+        both_parked = threading.Event()
+
+        def app(environ, start_response):
+            parking = environ[PARKING_ENVIRON_KEY]
+            waiters.append(parking.event())
+            parking.defer(5, lambda completed: ({"completed": completed}, 200))
+            if len(waiters) == 2:
+                both_parked.set()
+            start_response("204 No Content", [])
+            return [b""]
+
+        # One app thread: the second request can only run if the first
+        # one's wait does not occupy it.
+        server = self.start(app, app_threads=1)
+        with ThreadPoolExecutor(2) as clients:
+            answers = [clients.submit(self.request, server, "POST", "/send", b"{}") for _ in range(2)]
+            self.assertTrue(both_parked.wait(5))
+            self.assertEqual(server.stats()["waiting"], 2)
+            for waiter in waiters:
+                waiter.set()
+            for answer in answers:
+                self.assertEqual(answer.result(), (200, b'{"completed": true}\n'))
+        self.assertEqual(server.stats()["waiting"], 0)
+
+    def test_wait_timeout_and_waiting_cap(self):
+        def app(environ, start_response):
+            parking = environ[PARKING_ENVIRON_KEY]
+            if parking.event() is None:
+                start_response("503 Service Unavailable", [("Content-Type", "application/json")])
+                return [b'{"error": "too_many_waiting"}']
+            parking.defer(0.05, lambda completed: ({"completed": completed}, 200 if completed else 504))
+            start_response("204 No Content", [])
+            return [b""]
+
+        server = self.start(app)
+        self.assertEqual(self.request(server, "POST", "/send", b"{}"), (504, b'{"completed": false}\n'))
+        self.assertEqual(server.stats()["wait_timeouts"], 1)
+
+        capped = self.start(app, max_waiting=0)
+        self.assertEqual(self.request(capped, "POST", "/send", b"{}")[0], 503)
+        self.assertEqual(capped.stats()["waiting_refused"], 1)
+
+    def test_streamed_response_is_written_as_the_producer_wakes_it(self):
+        ready, streamers = [], []
+        finished, closed = threading.Event(), threading.Event()
+
+        def poll():
+            if ready:
+                return ready.pop(0)
+            return None if finished.is_set() else b""
+
+        def app(environ, start_response):
+            streamers.append(environ[PARKING_ENVIRON_KEY].stream(
+                poll, content_type="text/plain", on_close=closed.set, keepalive=b"ka\n", keepalive_seconds=0.05,
+            ))
+            start_response("204 No Content", [])
+            return [b""]
+
+        server = self.start(app, app_threads=1)
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+        self.addCleanup(connection.close)
+        connection.request("GET", "/events")
+        response = connection.getresponse()
+        self.assertEqual((response.status, response.getheader("Content-Type")), (200, "text/plain"))
+        self.assertEqual(response.readline(), b"ka\n")
+        ready.extend([b"one\n", b"two\n"])
+        finished.set()
+        streamers[0].set()
+        self.assertEqual(response.read().replace(b"ka\n", b""), b"one\ntwo\n")
+        self.assertTrue(closed.wait(5))
+        self.assertEqual(server.stats()["peak_streams"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
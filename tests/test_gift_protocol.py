@@ -0,0 +1,115 @@
+import unittest
+from urllib.parse import urlencode
+
+from workers.bilibili.gift_protocol import (
+    PARTIAL_FAILED, SendGiftForm, gift_send_steps, plan_bag_sends, provider_transaction_id, sendgift_payload,
+)
+
+
+def drive(steps, outcomes):
+    payloads = []
+    try:
+        payload = next(steps)
+        while True:
+            payloads.append(payload)
+            payload = steps.send(outcomes.pop(0))
+    except StopIteration as finished:
+        return payloads, finished.value
+
+
+def steps_for(count, bag_items):
+    form = SendGiftForm(csrf="csrf", room_id="1", ruid=2, gift_id="31036")
+    return gift_send_steps(form=form, count=count, bag_items=bag_items)
+
+
+class GiftProtocolTests(unittest.TestCase):
+    def test_bag_stack_is_used_before_direct_send(self):
+        bag = [{"gift_id": 31036, "bag_id": 9, "gift_num": 2}]
+        payloads, result = drive(steps_for(5, bag), [
+            (True, 200, {"code": 0, "data": {"tid": "a"}}, False),
+            (True, 200, {"code": 0, "data": {"tid": "b"}}, False),
+        ])
+
+        self.assertEqual([(p.bag_id, p.num) for p in payloads], [("9", 2), ("0", 3)])
+        self.assertEqual(result["mode"], "split")
+        self.assertTrue(result["success"])
+        self.assertEqual(result["provider_transaction_ids"], ["a", "b"])
+
+    def test_unavailable_bag_send_reports_everything_and_stops(self):
+        bag = [{"gift_id": "31036", "bag_id": 9, "gift_num": 2}]
+        payloads, result = drive(steps_for(5, bag), [(False, 0, {"code": -1, "message": "provider_unavailable"}, False)])
+
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual((result["count"], result["error"]), (5, "provider_unavailable"))
+        self.assertFalse(result["success"] or result["outcome_uncertain"])
+
+    def test_breaker_rejection_after_a_delivered_part_is_a_partial_failure(self):
+        bag = [{"gift_id": "31036", "bag_id": 9, "gift_num": 4}]
+        payloads, result = drive(steps_for(10, bag), [
+            (True, 200, {"code": 0, "data": {"tid": "T1"}}, False),
+            (False, 0, {"code": -1, "message": "provider_unavailable"}, False),
+        ])
+
+        self.assertEqual([(p.bag_id, p.num) for p in payloads], [("9", 4), ("0", 6)])
+        self.assertEqual((result["mode"], result["error"]), ("split", PARTIAL_FAILED))
+        self.assertEqual(result["provider_transaction_ids"], ["T1"])
+        self.assertEqual([part.get("error") for part in result["parts"]], [None, "provider_unavailable"])
+        self.assertFalse(result["success"])
+
+    def test_uncertain_bag_send_never_falls_through_to_direct_send(self):
+        bag = [{"gift_id": "31036", "bag_id": 9, "gift_num": 2}]
+        payloads, result = drive(steps_for(5, bag), [(False, 0, {"code": -1}, True)])
+
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(result["mode"], "bag")
+        self.assertTrue(result["outcome_uncertain"])
+
+    def test_single_direct_send_returns_one_flat_result(self):
+        payloads, result = drive(steps_for(1, []), [(False, 200, {"code": 200013}, False)])
+
+        self.assertEqual(payloads[0].bag_id, "0")
+        self.assertEqual(result["mode"], "direct")
+        self.assertFalse(result["success"])
+        self.assertFalse(result["outcome_uncertain"])
+
+    def test_planner_covers_a_gift_in_the_fewest_bag_sends(self):
+        bag = [
+            {"gift_id": 31036, "bag_id": 1, "gift_num": 1},
+            {"gift_id": 31036, "bag_id": 2, "gift_num": 2},
+            {"gift_id": 1, "bag_id": 3, "gift_num": 50},
+            {"gift_id": 31036, "bag_id": 4, "gift_num": 30, "expire_at": 2000},
+            {"gift_id": 31036, "bag_id": 5, "gift_num": 30, "expire_at": 1000},
+            {"gift_id": 31036, "bag_id": 6, "gift_num": 40},
+        ]
+        # Provider order would take 1, 2, 4 and 5: four sends instead of one.
+        self.assertEqual(plan_bag_sends(bag, [("31036", 20)]), [[("5", 20)]])
+        # No single stack covers 45: the largest first, then the soonest expiry.
+        self.assertEqual(plan_bag_sends(bag, [("31036", 45)]), [[("6", 40), ("5", 5)]])
+        self.assertEqual(plan_bag_sends(bag, [("2", 5)]), [[]])
+
+    def test_planner_reserves_stacks_across_a_batch(self):
+        bag = [{"gift_id": "31036", "bag_id": 9, "gift_num": 3}, {"gift_id": "1", "bag_id": 8, "gift_num": 5}]
+        plans = plan_bag_sends(bag, [("31036", 2), ("1", 1), ("31036", 2)])
+        self.assertEqual(plans, [[("9", 2)], [("8", 1)], [("9", 1)]])
+
+        payloads, result = drive(
+            gift_send_steps(form=SendGiftForm(csrf="c", room_id="1", ruid=2, gift_id="31036"), count=2, bag_plan=plans[2]),
+            [(True, 200, {"code": 0}, False), (True, 200, {"code": 0}, False)],
+        )
+        self.assertEqual([(p.bag_id, p.num) for p in payloads], [("9", 1), ("0", 1)])
+        self.assertEqual(bag[0]["gift_num"], 3)
+
+    def test_compiled_form_matches_the_urlencoded_payload(self):
+        form = SendGiftForm(csrf="a+b/c=", room_id="1", ruid=2, gift_id="31036")
+        for num, bag_id in ((1, "0"), (12, 9), (3, "x y&z")):
+            expected = urlencode(sendgift_payload(csrf="a+b/c=", room_id="1", ruid=2, gift_id="31036", num=num, bag_id=bag_id))
+            self.assertEqual(form.post(num, bag_id).body, expected.encode())
+
+    def test_provider_transaction_id_reads_top_level_or_data(self):
+        self.assertEqual(provider_transaction_id({"order_id": 7}), "7")
+        self.assertEqual(provider_transaction_id({"data": {"transactionId": "x"}}), "x")
+        self.assertIsNone(provider_transaction_id({"data": []}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from workers.bilibili.hedge import Hedger
+
+
+class HedgerTests(unittest.TestCase):
+    def test_slow_read_is_hedged_and_the_faster_attempt_wins(self):
+        hedger = Hedger(lambda endpoint: 0.02)
+        attempts = []
+        lock = threading.Lock()
+
+        def attempt():
+            with lock:
+                attempts.append(len(attempts))
+                index = attempts[-1]
+            # The first attempt hits a stalled server; the hedge does not.
+            time.sleep(1.0 if index == 0 else 0.01)
+            return index
+
+        started = time.monotonic()
+        self.assertEqual(hedger.call("pk/info", attempt), 1)
+        self.assertLess(time.monotonic() - started, 0.5)
+        stats = hedger.stats()
+        self.assertEqual((stats["calls"], stats["hedged"], stats["hedge_wins"]), (1, 1, 1))
+
+    def test_budget_caps_the_extra_load(self):
+        hedger = Hedger(lambda endpoint: 0.0, budget_ratio=0.1, burst=1.0)
+        for _ in range(20):
+            hedger.call("get_info", lambda: time.sleep(0.005) or "ok")
+
+        stats = hedger.stats()
+        self.assertLessEqual(stats["hedged"], 3)
+        self.assertGreater(stats["budget_denied"], 0)
+
+    def test_writes_are_never_hedged(self):
+        hedger = Hedger(lambda endpoint: 0.0)
+        for endpoint in ("sendGift", "msg/send"):
+            with self.assertRaises(ValueError):
+                hedger.call(endpoint, lambda: "sent")
+        self.assertEqual(hedger.stats()["calls"], 0)
+
+    def test_disabled_or_unknown_p95_runs_inline(self):
+        caller = threading.get_ident()
+        for hedger in (Hedger(lambda endpoint: 0.0, enabled=False), Hedger(lambda endpoint: None)):
+            self.assertEqual(hedger.call("bag_list", threading.get_ident), caller)
+            self.assertEqual(hedger.stats()["hedged"], 0)
+
+    def test_async_hedge_cancels_the_losing_attempt(self):
+        hedger = Hedger(lambda endpoint: 0.02)
+        cancelled = []
+
+        async def main():
+            calls = []
+
+            async def attempt():
+                calls.append(None)
+                index = len(calls) - 1
+                try:
+                    await asyncio.sleep(1.0 if index == 0 else 0.01)
+                except asyncio.CancelledError:
+                    cancelled.append(index)
+                    raise
+                return index
+
+            return await hedger.call_async("get_info", attempt)
+
+        self.assertEqual(asyncio.run(main()), 1)
+        self.assertEqual(cancelled, [0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from workers.bilibili.journal import JournalLocked, SendJournal, replay_journal
+from workers.bilibili.status_store import StatusStore
+
+
+def create(store, request_id):
+    return store.create(request_id, backend="http", confirm="api", deadline=None, total=1)
+
+
+class SendJournalTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "journal.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_restart_replays_states_with_restart_semantics(self):
+        store = StatusStore(10, 3600)
+        journal = SendJournal(self.path, fsync=False)
+        store.journal = journal
+        for request_id in ("queued", "sending", "done", "dropped"):
+            create(store, request_id)
+        store.mark_sending("sending")
+        store.mark_sending("done")
+        store.finish("done", [{"success": True, "provider_transaction_id": "t1"}])
+        store.discard("dropped")
+        journal.close()
+        with open(self.path, "ab") as handle:
+            handle.write(b'{"id":"torn","sta')
+
+        recovered = StatusStore(10, 3600)
+        self.assertEqual(recovered.restore(replay_journal(self.path).values()), 3)
+
+        queued, sending, done = (recovered.snapshot(key) for key in ("queued", "sending", "done"))
+        self.assertEqual((queued["status"], queued["outcome_uncertain"]), ("abandoned", False))
+        self.assertEqual((sending["status"], sending["outcome_uncertain"]), ("interrupted", True))
+        self.assertEqual(done["status"], "done")
+        self.assertEqual(done["results"][0]["provider_transaction_id"], "t1")
+        self.assertIsNone(recovered.get("dropped"))
+
+    def test_compaction_keeps_only_live_state(self):
+        store = StatusStore(10, 3600)
+        journal = SendJournal(self.path, snapshot=store.journal_entries, fsync=False)
+        store.journal = journal
+        create(store, "a")
+        store.mark_sending("a")
+        store.finish("a", [])
+        journal.flush()
+        journal.compact()
+        journal.close()
+
+        with open(self.path, "rb") as handle:
+            self.assertEqual(len(handle.readlines()), 1)
+        self.assertEqual(replay_journal(self.path)["a"]["status"], "done")
+
+    def test_second_writer_is_refused(self):
+        journal = SendJournal(self.path, fsync=False)
+        try:
+            with self.assertRaises(JournalLocked):
+                SendJournal(self.path, fsync=False)
+        finally:
+            journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+from workers.bilibili.latency import LatencyTracker
+
+
+class LatencyTrackerTests(unittest.TestCase):
+    def tracker(self, **kwargs):
+        kwargs.setdefault("min_samples", 10)
+        return LatencyTracker(**kwargs)
+
+    def test_default_until_enough_samples_then_p99_plus_margin(self):
+        tracker = self.tracker()
+        for _ in range(9):
+            tracker.observe("bag_list", 0.05)
+        self.assertEqual(tracker.timeout("bag_list", (1.2, 3.0)), (1.2, 3.0))
+
+        tracker.observe("bag_list", 0.10)
+        # p99 0.10 * 2 + 0.25, well under the fixed 3 s; connect has no samples yet.
+        self.assertEqual(tracker.timeout("bag_list", (1.2, 3.0)), (1.2, 0.5))
+        for _ in range(10):
+            tracker.observe_connect(0.02)
+        self.assertEqual(tracker.timeout("bag_list", (1.2, 3.0)), (0.3, 0.5))
+
+    def test_non_idempotent_reads_never_drop_below_the_default(self):
+        tracker = self.tracker()
+        for _ in range(10):
+            tracker.observe("sendGift", 0.05)
+            tracker.observe_connect(0.02)
+        # Only the connect side shrinks: a slow sendGift answer is not cut off.
+        self.assertEqual(tracker.timeout("sendGift", (1.2, 3.0)), (0.3, 3.0))
+        self.assertEqual(tracker.timeout("msg/send", (0.8, 1.8), fast=True), (0.3, 1.8))
+        self.assertEqual(tracker.stats()["endpoints"]["sendGift"]["adaptive_timeout"], 3.0)
+
+        tracker.observe_timeout("sendGift", 3.0)
+        tracker.observe_timeout("sendGift", 3.0)
+        self.assertEqual(tracker.timeout("sendGift", (1.2, 3.0)), (0.3, 6.25))
+
+    def test_a_stray_timeout_keeps_the_timeout_tight(self):
+        tracker = self.tracker()
+        for _ in range(20):
+            tracker.observe("bag_list", 0.05)
+        tracker.observe_timeout("bag_list", 0.5)
+        self.assertEqual(tracker.timeout("bag_list", (1.2, 3.0)), (1.2, 0.5))
+
+    def test_repeated_timeouts_loosen_the_next_timeout_up_to_the_caps(self):
+        tracker = self.tracker()
+        for _ in range(20):
+            tracker.observe("bag_list", 0.05)
+        tracker.observe_timeout("bag_list", 0.5)
+        tracker.observe_timeout("bag_list", 2.0)
+        self.assertEqual(tracker.timeout("bag_list", (1.2, 3.0)), (1.2, 4.25))
+        self.assertEqual(tracker.timeout("bag_list", (0.8, 1.8), fast=True), (0.8, 3.0))
+
+        tracker.observe_timeout("bag_list", 4.25)
+        self.assertEqual(tracker.timeout("bag_list", (1.2, 3.0))[1], 8.0)
+        self.assertEqual(tracker.stats()["endpoints"]["bag_list"]["timeouts"], 3)
+
+        # Once the slow calls scroll out of the recent window it tightens again.
+        for _ in range(10):
+            tracker.observe("bag_list", 0.05)
+        self.assertEqual(tracker.timeout("bag_list", (1.2, 3.0))[1], 0.5)
+
+    def test_timing_records_duration_and_timeouts(self):
+        tracker = self.tracker(min_samples=1)
+        with tracker.timing("get_info"):
+            pass
+        with self.assertRaises(TimeoutError):
+            with tracker.timing("get_info"):
+                raise TimeoutError
+        with self.assertRaises(ValueError):
+            with tracker.timing("get_info"):
+                raise ValueError
+
+        stats = tracker.stats()["endpoints"]["get_info"]
+        self.assertEqual((stats["calls"], stats["timeouts"]), (2, 1))
+
+    def test_endpoints_are_independent_and_can_be_switched_off(self):
+        tracker = self.tracker(enabled=False)
+        for _ in range(10):
+            tracker.observe("pk/info", 0.01)
+        self.assertEqual(tracker.timeout("pk/info", 8), (8.0, 8.0))
+        self.assertEqual(tracker.timeout("msg/send", 5), (5.0, 5.0))
+        self.assertEqual(tracker.stats()["endpoints"]["pk/info"]["adaptive_timeout"], 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
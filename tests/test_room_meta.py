@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from workers.bilibili.room_meta import RoomMetaCache
+
+from fake_clock import FakeClock
+
+
+class RoomMetaCacheTests(unittest.TestCase):
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.directory = workdir.name
+        self.clock = FakeClock()
+        self.fetches = []
+
+    def cache(self):
+        return RoomMetaCache(self.directory, uid_ttl=60, live_ttl=5, clock=self.clock)
+
+    def fetch(self, data):
+        return lambda: self.fetches.append(data) or data
+
+    def test_one_get_info_serves_uid_and_live_status_to_other_processes(self):
+        info = {"uid": 42, "live_status": 1}
+        self.assertEqual(self.cache().live_status("100", self.fetch(info)), 1)
+
+        # A second process (another instance on the same directory) reads both.
+        other = self.cache()
+        self.assertEqual(other.uid("100", self.fetch(info)), 42)
+        self.assertEqual(other.live_status("100", self.fetch(info)), 1)
+        self.assertEqual(len(self.fetches), 1)
+        self.assertEqual(other.stats()["hits"], 2)
+
+    def test_each_field_expires_on_its_own_ttl(self):
+        cache = self.cache()
+        cache.store("100", {"uid": 42, "live_status": 0})
+        self.clock.now += 10
+
+        self.assertEqual(cache.uid("100", self.fetch({"uid": 99, "live_status": 1})), 42)
+        self.assertEqual(cache.live_status("100", self.fetch({"uid": 42, "live_status": 1})), 1)
+        self.assertEqual(len(self.fetches), 1)
+
+    def test_bad_room_ids_and_corrupt_files_fall_back_to_fetch(self):
+        cache = self.cache()
+        self.assertEqual(cache.uid("../cookie", self.fetch({"uid": 7})), 7)
+        self.assertEqual(os.listdir(self.directory), [])
+
+        with open(os.path.join(self.directory, "room-100.json"), "w", encoding="utf-8") as handle:
+            handle.write("{not json")
+        self.assertEqual(cache.uid("100", self.fetch({"uid": 8})), 8)
+        self.assertEqual(cache.uid("100", self.fetch({"uid": 9})), 8)
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_missing_uid_is_not_cached(self):
+        cache = self.cache()
+        self.assertIsNone(cache.uid("100", self.fetch({"uid": 0})))
+        self.assertIsNone(cache.cached("100", "uid"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from workers.bilibili.room_shards import RoomShards
+
+
+class RoomShardsTests(unittest.TestCase):
+    def test_only_allow_listed_rooms_get_a_shard(self):
+        shards = RoomShards("100", ["200"], factory=lambda room_id: f"session-{room_id}")
+
+        self.assertEqual(shards.get().room_id, "100")
+        self.assertEqual(shards.get("200").session, "session-200")
+        self.assertIs(shards.get("200"), shards.get(200))
+        self.assertIsNone(shards.get("300"))
+        self.assertNotIn("300", shards)
+        self.assertEqual(shards.stats()["active"], 2)
+
+    def test_least_recently_used_room_is_evicted_but_never_the_primary(self):
+        shards = RoomShards("1", ["2", "3", "4"], max_active=2)
+        shards.get("1")
+        second = shards.get("2")
+        second.ruid = 42
+        shards.get("3")
+        shards.get("4")
+
+        stats = shards.stats()
+        self.assertEqual(sorted(stats["rooms"]), ["1", "4"])
+        self.assertEqual(stats["evicted"], 2)
+        # An evicted room starts over with empty caches.
+        self.assertIsNone(shards.get("2").ruid)
+
+    def test_stale_bag_is_served_while_one_refresh_runs(self):
+        bag = RoomShards("1", []).get().bag
+        self.assertEqual(bag.serve(100.0, 2.0), (None, True))
+        bag.store([{"bag_id": 7, "gift_id": 31036, "gift_num": 5}], 100.0, 100.0)
+
+        self.assertFalse(bag.serve(101.0, 2.0)[1])
+        items, refresh = bag.serve(103.0, 2.0)
+        self.assertEqual(items[0]["gift_num"], 5)
+        self.assertTrue(refresh)
+        self.assertFalse(bag.serve(103.5, 2.0)[1])
+        # A failed refresh keeps the last snapshot.
+        bag.store(None, 103.0, 104.0)
+        self.assertEqual(bag.items()[0]["gift_num"], 5)
+
+    def test_bag_sends_are_deducted_and_survive_a_refresh_that_missed_them(self):
+        bag = RoomShards("1", []).get().bag
+        bag.store([{"bag_id": 7, "gift_id": 31036, "gift_num": 5}], 100.0, 100.0)
+        bag.record_send(7, 2, ok=True, uncertain=False, now=101.0)
+        self.assertEqual(bag.items()[0]["gift_num"], 3)
+
+        # Started before the send: the provider's 5 does not include it yet.
+        bag.store([{"bag_id": 7, "gift_id": 31036, "gift_num": 5}], 100.5, 102.0)
+        self.assertEqual(bag.items()[0]["gift_num"], 3)
+        # Started after it: the provider's count is taken as is.
+        bag.store([{"bag_id": 7, "gift_id": 31036, "gift_num": 3}], 102.5, 103.0)
+        self.assertEqual(bag.items()[0]["gift_num"], 3)
+
+    def test_uncertain_bag_send_counts_as_spent_and_forces_revalidation(self):
+        bag = RoomShards("1", []).get().bag
+        bag.store([{"bag_id": 7, "gift_id": 31036, "gift_num": 1}], 100.0, 100.0)
+        bag.record_send(7, 1, ok=False, uncertain=True, now=100.5)
+
+        items, refresh = bag.serve(100.6, 2.0)
+        self.assertEqual(items[0]["gift_num"], 0)
+        self.assertTrue(refresh)
+
+
+if __name__ == "__main__":
+    unittest.main()
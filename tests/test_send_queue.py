@@ -0,0 +1,136 @@
+import threading
+import time
+import unittest
+
+from workers.bilibili.send_queue import LANE_CONTROL, LANE_GIFT, LANE_PK, BatchWindow, SendQueue
+
+
+def make_queue(depth=10):
+    return SendQueue({LANE_PK: depth, LANE_GIFT: depth, LANE_CONTROL: depth})
+
+
+class SendQueueTests(unittest.TestCase):
+    def test_drain_blocks_until_an_item_is_put(self):
+        queue = make_queue()
+        drained = []
+        consumer = threading.Thread(target=lambda: drained.extend(queue.drain(timeout=5)))
+        consumer.start()
+        time.sleep(0.05)
+        self.assertTrue(consumer.is_alive())
+        self.assertTrue(queue.put({"gifts": ["1"]}))
+        consumer.join(timeout=1)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(drained, [{"gifts": ["1"]}])
+        self.assertEqual(len(queue), 0)
+
+    def test_each_lane_enforces_its_own_depth(self):
+        queue = make_queue(depth=2)
+        self.assertTrue(queue.put("a"))
+        self.assertTrue(queue.put("b"))
+        self.assertFalse(queue.put("c"))
+        self.assertTrue(queue.put("pk", LANE_PK))
+        stats = queue.stats()
+        self.assertEqual(stats[LANE_GIFT]["rejected"], 1)
+        self.assertEqual(stats[LANE_GIFT]["depth"], 2)
+        self.assertEqual(stats[LANE_PK]["depth"], 1)
+
+    def test_pk_lane_is_drained_before_lower_lanes(self):
+        queue = make_queue()
+        queue.put("danmaku", LANE_CONTROL)
+        queue.put("wish-1")
+        queue.put("wish-2")
+        queue.put("pk-1", LANE_PK)
+        queue.put("pk-2", LANE_PK)
+
+        self.assertEqual(queue.drain(timeout=0, max_items=1), ["pk-1", "pk-2"])
+        self.assertEqual(queue.drain(timeout=0, max_items=1), ["wish-1"])
+        self.assertEqual(queue.drain(timeout=0), ["wish-2", "danmaku"])
+
+    def test_each_lane_is_ordered_earliest_deadline_first(self):
+        queue = make_queue()
+        now = time.time()
+        queue.put("no-deadline")
+        queue.put("late", deadline=now + 60)
+        queue.put("soon", deadline=now + 5)
+
+        self.assertEqual(queue.drain(timeout=0), ["soon", "late", "no-deadline"])
+
+    def test_expired_items_are_reported_instead_of_returned(self):
+        expired = []
+        queue = SendQueue({LANE_PK: 5, LANE_GIFT: 5}, on_expired=expired.append)
+        queue.put("stale", LANE_PK, deadline=time.time() - 1)
+        queue.put("fresh", LANE_PK, deadline=time.time() + 60)
+
+        self.assertEqual(queue.drain(timeout=0), ["fresh"])
+        self.assertEqual(expired, ["stale"])
+        self.assertEqual(queue.stats()[LANE_PK]["expired"], 1)
+
+    def test_drain_keeps_waiting_when_only_expired_items_were_queued(self):
+        expired = []
+        queue = SendQueue({LANE_GIFT: 5}, on_expired=expired.append)
+        queue.put("stale", deadline=time.time() - 1)
+
+        self.assertEqual(queue.drain(timeout=0.05), [])
+        self.assertEqual(expired, ["stale"])
+
+    def test_drain_timeout_returns_empty_list(self):
+        self.assertEqual(make_queue().drain(timeout=0.01), [])
+
+    def test_lane_with_a_target_sheds_while_sojourn_stays_above_it(self):
+        queue = SendQueue({LANE_PK: 10, LANE_GIFT: 10}, lane_targets={LANE_GIFT: (0.02, 0.02)})
+        for index in range(4):
+            queue.put(f"wish-{index}")
+        time.sleep(0.05)
+        self.assertEqual(queue.drain(timeout=0, max_items=1), ["wish-0"])
+        time.sleep(0.03)
+        self.assertEqual(queue.drain(timeout=0, max_items=1), ["wish-1"])
+
+        rejection, retry_after = queue.offer("wish-4")
+        self.assertEqual(rejection, "overloaded")
+        self.assertGreaterEqual(retry_after, 1.0)
+        self.assertEqual(queue.offer("pk", LANE_PK), (None, 0.0))
+        self.assertEqual(queue.stats()[LANE_GIFT]["shed"], 1)
+
+        # Once the backlog is gone the lane admits again.
+        queue.drain(timeout=0)
+        self.assertEqual(queue.offer("wish-5"), (None, 0.0))
+        self.assertFalse(queue.stats()[LANE_GIFT]["shedding"])
+
+    def test_depth_cap_still_applies_to_lanes_with_a_target(self):
+        queue = SendQueue({LANE_GIFT: 1}, lane_targets={LANE_GIFT: (10.0, 10.0)})
+        self.assertEqual(queue.offer("a"), (None, 0.0))
+        self.assertEqual(queue.offer("b")[0], "full")
+
+
+class BatchWindowTests(unittest.TestCase):
+    def busy_window(self):
+        window = BatchWindow(0.2)
+        window.note_provider_latency(1.0)
+        now = time.monotonic()
+        for ago in (0.003, 0.002, 0.001):
+            window.note_arrival(now - ago)
+        return window
+
+    def test_window_opens_only_when_arrivals_outpace_it(self):
+        window = self.busy_window()
+        self.assertAlmostEqual(window.current(), 0.1)
+        window.note_arrival(time.monotonic() + 10.0)
+        window.note_arrival(time.monotonic() + 20.0)
+        self.assertEqual(window.current(), 0.0)
+
+    def test_drain_lingers_for_more_items_but_not_for_pk(self):
+        queue = SendQueue({LANE_PK: 10, LANE_GIFT: 10}, window=self.busy_window())
+        queue.put("wish-1")
+        threading.Timer(0.02, queue.put, args=("wish-2",)).start()
+        self.assertEqual(queue.drain(timeout=1), ["wish-1", "wish-2"])
+
+        queue.put("pk", lane=LANE_PK)
+        started = time.monotonic()
+        self.assertEqual(queue.drain(timeout=1), ["pk"])
+        self.assertLess(time.monotonic() - started, 0.05)
+        self.assertGreaterEqual(sum(queue.window_stats()["batch_size_histogram"].values()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
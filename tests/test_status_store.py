@@ -0,0 +1,104 @@
+import unittest
+
+from workers.bilibili.status_store import StatusStore
+
+from fake_clock import FakeClock
+
+
+def create(store, request_id):
+    return store.create(request_id, backend="http", confirm="api", deadline=None, total=1)
+
+
+class StatusStoreTests(unittest.TestCase):
+    def test_records_expire_ttl_after_last_update(self):
+        clock = FakeClock()
+        store = StatusStore(10, 60, clock=clock)
+        create(store, "old")
+        create(store, "busy")
+        clock.now += 50
+        store.mark_sending("busy")
+        clock.now += 20
+
+        self.assertEqual(store.reap(), 1)
+        self.assertIsNone(store.get("old"))
+        self.assertEqual(store.snapshot("busy")["status"], "sending")
+
+    def test_full_store_rejects_until_entries_expire(self):
+        clock = FakeClock()
+        store = StatusStore(2, 60, clock=clock)
+        create(store, "a")
+        create(store, "b")
+        self.assertIsNone(create(store, "c"))
+
+        clock.now += 61
+        self.assertIsNotNone(create(store, "c"))
+        self.assertEqual(len(store), 1)
+
+    def test_discarded_requests_do_not_pile_up_in_the_expiry_heap(self):
+        clock = FakeClock()
+        store = StatusStore(10, 3600, clock=clock)
+        create(store, "kept")
+        for index in range(10000):
+            create(store, f"rejected-{index}")
+            store.discard(f"rejected-{index}")
+
+        self.assertEqual(len(store), 1)
+        self.assertLessEqual(store.stats()["expiry_entries"], 2 * len(store) + 64)
+        self.assertEqual(store.snapshot("kept")["status"], "queued")
+        clock.now += 3601
+        self.assertEqual(store.reap(), 1)
+
+    def test_finish_stores_results_once_and_derives_counts(self):
+        store = StatusStore(10, 60)
+        record = create(store, "r")
+        results = [{"success": True}, {"success": False}]
+        store.finish("r", results)
+
+        self.assertIs(record.results, results)
+        self.assertEqual((record.success_count, record.failed_count), (1, 1))
+        self.assertEqual(store.snapshot("r")["status"], "done")
+        self.assertGreater(store.stats()["approx_bytes"]["total"], 0)
+
+    def test_snapshot_many_reads_every_id_at_once(self):
+        store = StatusStore(10, 60)
+        create(store, "a")
+        create(store, "b")
+        store.finish("b", [{"success": True}])
+
+        states = store.snapshot_many(["b", "missing", "a"])
+        self.assertEqual(list(states), ["b", "missing", "a"])
+        self.assertEqual((states["a"]["status"], states["b"]["status"], states["missing"]), ("queued", "done", None))
+
+    def test_filtered_feed_starts_from_current_state_and_finishes(self):
+        clock = FakeClock()
+        store = StatusStore(10, 60, clock=clock)
+        create(store, "a")
+        create(store, "b")
+        create(store, "other")
+        feed = store.subscribe(["a", "b", "missing"])
+        clock.now += 1
+        store.mark_sending("a", "b", "other")
+        store.finish("a", [{"success": True}])
+        self.assertFalse(feed.finished)
+        store.finish("b", [], status="expired")
+
+        events = [(event["request_id"], event["status"]) for event in feed.take()]
+        self.assertEqual(events, [
+            ("a", "queued"), ("b", "queued"), ("missing", "not_found"),
+            ("a", "sending"), ("b", "sending"), ("a", "done"), ("b", "expired"),
+        ])
+        self.assertTrue(feed.finished)
+        store.unsubscribe(feed)
+        self.assertEqual(store.stats()["feeds"], 0)
+
+    def test_slow_feed_drops_oldest_events(self):
+        store = StatusStore(10, 60)
+        feed = store.subscribe(max_pending=2)
+        for request_id in ("a", "b", "c"):
+            create(store, request_id)
+        self.assertEqual([event["request_id"] for event in feed.take()], ["b", "c"])
+        self.assertEqual(feed.dropped, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+from workers.bilibili.warmup import Warmup
+
+
+class WarmupTests(unittest.TestCase):
+    def test_ready_only_after_every_step_ran(self):
+        ran = []
+        warmup = Warmup([("a", lambda: ran.append("a") or True), ("b", lambda: ran.append("b") or True)])
+
+        self.assertFalse(warmup.ready)
+        self.assertTrue(warmup.run_steps())
+        self.assertEqual(ran, ["a", "b"])
+        self.assertTrue(warmup.ready)
+        self.assertEqual(warmup.stats()["state"], "ready")
+
+    def test_failing_step_is_reported_but_does_not_block_readiness(self):
+        def boom():
+            raise ConnectionError("refused")
+
+        warmup = Warmup([("connections", boom), ("bag_list", lambda: False), ("room_uid", lambda: True)])
+        self.assertFalse(warmup.run_steps())
+
+        stats = warmup.stats()
+        self.assertTrue(stats["ready"])
+        self.assertEqual(stats["state"], "degraded")
+        self.assertEqual(stats["steps"]["connections"]["error"], "ConnectionError")
+        self.assertFalse(stats["steps"]["bag_list"]["ok"])
+        self.assertTrue(stats["steps"]["room_uid"]["ok"])
+
+    def test_slow_step_stops_holding_readiness_at_the_timeout(self):
+        release = threading.Event()
+        warmup = Warmup([("slow", lambda: release.wait(5))], timeout=0.05)
+        thread = threading.Thread(target=warmup.run_steps)
+        thread.start()
+
+        self.assertTrue(warmup.wait(timeout=1))
+        self.assertEqual(warmup.stats()["state"], "degraded")
+        release.set()
+        thread.join(timeout=1)
+
+    def test_refresh_records_last_outcome(self):
+        warmup = Warmup([], refresh=[("keepalive", lambda: True), ("bag_list", lambda: False)])
+        warmup.refresh_once()
+
+        refresh = warmup.stats()["refresh"]
+        self.assertEqual((refresh["runs"], refresh["failures"]), (1, 1))
+        self.assertTrue(refresh["last"]["keepalive"]["ok"])
+
+    def test_skipped_warmup_is_ready_immediately(self):
+        self.assertTrue(Warmup.skipped().ready)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -143,14 +143,34 @@ class WindowsGiftListener {
         this.allowedGiftIds = loadAllowedGiftIds();
         this.threeServerRoomId = null;
         this.threeServerScript = this.resolveVersionedScript('THREESERVER_SCRIPT', 'threeserver.py', [
-            'cookie_store.py'
+            'accounts.py',
+            'breaker.py',
+            'coalesce.py',
+            'cookie_store.py',
+            'danmaku.py',
+            'dispatch_pool.py',
+            'dns_cache.py',
+            'event_server.py',
+            'gift_protocol.py',
+            'hedge.py',
+            'journal.py',
+            'latency.py',
+            'room_meta.py',
+            'room_shards.py',
+            'send_queue.py',
+            'status_store.py',
+            'warmup.py'
         ]);
         this.threeServerPythonPath = process.env.THREESERVER_PYTHON || 'python';
         this.threeServerProcess = null;
         this.threeServerProcessRoomId = null;
         this.pkThreeServers = new Map();
         this.pkScript = this.resolveVersionedScript('BILIPK_SCRIPT', 'checkpk.py', [
+            'dns_cache.py',
+            'hedge.py',
+            'latency.py',
             'normalpk.py',
+            'room_meta.py',
             'shousheng.py'
         ]);
         this.pkPythonPath = process.env.BILIPK_PYTHON || 'python';
@@ -974,6 +994,10 @@ class WindowsGiftListener {
                 timeout: 1000,
                 headers: { 'X-Local-Sender-Token': token }
             });
+            // A threeserver that reports ready:false is still warming up
+            // (provider connections, room uid, bag list); treat it as not
+            // yet confirmed so the first gift goes to a hot sender.
+            if (response.data?.ready === false) return null;
             return response.data?.room_id ? String(response.data.room_id) : null;
         } catch (error) {
             return null;
@@ -1357,7 +1381,11 @@ class WindowsGiftListener {
             let reportSuccess = false;
             let outcomeReason = 'send_result_uncertain';
             try {
-                backendResponse = await axios.post(`${backendUrl}/send`, { gifts }, {
+                backendResponse = await axios.post(`${backendUrl}/send`, {
+                    gifts,
+                    lane: body?.lane === 'pk' ? 'pk' : undefined,
+                    deadline: Number.isFinite(body?.deadline) ? body.deadline : undefined
+                }, {
                     timeout: 10000,
                     headers: { 'X-Local-Sender-Token': backendToken },
                     validateStatus: () => true
@@ -0,0 +1,231 @@
+"""Per-account cookies, room shards, queue quota and counters for threeserver."""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+DEFAULT_ACCOUNT = "default"
+ACCOUNT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Account:
+    """One Bilibili login. ``shards`` is built by the registry's factory.
+
+    ``queued`` counts this account's requests that were admitted but not yet
+    finished; it is the account's share of the send queue and keeps the
+    account from being evicted while it has work in flight.
+    """
+
+    __slots__ = (
+        "account_id", "cookie_kv", "shards", "queued", "requests", "rejected",
+        "succeeded", "failed", "uncertain", "created", "last_used", "warmed",
+    )
+
+    def __init__(self, account_id: str, cookie_kv: Dict[str, str], now: float):
+        self.account_id = account_id
+        self.cookie_kv = cookie_kv
+        self.shards: Any = None
+        self.queued = 0
+        self.requests = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.uncertain = 0
+        self.created = now
+        self.last_used = now
+        self.warmed: Optional[bool] = None
+
+    @property
+    def cookie_header(self) -> str:
+        return "; ".join(f"{name}={value}" for name, value in self.cookie_kv.items())
+
+
+class AccountRegistry:
+    """Accounts loaded on first use and evicted after ``idle_seconds`` without work.
+
+    ``cookie_path(account_id)`` maps an id to its cookie file or returns None
+    for unknown ids; ``load_cookies(path)`` reads it. ``make_shards(account)``
+    gives the account its own sessions and caches, and ``warm(account)``, if
+    set, runs once on a background thread right after the account is created.
+    At most ``max_accounts`` are kept; the default account is never evicted.
+    """
+
+    def __init__(
+        self,
+        cookie_path: Callable[[str], Optional[str]],
+        load_cookies: Callable[[str], Dict[str, str]],
+        make_shards: Callable[[Account], Any],
+        *,
+        warm: Optional[Callable[[Account], bool]] = None,
+        max_accounts: int = 64,
+        max_queued: int = 20,
+        idle_seconds: float = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._cookie_path = cookie_path
+        self._load_cookies = load_cookies
+        self._make_shards = make_shards
+        self._warm = warm
+        self.max_accounts = max(1, int(max_accounts))
+        self.max_queued = max(1, int(max_queued))
+        self.idle_seconds = float(idle_seconds)
+        self._clock = clock
+        self._accounts: "OrderedDict[str, Account]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._created = 0
+        self._evicted = 0
+
+    def get(self, account_id: Optional[str] = None) -> Optional[Account]:
+        """The account for ``account_id`` (default when None), loading it if needed.
+
+        Returns None for unknown ids, unreadable cookie files, or when the
+        registry is full of accounts that still have queued work.
+        """
+        account_id = DEFAULT_ACCOUNT if account_id is None else str(account_id)
+        if not ACCOUNT_ID_PATTERN.match(account_id):
+            return None
+        with self._lock:
+            account = self._accounts.get(account_id)
+            if account is not None:
+                self._accounts.move_to_end(account_id)
+                account.last_used = self._clock()
+                return account
+            loading = self._loading.setdefault(account_id, threading.Lock())
+        # Load outside the registry lock: reading (and on Windows decrypting)
+        # a cookie file must not stall requests for accounts already loaded.
+        with loading:
+            try:
+                account = self._load(account_id)
+            finally:
+                with self._lock:
+                    self._loading.pop(account_id, None)
+        if account is None or account.warmed is not None:
+            return account
+        account.warmed = False
+        if self._warm is not None:
+            threading.Thread(target=self._run_warm, args=(account,), name=f"warm-{account_id}", daemon=True).start()
+        return account
+
+    def peek(self, account_id: str = DEFAULT_ACCOUNT) -> Optional[Account]:
+        """The account if it is loaded; never loads or touches it."""
+        with self._lock:
+            return self._accounts.get(account_id)
+
+    def _load(self, account_id: str) -> Optional[Account]:
+        with self._lock:
+            account = self._accounts.get(account_id)
+            if account is not None:
+                return account
+        path = self._cookie_path(account_id)
+        if path is None:
+            return None
+        try:
+            cookie_kv = self._load_cookies(path)
+        except (OSError, ValueError, RuntimeError):
+            return None
+        account = Account(account_id, cookie_kv, self._clock())
+        account.shards = self._make_shards(account)
+        with self._lock:
+            self._evict(self._clock(), make_room=True)
+            if len(self._accounts) >= self.max_accounts:
+                return None
+            self._accounts[account_id] = account
+            self._created += 1
+        return account
+
+    def _run_warm(self, account: Account) -> None:
+        try:
+            account.warmed = bool(self._warm(account))
+        except Exception:
+            account.warmed = False
+
+    def admit(self, account: Account, *, exempt: bool = False) -> bool:
+        """Reserve one queued slot for ``account``; False when its quota is used up.
+
+        ``exempt`` reserves the slot even past the quota, for sends that are
+        never shed (the PK lane); they still count towards ``queued``.
+        """
+        with self._lock:
+            account.last_used = self._clock()
+            if account.queued >= self.max_queued and not exempt:
+                account.rejected += 1
+                return False
+            account.queued += 1
+            account.requests += 1
+            return True
+
+    def release(self, account: Optional[Account], results: Iterable[Dict[str, Any]] = ()) -> None:
+        """Give the slot back and count the request's gift results."""
+        if account is None:
+            return
+        with self._lock:
+            account.queued = max(0, account.queued - 1)
+            account.last_used = self._clock()
+            for result in results:
+                if not isinstance(result, dict):
+                    continue
+                if result.get("success"):
+                    account.succeeded += 1
+                elif result.get("outcome_uncertain"):
+                    account.uncertain += 1
+                else:
+                    account.failed += 1
+
+    def _evict(self, now: float, make_room: bool = False) -> int:
+        evicted: List[str] = []
+        for account_id, account in self._accounts.items():
+            if account_id == DEFAULT_ACCOUNT or account.queued:
+                continue
+            if now - account.last_used >= self.idle_seconds or (
+                make_room and len(self._accounts) - len(evicted) >= self.max_accounts
+            ):
+                evicted.append(account_id)
+        for account_id in evicted:
+            del self._accounts[account_id]
+        self._evicted += len(evicted)
+        return len(evicted)
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            return self._evict(self._clock())
+
+    def start_reaper(self, interval: float = 30.0) -> threading.Thread:
+        def _run() -> None:
+            while True:
+                time.sleep(interval)
+                self.evict_idle()
+
+        thread = threading.Thread(target=_run, name="account-reaper", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            return {
+                "active": len(self._accounts),
+                "max_accounts": self.max_accounts,
+                "max_queued_per_account": self.max_queued,
+                "idle_seconds": self.idle_seconds,
+                "created": self._created,
+                "evicted": self._evicted,
+                "accounts": {
+                    account.account_id: {
+                        "queued": account.queued,
+                        "requests": account.requests,
+                        "rejected": account.rejected,
+                        "succeeded": account.succeeded,
+                        "failed": account.failed,
+                        "uncertain": account.uncertain,
+                        "warmed": account.warmed,
+                        "idle_seconds": round(now - account.last_used, 3),
+                        "rooms": account.shards.stats()["active"] if hasattr(account.shards, "stats") else None,
+                    }
+                    for account in self._accounts.values()
+                },
+            }
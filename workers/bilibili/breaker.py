@@ -0,0 +1,205 @@
+"""Per-endpoint circuit breakers for provider calls."""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN_SECONDS = 5.0
+MAX_COOLDOWN_SECONDS = 60.0
+
+
+class ProviderUnavailable(Exception):
+    """The endpoint's breaker is open: the call was not made, nothing was sent."""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"{endpoint} unavailable, retry in {retry_after:.1f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class _Breaker:
+    __slots__ = (
+        "state", "failures", "cooldown", "retry_at", "probing", "opens", "rejected",
+        "last_error", "changed_at",
+    )
+
+    def __init__(self, cooldown: float, now: float):
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self.retry_at = 0.0
+        self.probing = False
+        self.opens = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self.changed_at = now
+
+
+class CircuitBreakers:
+    """One breaker per provider endpoint, tripped by connect failures only.
+
+    ``failure_threshold`` consecutive failures for which ``is_failure``
+    holds (connection refused, connect timeout, DNS: the request never left
+    this machine) open the endpoint's breaker. While open, ``guard()``
+    raises ``ProviderUnavailable`` at once instead of letting each queued
+    call wait out its timeout. After the cooldown one call is let through
+    as a half-open probe; if it connects the breaker closes, otherwise it
+    reopens with the cooldown doubled (up to ``MAX_COOLDOWN_SECONDS``).
+    Any other outcome, including a read timeout, proves the endpoint
+    accepts connections and counts as a success here.
+    """
+
+    def __init__(
+        self,
+        is_failure: Callable[[BaseException], bool],
+        *,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        cooldown: float = DEFAULT_COOLDOWN_SECONDS,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._is_failure = is_failure
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = max(0.0, float(cooldown))
+        self.enabled = enabled
+        self._clock = clock
+        self._breakers: Dict[str, _Breaker] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, is_failure: Callable[[BaseException], bool]) -> "CircuitBreakers":
+        """``BILI_BREAKER=0`` disables; ``BILI_BREAKER_FAILURES`` / ``BILI_BREAKER_COOLDOWN_SECONDS`` tune it."""
+        enabled = str(os.getenv("BILI_BREAKER", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
+        return cls(
+            is_failure,
+            failure_threshold=int(os.getenv("BILI_BREAKER_FAILURES", DEFAULT_FAILURE_THRESHOLD) or DEFAULT_FAILURE_THRESHOLD),
+            cooldown=float(os.getenv("BILI_BREAKER_COOLDOWN_SECONDS", DEFAULT_COOLDOWN_SECONDS) or DEFAULT_COOLDOWN_SECONDS),
+            enabled=enabled,
+        )
+
+    def _breaker(self, endpoint: str) -> _Breaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers.setdefault(endpoint, _Breaker(self.cooldown, self._clock()))
+        return breaker
+
+    def retry_after(self, endpoint: str, *, reject: bool = False) -> Optional[float]:
+        """Seconds until ``endpoint`` takes calls again; None when it takes them now.
+
+        With ``reject``, a caller that fails its work because of the answer
+        counts as a rejected call.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None or breaker.state == CLOSED:
+                return None
+            remaining = breaker.retry_at - self._clock()
+            # Due for a probe (open past the cooldown, or half-open with none in flight).
+            if (breaker.state == OPEN and remaining <= 0) or (breaker.state == HALF_OPEN and not breaker.probing):
+                return None
+            if reject:
+                breaker.rejected += 1
+            return max(0.0, remaining)
+
+    def allow(self, endpoint: str) -> bool:
+        """Whether a call may go out now; in half-open state only the one probe may."""
+        if not self.enabled:
+            return True
+        with self._lock:
+            breaker = self._breaker(endpoint)
+            if breaker.state == CLOSED:
+                return True
+            now = self._clock()
+            if breaker.state == OPEN and now >= breaker.retry_at:
+                breaker.state = HALF_OPEN
+                breaker.changed_at = now
+            if breaker.state == HALF_OPEN and not breaker.probing:
+                breaker.probing = True
+                return True
+            breaker.rejected += 1
+            return False
+
+    def record_success(self, endpoint: str) -> None:
+        with self._lock:
+            breaker = self._breaker(endpoint)
+            breaker.failures = 0
+            breaker.probing = False
+            if breaker.state != CLOSED:
+                breaker.state = CLOSED
+                breaker.cooldown = self.cooldown
+                breaker.changed_at = self._clock()
+
+    def record_failure(self, endpoint: str, error: str) -> None:
+        with self._lock:
+            breaker = self._breaker(endpoint)
+            breaker.failures += 1
+            breaker.last_error = error
+            now = self._clock()
+            if breaker.state == HALF_OPEN:
+                breaker.cooldown = min(MAX_COOLDOWN_SECONDS, breaker.cooldown * 2)
+            elif breaker.state == OPEN or breaker.failures < self.failure_threshold:
+                return
+            breaker.state = OPEN
+            breaker.probing = False
+            breaker.retry_at = now + breaker.cooldown
+            breaker.opens += 1
+            breaker.changed_at = now
+
+    def _release(self, endpoint: str) -> None:
+        with self._lock:
+            self._breaker(endpoint).probing = False
+
+    @contextmanager
+    def guard(self, endpoint: str) -> Iterator[None]:
+        """Run the block as one ``endpoint`` call; raises ``ProviderUnavailable`` while open."""
+        if not self.enabled:
+            yield
+            return
+        if not self.allow(endpoint):
+            raise ProviderUnavailable(endpoint, self.retry_after(endpoint) or 0.0)
+        try:
+            yield
+        except Exception as error:
+            if self._is_failure(error):
+                self.record_failure(endpoint, type(error).__name__)
+            else:
+                self.record_success(endpoint)
+            raise
+        except BaseException:
+            # Cancelled (e.g. the losing half of a hedged read): no verdict.
+            self._release(endpoint)
+            raise
+        self.record_success(endpoint)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            endpoints = {}
+            for name, breaker in self._breakers.items():
+                endpoints[name] = {
+                    "state": breaker.state,
+                    "consecutive_failures": breaker.failures,
+                    "opens": breaker.opens,
+                    "rejected": breaker.rejected,
+                    "cooldown_seconds": breaker.cooldown,
+                    "retry_in_seconds": round(max(0.0, breaker.retry_at - now), 3) if breaker.state == OPEN else None,
+                    "last_error": breaker.last_error,
+                    "since_seconds": round(now - breaker.changed_at, 3),
+                }
+            return {
+                "enabled": self.enabled,
+                "failure_threshold": self.failure_threshold,
+                "cooldown_seconds": self.cooldown,
+                "endpoints": endpoints,
+            }
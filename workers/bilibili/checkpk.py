@@ -8,6 +8,12 @@ import os
 import sys
 import signal
 import io
+
+from dns_cache import pin_provider_hosts
+from hedge import Hedger
+from latency import LatencyTracker, report_at_exit
+from room_meta import RoomMetaCache
+
 def load_config():
     try:
         env_path = os.getenv("BILIPK_CONFIG")
@@ -67,6 +73,29 @@ def force_utf8_stdio():
 
 force_utf8_stdio()
 
+# 预先解析 api.live.bilibili.com 并固定地址，轮询和查房间信息时新建连接不再等系统解析器
+PROVIDER_DNS = pin_provider_hosts(["api.live.bilibili.com"], log=print)
+# 超时按本进程观测到的接口耗时 p99 自适应；5 / 8 秒只是样本不够时的起步值
+PROVIDER_LATENCY = LatencyTracker.from_env(timeout_errors=(requests.Timeout,))
+if PROVIDER_DNS is not None:
+    PROVIDER_DNS.on_connect = PROVIDER_LATENCY.observe_connect
+report_at_exit(PROVIDER_LATENCY, print)
+# BILI_HEDGE_READS=1：只读接口慢过 p95 时再发一份，先回来的算数
+PROVIDER_HEDGE = Hedger.from_env(PROVIDER_LATENCY.p95)
+
+
+def provider_get(endpoint, url, headers, default_timeout):
+    """GET 一个只读 provider 接口（get_info / pk/info）：超时自适应，按需对冲"""
+    def attempt():
+        with PROVIDER_LATENCY.timing(endpoint):
+            return requests.get(url, headers=headers, timeout=PROVIDER_LATENCY.timeout(endpoint, default_timeout))
+
+    return PROVIDER_HEDGE.call(endpoint, attempt)
+
+
+# 房间 uid / 开播状态写到本地缓存，normalpk / shousheng / threeserver 启动时直接读
+ROOM_META = RoomMetaCache.from_env()
+
 # 创建stats目录用于记录PK历史
 APP_DATA_DIR = os.path.join(os.getenv("LOCALAPPDATA", os.path.expanduser("~")), "BiliPKTool")
 STATS_DIR = os.path.join(APP_DATA_DIR, "stats")
@@ -106,18 +135,28 @@ def build_worker_cmd(script_name, room_id, pk_id):
     return [sys.executable, os.path.join(BASE_DIR, f"{script_name}.py"), room_id, str(pk_id)]
 
 
+def fetch_room_info(room_id):
+    url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={room_id}"
+    resp = provider_get("get_info", url, HEADERS, 5)
+    resp.raise_for_status()
+    return resp.json().get("data", {})
+
+
 def is_live(room_id):
     try:
-        url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={room_id}"
-        resp = requests.get(url, headers=HEADERS, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("data", {}).get("live_status", 0) == 1
+        return ROOM_META.live_status(room_id, lambda: fetch_room_info(room_id)) == 1
     except Exception as e:
         print(f"[直播检测异常] {e}")
         return False
 
 
+def get_room_host_uid(room_id):
+    try:
+        return ROOM_META.uid(room_id, lambda: fetch_room_info(room_id))
+    except Exception:
+        return None
+
+
 def send_danmaku(msg):
     print(f"[弹幕禁用] 已禁用弹幕发送: {msg}")
     return
@@ -149,17 +188,7 @@ def has_won_today():
     """检查今天是否已经赢过 type=2 的首胜PK"""
     try:
         # 获取主播UID
-        def get_room_host_uid_temp(room_id):
-            try:
-                url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={room_id}"
-                headers = {"User-Agent": "Mozilla/5.0"}
-                resp = requests.get(url, headers=headers, timeout=5)
-                data = resp.json()
-                return data.get("data", {}).get("uid")
-            except:
-                return None
-
-        my_uid = get_room_host_uid_temp(MONITOR_ROOM_ID)
+        my_uid = get_room_host_uid(MONITOR_ROOM_ID)
         if not my_uid:
             print("[警告] 无法获取主播UID，无法判断首胜状态")
             return False
@@ -228,7 +257,7 @@ def check_pk_result(pk_id, pk_type=None):
             time.sleep(1)  # 每次等待1秒
 
             url = f"https://api.live.bilibili.com/xlive/general-interface/v2/pk/info?room_id={MONITOR_ROOM_ID}"
-            resp = requests.get(url, headers=HEADERS, timeout=5)
+            resp = provider_get("pk/info", url, HEADERS, 5)
             data = resp.json()
             members = data.get("data", {}).get("members", [])
 
@@ -243,17 +272,7 @@ def check_pk_result(pk_id, pk_type=None):
             return
 
         # 动态获取监控房间的主播UID
-        def get_room_host_uid_temp(room_id):
-            try:
-                url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={room_id}"
-                headers = {"User-Agent": "Mozilla/5.0"}
-                resp = requests.get(url, headers=headers, timeout=5)
-                data = resp.json()
-                return data.get("data", {}).get("uid")
-            except:
-                return None
-
-        my_uid = get_room_host_uid_temp(MONITOR_ROOM_ID)
+        my_uid = get_room_host_uid(MONITOR_ROOM_ID)
         print(f"[连胜检测] 监控房间 {MONITOR_ROOM_ID} 的主播UID: {my_uid}")
         won = False
 
@@ -286,7 +305,7 @@ def check_pk():
     global last_pk_id, shousheng_won
     try:
         url = f"https://api.live.bilibili.com/xlive/general-interface/v2/pk/info?room_id={MONITOR_ROOM_ID}"
-        resp = requests.get(url, headers=HEADERS, timeout=5)
+        resp = provider_get("pk/info", url, HEADERS, 5)
         if resp.status_code != 200:
             print("[ERROR] 请求失败")
             return
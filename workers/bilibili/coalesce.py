@@ -0,0 +1,122 @@
+"""Merge same-gift sends from requests drained together into one provider call."""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# (lane rank, fast timeouts, deadline, id(account), room_id): only requests
+# with equal keys share a provider call, so a PK send never waits on (or
+# shares an uncertain outcome with) wish traffic, nor inherits its deadline.
+JobKey = Tuple[int, bool, Optional[float], int, Optional[str]]
+
+
+class Share:
+    """One request entry's slice of a coalesced send."""
+
+    __slots__ = ("request_index", "entry_index", "count")
+
+    def __init__(self, request_index: int, entry_index: int, count: int):
+        self.request_index = request_index
+        self.entry_index = entry_index
+        self.count = count
+
+
+class CoalescedGift:
+    __slots__ = ("gift_id", "count", "shares")
+
+    def __init__(self, gift_id: str):
+        self.gift_id = gift_id
+        self.count = 0
+        self.shares: List[Share] = []
+
+
+def coalesce_key(item: Dict[str, Any], lane_rank: int) -> JobKey:
+    return (lane_rank, bool(item.get("fast")), item.get("deadline"), id(item.get("account")), item.get("room_id"))
+
+
+def group_jobs(items: Sequence[Any], lane_rank: Dict[str, int], default_lane: str) -> List[Any]:
+    """Drained queue items as dispatch jobs.
+
+    Gift requests (dicts with ``gifts``) with equal ``coalesce_key`` become
+    one list job, higher lanes first; a group of one stays a plain item, and
+    anything else is passed through after them.
+    """
+    groups: Dict[JobKey, List[Dict[str, Any]]] = {}
+    others: List[Any] = []
+    for item in items:
+        if isinstance(item, dict) and "gifts" in item:
+            rank = lane_rank.get(item.get("lane"), lane_rank[default_lane])
+            groups.setdefault(coalesce_key(item, rank), []).append(item)
+        else:
+            others.append(item)
+    jobs: List[Any] = []
+    for key, group in sorted(groups.items(), key=lambda entry: entry[0][0]):
+        if len(group) > 1:
+            jobs.append(group)
+        else:
+            jobs.extend(group)
+    jobs.extend(others)
+    return jobs
+
+
+def coalesce_requests(requests: Sequence[Sequence[Tuple[str, int]]], max_count: int) -> List[CoalescedGift]:
+    """Group ``(gift_id, count)`` entries of several requests by gift id.
+
+    Shares keep request order, which is the drain (priority, deadline)
+    order. A new send is started rather than pushing one past ``max_count``;
+    a single entry is never split across sends.
+    """
+    merged: List[CoalescedGift] = []
+    open_by_gift: Dict[str, CoalescedGift] = {}
+    for request_index, entries in enumerate(requests):
+        for entry_index, (gift_id, count) in enumerate(entries):
+            current = open_by_gift.get(gift_id)
+            if current is None or current.count + count > max_count:
+                current = CoalescedGift(gift_id)
+                open_by_gift[gift_id] = current
+                merged.append(current)
+            current.count += count
+            current.shares.append(Share(request_index, entry_index, count))
+    return merged
+
+
+def split_result(result: Dict[str, Any], gift: CoalescedGift) -> List[Dict[str, Any]]:
+    """Turn one provider result for ``gift`` into one result per share.
+
+    Units the provider confirmed are credited to shares in order, so when
+    a bag stack covers only part of the merged count the earliest requests
+    are the ones reported as sent. If any part is uncertain, every share is
+    uncertain: nobody can tell whose units went through.
+    """
+    parts = result.get("parts") if result.get("mode") == "split" else [result]
+    parts = [part for part in parts or [] if isinstance(part, dict)]
+    uncertain = bool(result.get("outcome_uncertain")) or any(part.get("outcome_uncertain") for part in parts)
+    confirmed = sum(int(part.get("count") or 0) for part in parts if part.get("success"))
+    transaction_ids = [
+        str(part["provider_transaction_id"]) for part in parts if part.get("provider_transaction_id")
+    ]
+    requests = len({share.request_index for share in gift.shares})
+    split: List[Dict[str, Any]] = []
+    for share in gift.shares:
+        covered = 0 if uncertain else min(share.count, confirmed)
+        confirmed -= covered
+        entry: Dict[str, Any] = {
+            "id": gift.gift_id,
+            "count": share.count,
+            "success": not uncertain and covered == share.count,
+            "status_code": parts[-1].get("status_code") if parts else result.get("status_code"),
+            "mode": result.get("mode"),
+            "outcome_uncertain": uncertain,
+            "coalesced": {"requests": requests, "count": gift.count},
+        }
+        if covered or uncertain:
+            if len(transaction_ids) == 1:
+                entry["provider_transaction_id"] = transaction_ids[0]
+            elif transaction_ids:
+                entry["provider_transaction_ids"] = transaction_ids
+        if not entry["success"] and not uncertain:
+            entry["sent_count"] = covered
+        if result.get("error"):
+            entry["error"] = result["error"]
+        split.append(entry)
+    return split
@@ -0,0 +1,156 @@
+"""A danmaku lane with its own worker thread, connection and pacing."""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+DEFAULT_MIN_INTERVAL_SECONDS = 1.0
+DEFAULT_MAX_PENDING = 20
+MAX_BACKOFF_FACTOR = 8
+_SAMPLES = 128
+
+
+def _summary(samples: Deque[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "max": None}
+    ordered = sorted(samples)
+    return {"p50": round(ordered[len(ordered) // 2], 3), "max": round(ordered[-1], 3)}
+
+
+class DanmakuLane:
+    """Send chat messages one at a time, at most one per ``min_interval``.
+
+    Gifts and danmaku used to share the send queue's drain loop, so a burst
+    of gifts held chat back and a slow danmaku (plus its post delay) held
+    the next gift cycle back. The lane owns a thread and ``send`` owns its
+    connection, so the two never wait on each other.
+
+    ``send(text)`` returns a result dict; ``success`` marks a delivered
+    message and ``rate_limited`` a message the provider refused for
+    frequency. A refused message is requeued at the front once and the
+    interval doubles (up to ``MAX_BACKOFF_FACTOR`` times) until a send goes
+    through. Messages beyond ``max_pending`` are refused at ``offer``.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Dict[str, Any]],
+        *,
+        min_interval: float = DEFAULT_MIN_INTERVAL_SECONDS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        log: Callable[[str], None] = print,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._send = send
+        self.min_interval = max(0.0, float(min_interval))
+        self.max_pending = max(1, int(max_pending))
+        self._log = log
+        self._clock = clock
+        self._interval = self.min_interval
+        self._next_at = 0.0
+        self._pending: Deque[Tuple[str, float, bool]] = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self._waits: Deque[float] = deque(maxlen=_SAMPLES)
+        self._send_ms: Deque[float] = deque(maxlen=_SAMPLES)
+
+    def offer(self, text: str) -> bool:
+        """Queue ``text``; False when the lane is full or closed."""
+        with self._condition:
+            if self._closed or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append((text, self._clock(), False))
+            self._condition.notify()
+            return True
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def start(self) -> threading.Thread:
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="danmaku", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _next(self) -> Optional[Tuple[str, float, bool]]:
+        with self._condition:
+            while not self._closed:
+                if self._pending:
+                    remaining = self._next_at - self._clock()
+                    if remaining <= 0:
+                        return self._pending.popleft()
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+            return None
+
+    def run_once(self) -> bool:
+        """Send the next message once its slot comes up; False after ``close``."""
+        entry = self._next()
+        if entry is None:
+            return False
+        text, queued_at, retried = entry
+        started = self._clock()
+        try:
+            result = self._send(text)
+        except Exception as error:
+            result = {"success": False, "error": type(error).__name__}
+        finished = self._clock()
+        with self._condition:
+            self._waits.append((started - queued_at) * 1000.0)
+            self._send_ms.append((finished - started) * 1000.0)
+            if result.get("rate_limited"):
+                self.rate_limited += 1
+                floor = max(self.min_interval, 0.5)
+                self._interval = min(floor * MAX_BACKOFF_FACTOR, max(self._interval * 2, floor))
+                if not retried:
+                    self._pending.appendleft((text, queued_at, True))
+                else:
+                    self.failed += 1
+            elif result.get("success"):
+                self.sent += 1
+                self._interval = self.min_interval
+            else:
+                self.failed += 1
+            self._next_at = finished + self._interval
+            requeued = result.get("rate_limited") and not retried
+        if result.get("success"):
+            self._log("✅ 弹幕发送成功")
+        elif not requeued:
+            self._log(f"❌ 弹幕发送失败: {result}")
+        return True
+
+    def _run(self) -> None:
+        while self.run_once():
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "min_interval_seconds": self.min_interval,
+                "interval_seconds": self._interval,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "rate_limited": self.rate_limited,
+                "queue_wait_ms": _summary(self._waits),
+                "send_ms": _summary(self._send_ms),
+            }
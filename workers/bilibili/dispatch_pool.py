@@ -0,0 +1,78 @@
+"""Bounded, priority-ordered thread pool for threeserver provider calls."""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+
+class PriorityPool:
+    """Fixed number of worker threads that run the lowest priority value first.
+
+    ``ThreadPoolExecutor`` is FIFO, so a PK gift submitted behind a 20-item
+    wish batch would wait for all of them. Here each task carries the rank of
+    the lane it came from and ties fall back to submission order.
+    """
+
+    def __init__(self, workers: int, name: str = "dispatch"):
+        self.workers = max(1, int(workers))
+        self._tasks: List[tuple] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition(threading.Lock())
+        self._busy = 0
+        self._completed = 0
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, priority: int, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("pool is shut down")
+            heapq.heappush(self._tasks, (int(priority), next(self._sequence), future, fn, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._tasks and not self._closed:
+                    self._condition.wait()
+                if not self._tasks:
+                    return
+                _priority, _sequence, future, fn, args, kwargs = heapq.heappop(self._tasks)
+                self._busy += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as error:
+                        future.set_exception(error)
+            finally:
+                with self._condition:
+                    self._busy -= 1
+                    self._completed += 1
+
+    def shutdown(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "queued": len(self._tasks),
+                "completed": self._completed,
+            }
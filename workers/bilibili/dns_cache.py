@@ -0,0 +1,290 @@
+"""Provider host addresses resolved in the background and pinned for new connections."""
+
+from __future__ import annotations
+
+import atexit
+import ipaddress
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+# (family, type, proto, sockaddr) as getaddrinfo returns them, minus canonname.
+Address = Tuple[int, int, int, Tuple[Any, ...]]
+
+MIN_RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 30.0
+
+
+class _Host:
+    __slots__ = (
+        "name", "addresses", "resolved_at", "next_refresh", "retry", "resolutions",
+        "resolve_failures", "resolve_ms", "hits", "stale_hits", "misses",
+        "connect_failures", "failovers",
+    )
+
+    def __init__(self, name: str):
+        self.name = name
+        self.addresses: List[Address] = []
+        self.resolved_at: Optional[float] = None
+        self.next_refresh = 0.0
+        self.retry = MIN_RETRY_SECONDS
+        self.resolutions = 0
+        self.resolve_failures = 0
+        self.resolve_ms: Deque[float] = deque(maxlen=64)
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.connect_failures = 0
+        self.failovers = 0
+
+
+class DnsCache:
+    """Addresses for ``hosts``, refreshed off the send path.
+
+    ``getaddrinfo`` does not expose record TTLs, so every host is kept for
+    ``ttl`` seconds and re-resolved at half of it. A failed lookup keeps the
+    last good addresses (served as stale) and retries with backoff, so a
+    resolver outage never takes away addresses that worked. Connections try
+    the addresses in order; one that refuses or times out moves to the back.
+    Only a host that was never resolved falls back to a blocking lookup.
+    """
+
+    def __init__(
+        self,
+        hosts: Iterable[str],
+        *,
+        ttl: float = 60.0,
+        resolver: Callable[..., List[Tuple[Any, ...]]] = socket.getaddrinfo,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = max(1.0, float(ttl))
+        self._resolver = resolver
+        self._clock = clock
+        self._hosts: Dict[str, _Host] = {}
+        for host in hosts:
+            name = str(host).strip().lower()
+            if name and not _is_ip_literal(name):
+                self._hosts[name] = _Host(name)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Called with (seconds, timed_out) for every connect attempt to a pinned address.
+        self.on_connect: Optional[Callable[[float, bool], None]] = None
+
+    def __contains__(self, host: object) -> bool:
+        return str(host).lower() in self._hosts
+
+    def refresh(self, host: str) -> bool:
+        """Resolve ``host`` now (blocking); keeps the old addresses on failure."""
+        entry = self._hosts.get(str(host).lower())
+        if entry is None:
+            return False
+        started = time.perf_counter()
+        try:
+            infos = self._resolver(entry.name, None, 0, socket.SOCK_STREAM)
+        except OSError:
+            infos = []
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        fresh: List[Address] = []
+        for family, socktype, proto, _canonname, sockaddr in infos:
+            address = (family, socktype or socket.SOCK_STREAM, proto, tuple(sockaddr))
+            if address not in fresh:
+                fresh.append(address)
+        now = self._clock()
+        with self._lock:
+            entry.resolve_ms.append(elapsed_ms)
+            if not fresh:
+                entry.resolve_failures += 1
+                entry.next_refresh = now + entry.retry
+                entry.retry = min(MAX_RETRY_SECONDS, entry.retry * 2)
+                return False
+            # Keep the current failover order for addresses that are still
+            # listed; new ones go after them.
+            kept = [address for address in entry.addresses if address in fresh]
+            entry.addresses = kept + [address for address in fresh if address not in kept]
+            entry.resolved_at = now
+            entry.next_refresh = now + self.ttl / 2
+            entry.retry = MIN_RETRY_SECONDS
+            entry.resolutions += 1
+            return True
+
+    def refresh_due(self) -> float:
+        """Refresh every host whose time has come; returns seconds until the next one."""
+        now = self._clock()
+        for entry in list(self._hosts.values()):
+            if entry.next_refresh <= now:
+                self.refresh(entry.name)
+        with self._lock:
+            upcoming = min((entry.next_refresh for entry in self._hosts.values()), default=now + self.ttl)
+        return max(0.0, upcoming - self._clock())
+
+    def addresses(self, host: str) -> Optional[List[Address]]:
+        """The pinned addresses in failover order; None when unknown or never resolved."""
+        entry = self._hosts.get(str(host).lower())
+        if entry is None:
+            return None
+        with self._lock:
+            if not entry.addresses:
+                entry.misses += 1
+                self._wake.set()
+                return None
+            if self._clock() - entry.resolved_at >= self.ttl:
+                entry.stale_hits += 1
+            else:
+                entry.hits += 1
+            return list(entry.addresses)
+
+    def report_failure(self, host: str, address: Address) -> None:
+        entry = self._hosts.get(str(host).lower())
+        if entry is None:
+            return
+        with self._lock:
+            entry.connect_failures += 1
+            if address in entry.addresses and entry.addresses[-1] != address:
+                entry.addresses.remove(address)
+                entry.addresses.append(address)
+
+    def create_connection(
+        self,
+        address: Tuple[str, int],
+        timeout: Optional[float],
+        source_address: Optional[Tuple[str, int]] = None,
+        socket_options: Optional[Iterable[Tuple[int, int, Any]]] = None,
+        *,
+        fallback: Callable[..., socket.socket],
+    ) -> socket.socket:
+        """Connect like ``socket.create_connection`` but to the pinned addresses.
+
+        ``fallback`` gets the original arguments for hosts that are not
+        pinned or not resolved yet.
+        """
+        host, port = address
+        pinned = self.addresses(host)
+        if not pinned:
+            return fallback(address, timeout, source_address=source_address, socket_options=socket_options)
+        last_error: Optional[OSError] = None
+        for index, (family, socktype, proto, sockaddr) in enumerate(pinned):
+            sock = None
+            started = time.monotonic()
+            try:
+                sock = socket.socket(family, socktype, proto)
+                for option in socket_options or ():
+                    sock.setsockopt(*option)
+                sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect((sockaddr[0], port) + tuple(sockaddr[2:]))
+                if self.on_connect is not None:
+                    self.on_connect(time.monotonic() - started, False)
+                if index:
+                    with self._lock:
+                        self._hosts[host.lower()].failovers += 1
+                return sock
+            except OSError as connect_error:
+                last_error = connect_error
+                if self.on_connect is not None and isinstance(connect_error, socket.timeout):
+                    self.on_connect(time.monotonic() - started, True)
+                if sock is not None:
+                    sock.close()
+                self.report_failure(host, (family, socktype, proto, sockaddr))
+        raise last_error if last_error is not None else OSError(f"no usable address for {host}")
+
+    def start(self) -> threading.Thread:
+        """Resolve every host now and keep them fresh on a daemon thread."""
+        def _run() -> None:
+            while True:
+                self._wake.wait(self.refresh_due())
+                if self._wake.is_set():
+                    self._wake.clear()
+                    with self._lock:
+                        for entry in self._hosts.values():
+                            if not entry.addresses:
+                                entry.next_refresh = min(entry.next_refresh, self._clock())
+
+        thread = threading.Thread(target=_run, name="dns-cache", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            hosts = {}
+            for entry in self._hosts.values():
+                samples = sorted(entry.resolve_ms)
+                hosts[entry.name] = {
+                    "addresses": [address[3][0] for address in entry.addresses],
+                    "age_seconds": None if entry.resolved_at is None else round(now - entry.resolved_at, 3),
+                    "stale": entry.resolved_at is not None and now - entry.resolved_at >= self.ttl,
+                    "resolutions": entry.resolutions,
+                    "resolve_failures": entry.resolve_failures,
+                    "resolve_ms_last": round(entry.resolve_ms[-1], 3) if entry.resolve_ms else None,
+                    "resolve_ms_p50": round(samples[len(samples) // 2], 3) if samples else None,
+                    "resolve_ms_max": round(samples[-1], 3) if samples else None,
+                    "hits": entry.hits,
+                    "stale_hits": entry.stale_hits,
+                    "misses": entry.misses,
+                    "connect_failures": entry.connect_failures,
+                    "failovers": entry.failovers,
+                }
+            return {"ttl_seconds": self.ttl, "hosts": hosts}
+
+
+def _is_ip_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return False
+    return True
+
+
+def install_urllib3(cache: DnsCache) -> None:
+    """Route urllib3 (and so ``requests``) connections for pinned hosts through ``cache``.
+
+    urllib3 looks ``create_connection`` up on its ``util.connection`` module
+    for every new socket; hosts the cache does not pin keep the original.
+    """
+    from urllib3.util import connection as urllib3_connection
+    from urllib3.util.timeout import _DEFAULT_TIMEOUT
+
+    original = getattr(urllib3_connection.create_connection, "__wrapped__", urllib3_connection.create_connection)
+
+    def create_connection(address, timeout=_DEFAULT_TIMEOUT, source_address=None, socket_options=None):
+        if timeout is _DEFAULT_TIMEOUT:
+            timeout = socket.getdefaulttimeout()
+        return cache.create_connection(
+            address, timeout, source_address, socket_options, fallback=original,
+        )
+
+    create_connection.__wrapped__ = original
+    urllib3_connection.create_connection = create_connection
+
+
+def pin_provider_hosts(hosts: Iterable[str], *, log: Optional[Callable[[str], None]] = None) -> Optional[DnsCache]:
+    """Start a DNS cache for ``hosts`` and install it for ``requests``.
+
+    Off with ``BILI_DNS_CACHE=0``; ``BILI_DNS_TTL_SECONDS`` sets the TTL.
+    With ``log``, a one-line summary of resolution times is written at exit.
+    """
+    if str(os.getenv("BILI_DNS_CACHE", "1") or "1").strip().lower() in ("0", "false", "no", "n", "off"):
+        return None
+    cache = DnsCache(hosts, ttl=float(os.getenv("BILI_DNS_TTL_SECONDS", "60") or 60))
+    if not cache.stats()["hosts"]:
+        return None
+    try:
+        install_urllib3(cache)
+    except ImportError:
+        return None
+    cache.start()
+    if log is not None:
+        def _report() -> None:
+            for host, info in cache.stats()["hosts"].items():
+                log(
+                    f"[DNS] {host}: {info['addresses']} 解析{info['resolutions']}次 "
+                    f"失败{info['resolve_failures']}次 p50={info['resolve_ms_p50']}ms max={info['resolve_ms_max']}ms "
+                    f"命中{info['hits']} 过期命中{info['stale_hits']} 未命中{info['misses']} 切换{info['failovers']}"
+                )
+
+        atexit.register(_report)
+    return cache
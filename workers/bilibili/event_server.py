@@ -0,0 +1,486 @@
+"""An asyncio HTTP/1.1 server for a WSGI app whose waiting requests park instead of holding a thread."""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+# environ key under which a handler finds its request's Parking.
+PARKING_ENVIRON_KEY = "event_server.parking"
+
+DEFAULT_MAX_CONNECTIONS = 1000
+DEFAULT_MAX_WAITING = 1000
+DEFAULT_APP_THREADS = 8
+DEFAULT_KEEPALIVE_SECONDS = 30.0
+DEFAULT_STREAM_KEEPALIVE_SECONDS = 15.0
+MAX_BODY_BYTES = 1 << 20
+MAX_HEADERS = 100
+_HOP_BY_HOP = frozenset({"connection", "content-length", "keep-alive", "transfer-encoding"})
+
+# finish(completed) -> (JSON payload, status code)
+Finish = Callable[[bool], Tuple[Any, int]]
+# poll() -> bytes ready now (b"" for none yet), None once the stream is over
+Poll = Callable[[], Optional[bytes]]
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: int = 400):
+        super().__init__(status)
+        self.status = status
+
+
+class Waiter:
+    """A thread-safe ``set()`` that wakes a coroutine on the server's loop.
+
+    Stands in for the ``threading.Event`` a producer thread would set; the
+    request waiting on it holds no thread.
+    """
+
+    __slots__ = ("_loop", "_future", "_set")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._future: Optional[asyncio.Future] = None
+        self._set = False
+
+    def set(self) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass  # the loop is gone; nobody is waiting any more
+
+    def is_set(self) -> bool:
+        return self._set
+
+    def clear(self) -> None:
+        # Loop thread only; a set() already scheduled still lands afterwards.
+        self._set = False
+        self._future = None
+
+    def _wake(self) -> None:
+        self._set = True
+        if self._future is not None and not self._future.done():
+            self._future.set_result(True)
+
+    async def wait(self, timeout: float) -> bool:
+        if self._set:
+            return True
+        self._future = self._loop.create_future()
+        try:
+            await asyncio.wait_for(self._future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._set
+
+
+class Parking:
+    """Per-request handle a handler uses to answer later without blocking.
+
+    ``event()`` returns a ``Waiter`` to hand to the producer (None when
+    ``max_waiting`` requests are already parked: shed the request). After
+    queueing the work, ``defer(timeout, finish)`` tells the server to wait
+    for the waiter, then answer with ``finish(completed)``; whatever the
+    handler returns is then ignored. A handler that never calls ``defer``
+    is answered with its own response as usual.
+
+    ``stream(poll, ...)`` instead answers with a body written piece by
+    piece as ``poll()`` has bytes ready, for as long as it keeps returning
+    bytes; the connection is closed at the end.
+    """
+
+    __slots__ = ("_server", "waiter", "timeout", "finish", "streamer", "poll", "content_type", "on_close",
+                 "keepalive", "keepalive_seconds")
+
+    def __init__(self, server: "EventLoopServer"):
+        self._server = server
+        self.waiter: Optional[Waiter] = None
+        self.timeout = 0.0
+        self.finish: Optional[Finish] = None
+        self.streamer: Optional[Waiter] = None
+        self.poll: Optional[Poll] = None
+        self.content_type = ""
+        self.on_close: Optional[Callable[[], None]] = None
+        self.keepalive = b""
+        self.keepalive_seconds = DEFAULT_STREAM_KEEPALIVE_SECONDS
+
+    def event(self) -> Optional[Waiter]:
+        if self.waiter is None:
+            self.waiter = self._server._claim_waiter()
+        return self.waiter
+
+    def defer(self, timeout: float, finish: Finish) -> None:
+        if self.waiter is None:
+            raise RuntimeError("defer() without event()")
+        self.timeout = float(timeout)
+        self.finish = finish
+
+    def stream(
+        self,
+        poll: Poll,
+        *,
+        content_type: str,
+        on_close: Optional[Callable[[], None]] = None,
+        keepalive: bytes = b"",
+        keepalive_seconds: float = DEFAULT_STREAM_KEEPALIVE_SECONDS,
+    ) -> Waiter:
+        """Stream ``poll()``'s output; the producer sets the returned Waiter when more is ready.
+
+        ``poll`` runs on the loop and must not block. ``keepalive`` is written
+        after ``keepalive_seconds`` without output (and ``poll`` asked again);
+        ``on_close`` runs once the stream ends or the client goes away.
+        """
+        if self.waiter is not None:
+            raise RuntimeError("stream() after event()")
+        self.poll = poll
+        self.content_type = content_type
+        self.on_close = on_close
+        self.keepalive = keepalive
+        self.keepalive_seconds = max(0.01, float(keepalive_seconds))
+        self.streamer = Waiter(self._server._loop)
+        return self.streamer
+
+
+class EventLoopServer:
+    """Serve ``app`` (WSGI) from one asyncio loop.
+
+    Connections and parked requests cost a coroutine each; the WSGI handler
+    itself runs on a pool of ``app_threads`` and returns as soon as it has
+    queued its work; a streamed response likewise holds no thread between
+    writes. Past ``max_connections`` open connections new ones get
+    503 and are closed. ``dumps`` encodes deferred answers.
+    """
+
+    def __init__(
+        self,
+        app: Callable[..., Any],
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_waiting: int = DEFAULT_MAX_WAITING,
+        app_threads: int = DEFAULT_APP_THREADS,
+        keepalive_seconds: float = DEFAULT_KEEPALIVE_SECONDS,
+        dumps: Callable[[Any], str] = json.dumps,
+    ):
+        self._app = app
+        self.host = host
+        self.port = int(port)
+        self.max_connections = max(1, int(max_connections))
+        self.max_waiting = max(0, int(max_waiting))
+        self.app_threads = max(1, int(app_threads))
+        self.keepalive_seconds = float(keepalive_seconds)
+        self._dumps = dumps
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.peak_connections = 0
+        self.refused_connections = 0
+        self.requests = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.waiting_refused = 0
+        self.wait_timeouts = 0
+        self.streams = 0
+        self.peak_streams = 0
+
+    # -- parked requests --------------------------------------------------
+
+    def _claim_waiter(self) -> Optional[Waiter]:
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                self.waiting_refused += 1
+                return None
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+        return Waiter(self._loop)
+
+    def _release_waiter(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+
+    # -- HTTP ---------------------------------------------------------------
+
+    async def _read_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").rstrip("\r\n").split(" ")
+        except ValueError:
+            raise _BadRequest()
+        if not version.startswith("HTTP/1."):
+            raise _BadRequest(HTTPStatus.HTTP_VERSION_NOT_SUPPORTED)
+        headers: List[Tuple[str, str]] = []
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, sep, value = line.decode("latin-1").partition(":")
+            if not sep or len(headers) >= MAX_HEADERS:
+                raise _BadRequest()
+            headers.append((name.strip(), value.strip()))
+        lookup = {name.lower(): value for name, value in headers}
+        if lookup.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        if "chunked" in lookup.get("transfer-encoding", "").lower():
+            body = await self._read_chunked(reader)
+        else:
+            try:
+                length = int(lookup.get("content-length") or 0)
+            except ValueError:
+                raise _BadRequest()
+            if length < 0:
+                raise _BadRequest()
+            if length > MAX_BODY_BYTES:
+                raise _BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await reader.readexactly(length) if length else b""
+        return method, target, version, headers, lookup, body
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks: List[bytes] = []
+        size = 0
+        while True:
+            try:
+                length = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise _BadRequest()
+            if length == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            size += length
+            if size > MAX_BODY_BYTES:
+                raise _BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            chunks.append(await reader.readexactly(length))
+            await reader.readexactly(2)
+
+    def _environ(self, method: str, target: str, version: str, headers: List[Tuple[str, str]],
+                 body: bytes, peer: Any, parking: Parking) -> Dict[str, Any]:
+        path, _, query = target.partition("?")
+        environ: Dict[str, Any] = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": peer[0] if isinstance(peer, tuple) else "",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            PARKING_ENVIRON_KEY: parking,
+        }
+        for name, value in headers:
+            key = name.upper().replace("-", "_")
+            if key == "CONTENT_TYPE":
+                environ[key] = value
+            elif key not in ("CONTENT_LENGTH", "TRANSFER_ENCODING"):
+                key = "HTTP_" + key
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _call_app(self, environ: Dict[str, Any]) -> Tuple[str, List[Tuple[str, str]], bytes]:
+        chunks: List[bytes] = []
+        started: List[Any] = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+            return chunks.append
+
+        result = self._app(environ, start_response)
+        try:
+            chunks.extend(result)
+        finally:
+            close = getattr(result, "close", None)
+            if close is not None:
+                close()
+        return started[0], list(started[1]), b"".join(chunks)
+
+    async def _respond(self, method, target, version, headers, body, peer,
+                       parking: Parking) -> Tuple[str, List[Tuple[str, str]], bytes]:
+        environ = self._environ(method, target, version, headers, body, peer, parking)
+        try:
+            status, response_headers, payload = await self._loop.run_in_executor(self._pool, self._call_app, environ)
+            if parking.finish is not None:
+                completed = await parking.waiter.wait(parking.timeout)
+                if not completed:
+                    self.wait_timeouts += 1
+                answer, code = parking.finish(completed)
+                status = f"{code} {HTTPStatus(code).phrase}"
+                response_headers = [("Content-Type", "application/json")]
+                payload = (self._dumps(answer) + "\n").encode("utf-8")
+        except Exception as error:
+            print(f"❌ {method} {target}: {type(error).__name__}: {error}", file=sys.stderr)
+            status, response_headers, payload = "500 Internal Server Error", [("Content-Type", "text/plain")], b"internal error"
+        finally:
+            if parking.waiter is not None:
+                self._release_waiter()
+        return status, response_headers, payload
+
+    @staticmethod
+    def _encode(status: str, headers: List[Tuple[str, str]], payload: bytes, *, keep_alive: bool, head: bool,
+                streamed: bool = False) -> bytes:
+        lines = [f"HTTP/1.1 {status}"]
+        lines.extend(f"{name}: {value}" for name, value in headers if name.lower() not in _HOP_BY_HOP)
+        if not streamed:
+            lines.append(f"Content-Length: {len(payload)}")
+        lines.append(f"Date: {formatdate(usegmt=True)}")
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        head_bytes = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        return head_bytes if head else head_bytes + payload
+
+    def _error(self, status: int) -> bytes:
+        phrase = HTTPStatus(status).phrase
+        payload = self._dumps({"error": phrase.lower().replace(" ", "_")}).encode("utf-8")
+        return self._encode(f"{status} {phrase}", [("Content-Type", "application/json")], payload, keep_alive=False, head=False)
+
+    async def _stream(self, writer: asyncio.StreamWriter, parking: Parking, status: str,
+                      response_headers: List[Tuple[str, str]], payload: bytes, *, head: bool) -> None:
+        # No Content-Length: the body ends when the connection closes.
+        waiter = parking.streamer
+        self.streams += 1
+        self.peak_streams = max(self.peak_streams, self.streams)
+        try:
+            if not status.startswith("2"):
+                # The handler failed after stream(): send its own answer.
+                writer.write(self._encode(status, response_headers, payload, keep_alive=False, head=head))
+                head = True
+            else:
+                headers = [("Content-Type", parking.content_type), ("Cache-Control", "no-cache")]
+                writer.write(self._encode("200 OK", headers, b"", keep_alive=False, head=True, streamed=True))
+            await writer.drain()
+            while not head:
+                waiter.clear()
+                chunk = parking.poll()
+                if chunk is None:
+                    break
+                if chunk:
+                    writer.write(chunk)
+                    await writer.drain()
+                elif not await waiter.wait(parking.keepalive_seconds) and parking.keepalive:
+                    writer.write(parking.keepalive)
+                    await writer.drain()
+        finally:
+            self.streams -= 1
+            if parking.on_close is not None:
+                try:
+                    parking.on_close()
+                except Exception as error:
+                    print(f"❌ stream close: {type(error).__name__}: {error}", file=sys.stderr)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if self.connections >= self.max_connections:
+            self.refused_connections += 1
+            writer.write(self._error(HTTPStatus.SERVICE_UNAVAILABLE))
+            writer.close()
+            return
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    parsed = await asyncio.wait_for(self._read_request(reader, writer), self.keepalive_seconds)
+                except _BadRequest as bad:
+                    writer.write(self._error(bad.status))
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, ConnectionError):
+                    # idle keep-alive, peer went away, or a line past the reader's limit
+                    break
+                if parsed is None:
+                    break
+                method, target, version, headers, lookup, body = parsed
+                self.requests += 1
+                parking = Parking(self)
+                status, response_headers, payload = await self._respond(method, target, version, headers, body, peer, parking)
+                if parking.streamer is not None:
+                    await self._stream(writer, parking, status, response_headers, payload, head=method == "HEAD")
+                    break
+                connection = lookup.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                writer.write(self._encode(status, response_headers, payload, keep_alive=keep_alive, head=method == "HEAD"))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    # -- lifecycle ----------------------------------------------------------
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._pool = ThreadPoolExecutor(self.app_threads, thread_name_prefix="app")
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port, backlog=min(4096, self.max_connections), reuse_address=True,
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass  # stop()
+        finally:
+            self._pool.shutdown(wait=False)
+
+    def serve_forever(self) -> None:
+        asyncio.run(self._serve())
+
+    def start(self, timeout: float = 5.0) -> threading.Thread:
+        """``serve_forever`` on a daemon thread; returns once the port is bound."""
+        thread = threading.Thread(target=self.serve_forever, name="event-server", daemon=True)
+        thread.start()
+        if not self._started.wait(timeout):
+            raise RuntimeError("event server did not start")
+        return thread
+
+    def stop(self) -> None:
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waiting, peak_waiting, waiting_refused = self.waiting, self.peak_waiting, self.waiting_refused
+        return {
+            "server": "event_loop",
+            "app_threads": self.app_threads,
+            "max_connections": self.max_connections,
+            "max_waiting": self.max_waiting,
+            "connections": self.connections,
+            "peak_connections": self.peak_connections,
+            "refused_connections": self.refused_connections,
+            "requests": self.requests,
+            "waiting": waiting,
+            "peak_waiting": peak_waiting,
+            "waiting_refused": waiting_refused,
+            "wait_timeouts": self.wait_timeouts,
+            "streams": self.streams,
+            "peak_streams": self.peak_streams,
+        }
@@ -0,0 +1,228 @@
+"""Transport-free sendGift protocol shared by the threeserver HTTP backends.
+
+``gift_send_steps`` is a generator: it yields each sendGift POST (count,
+bag_id and the encoded form body) and is resumed with the transport's
+``(ok, status_code, body, outcome_uncertain)`` tuple. The requests (thread
+pool) and httpx (asyncio) backends only differ in how they perform the POST,
+so the bag-first split, the no-fallthrough rule after an ambiguous or
+``provider_unavailable`` response and the result shape live here once.
+``BagIndex`` plans which bag stacks each gift of a batch uses.
+"""
+
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, Generator, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import quote_plus, urlencode
+
+PostOutcome = Tuple[bool, int, Dict[str, Any], bool]
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+# Message of the outcome a transport reports when it did not make the call
+# at all (circuit breaker open): a certain non-send.
+PROVIDER_UNAVAILABLE = "provider_unavailable"
+PARTIAL_FAILED = "partial_failed"
+
+
+class GiftPost(NamedTuple):
+    num: int
+    bag_id: str
+    body: bytes
+
+
+GiftSteps = Generator[GiftPost, PostOutcome, Dict[str, Any]]
+# (bag_id, num) sendGift calls that spend bag stacks, in send order.
+BagPlan = List[Tuple[str, int]]
+
+
+def provider_transaction_id(body: Dict[str, Any]) -> Optional[str]:
+    data = body.get("data") if isinstance(body, dict) else None
+    candidates = [body, data] if isinstance(data, dict) else [body]
+    for candidate in candidates:
+        if not isinstance(candidate, dict):
+            continue
+        for key in ("transaction_id", "transactionId", "order_id", "orderId", "tid"):
+            value = candidate.get(key)
+            if isinstance(value, (str, int)) and 1 <= len(str(value)) <= 200:
+                return str(value)
+    return None
+
+
+def provider_unavailable(body: Any) -> bool:
+    return isinstance(body, dict) and body.get("message") == PROVIDER_UNAVAILABLE
+
+
+def _unavailable_result(gift_id: str, count: int, mode: str) -> Dict[str, Any]:
+    return {
+        "id": str(gift_id), "count": count, "success": False, "status_code": 0, "mode": mode,
+        "error": PROVIDER_UNAVAILABLE, "outcome_uncertain": False,
+    }
+
+
+def sendgift_payload(*, csrf: str, room_id: str, ruid: int, gift_id: str, num: int, bag_id: Any = "0") -> Dict[str, str]:
+    return {
+        "gift_id": str(gift_id),
+        "room_id": str(room_id),
+        "roomid": str(room_id),
+        "ruid": str(ruid),
+        "num": str(num),
+        "gift_num": str(num),
+        "bag_id": str(bag_id),
+        "biz_id": str(room_id),
+        "platform": "pc",
+        "csrf": csrf,
+        "csrf_token": csrf,
+    }
+
+
+class SendGiftForm:
+    """The sendGift form for one (account, room, ruid, gift), urlencoded once.
+
+    Only ``num`` (twice) and ``bag_id`` change between sends, so the body is
+    kept as the encoded pieces around them and a send joins seven byte
+    strings. ``headers`` is whatever the transport sends with every POST.
+    """
+
+    __slots__ = ("gift_id", "headers", "_pieces")
+
+    def __init__(self, *, csrf: str, room_id: str, ruid: int, gift_id: str, headers: Optional[Dict[str, str]] = None):
+        self.gift_id = str(gift_id)
+        self.headers = headers if headers is not None else {"Content-Type": FORM_CONTENT_TYPE}
+        fixed = sendgift_payload(csrf=csrf, room_id=room_id, ruid=ruid, gift_id=gift_id, num=0)
+        # Same field order as sendgift_payload, so the bytes match urlencode(payload).
+        head = urlencode([(key, fixed[key]) for key in ("gift_id", "room_id", "roomid", "ruid")])
+        tail = urlencode([(key, fixed[key]) for key in ("biz_id", "platform", "csrf", "csrf_token")])
+        self._pieces = (f"{head}&num=".encode(), b"&gift_num=", b"&bag_id=", f"&{tail}".encode())
+
+    def post(self, num: int, bag_id: Any = "0") -> GiftPost:
+        head, gift_num, bag, tail = self._pieces
+        count = str(int(num)).encode()
+        bag_id = str(bag_id)
+        return GiftPost(int(num), bag_id, b"".join((head, count, gift_num, count, bag, quote_plus(bag_id).encode(), tail)))
+
+
+class BagIndex:
+    """One bag snapshot indexed by gift_id, handed out to a batch's gifts.
+
+    ``take`` picks the stacks for one gift in the fewest sendGift calls:
+    the soonest-expiring stack that covers the rest by itself, otherwise
+    the largest stack, and again for what is left. Taken counts are
+    reserved, so later gifts of the same batch plan against what the
+    earlier ones leave. The snapshot itself is not changed.
+    """
+
+    __slots__ = ("_stacks",)
+
+    def __init__(self, bag_items: Optional[Iterable[Dict[str, Any]]]):
+        stacks: Dict[str, List[List[Any]]] = {}
+        for it in bag_items or ():
+            try:
+                bag_id = it.get("bag_id") or it.get("id")
+                gift_num = int(it.get("gift_num") or it.get("num") or 0)
+                # expire_at 是过期时间戳，0 表示不过期
+                expire_at = float(it.get("expire_at") or 0) or math.inf
+                gift_id = str(it.get("gift_id"))
+            except Exception:
+                continue
+            if not bag_id or gift_num <= 0:
+                continue
+            stacks.setdefault(gift_id, []).append([expire_at, str(bag_id), gift_num])
+        for entries in stacks.values():
+            entries.sort()
+        self._stacks = stacks
+
+    def take(self, gift_id: Any, count: int) -> BagPlan:
+        """Reserve up to ``count`` of ``gift_id``; the rest is for a direct send."""
+        stacks = self._stacks.get(str(gift_id))
+        plan: BagPlan = []
+        remaining = int(count)
+        while remaining > 0 and stacks:
+            stack = next((entry for entry in stacks if entry[2] >= remaining), None)
+            if stack is None:
+                stack = max(stacks, key=lambda entry: (entry[2], -entry[0]))
+            n = min(remaining, stack[2])
+            plan.append((stack[1], n))
+            remaining -= n
+            stack[2] -= n
+            if stack[2] <= 0:
+                stacks.remove(stack)
+        return plan
+
+
+def plan_bag_sends(bag_items: Optional[Iterable[Dict[str, Any]]], gifts: Sequence[Tuple[str, int]]) -> List[BagPlan]:
+    """Bag plans for every ``(gift_id, count)`` of a batch, from one pass over the bag."""
+    index = BagIndex(bag_items)
+    return [index.take(gift_id, count) for gift_id, count in gifts]
+
+
+def gift_send_steps(
+    *, form: SendGiftForm, count: int,
+    bag_items: Optional[Iterable[Dict[str, Any]]] = None, bag_plan: Optional[BagPlan] = None,
+) -> GiftSteps:
+    """Bag sends from ``bag_plan`` (or a plan over ``bag_items``), then a direct send for the rest."""
+    gift_id = form.gift_id
+    remaining = int(count)
+    results: List[Dict[str, Any]] = []
+    if bag_plan is None:
+        bag_plan = BagIndex(bag_items).take(gift_id, remaining)
+
+    # 先尝试用背包（如果有），避免走付费路径
+    for bag_id, n in bag_plan:
+        n = min(remaining, n)
+        ok, status_code, raw, outcome_uncertain = yield form.post(n, bag_id)
+        if provider_unavailable(raw):
+            # Nothing went out; report the whole rest and do not switch to a
+            # paid send, which the breaker might let through as its probe.
+            results.append(_unavailable_result(gift_id, remaining, "bag"))
+            remaining = 0
+            break
+        results.append({
+            "id": str(gift_id), "count": n, "success": ok,
+            "status_code": status_code, "mode": "bag",
+            "provider_transaction_id": provider_transaction_id(raw),
+            "outcome_uncertain": outcome_uncertain,
+        })
+        if ok:
+            remaining -= n
+        else:
+            # Never fall through to a paid send after an ambiguous bag
+            # response; that would be an automatic duplicate attempt.
+            if outcome_uncertain:
+                remaining = 0
+            break
+        if remaining <= 0:
+            break
+
+    # 剩余数量：尝试直接 sendGift（可能会消耗电池/或被拒）
+    if remaining > 0:
+        ok, status_code, raw, outcome_uncertain = yield form.post(remaining)
+        if provider_unavailable(raw):
+            results.append(_unavailable_result(gift_id, remaining, "direct"))
+        else:
+            results.append({
+                "id": str(gift_id), "count": remaining, "success": ok,
+                "status_code": status_code, "mode": "direct",
+                "provider_transaction_id": provider_transaction_id(raw),
+                "outcome_uncertain": outcome_uncertain,
+            })
+
+    # 兼容 threeserver 既有返回格式：单个礼物也返回一条（或多条分片）
+    if len(results) == 1:
+        return results[0]
+    split = {
+        "id": str(gift_id),
+        "count": count,
+        "success": all(r.get("success") for r in results),
+        "outcome_uncertain": any(r.get("outcome_uncertain") for r in results),
+        "mode": "split",
+        "provider_transaction_ids": [
+            r.get("provider_transaction_id") for r in results
+            if r.get("provider_transaction_id")
+        ],
+        "parts": results,
+    }
+    if any(r.get("error") == PROVIDER_UNAVAILABLE for r in results):
+        # provider_unavailable promises nothing went out (the caller may send
+        # again); once an earlier part was delivered, a retry would double it.
+        delivered = any(r.get("success") or r.get("outcome_uncertain") for r in results)
+        split["error"] = PARTIAL_FAILED if delivered else PROVIDER_UNAVAILABLE
+    return split
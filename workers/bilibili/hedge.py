@@ -0,0 +1,171 @@
+"""Hedged requests for idempotent provider reads."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, TypeVar
+
+T = TypeVar("T")
+
+# 只有这些只读接口可以发第二份；sendGift / msg/send 发两次就是送两次
+HEDGEABLE_ENDPOINTS = frozenset({"get_info", "bag_list", "pk/info"})
+
+DEFAULT_BUDGET_RATIO = 0.1
+DEFAULT_BURST = 3.0
+DEFAULT_MAX_WORKERS = 8
+
+
+class Hedger:
+    """Send a second copy of a slow read and take whichever answers first.
+
+    A call that has not returned within ``hedge_after(endpoint)`` seconds
+    (the endpoint's observed p95; None, before there are enough samples,
+    means no hedging) gets a second attempt, which opens or borrows
+    another pooled connection. The first
+    attempt to succeed wins; the loser is cancelled where the client allows
+    it (asyncio) and otherwise left to finish in the background.
+
+    Extra load is capped like a retry budget: every call earns
+    ``budget_ratio`` of a hedge, up to ``burst`` saved, and every hedge
+    spends one, so at most about ``budget_ratio`` of calls are doubled
+    however slow the provider gets. Only ``HEDGEABLE_ENDPOINTS`` are
+    accepted; anything else raises ``ValueError``.
+    """
+
+    def __init__(
+        self,
+        hedge_after: Callable[[str], Optional[float]],
+        *,
+        enabled: bool = True,
+        budget_ratio: float = DEFAULT_BUDGET_RATIO,
+        burst: float = DEFAULT_BURST,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+    ):
+        self._hedge_after = hedge_after
+        self.enabled = enabled
+        self.budget_ratio = max(0.0, float(budget_ratio))
+        self.burst = max(1.0, float(burst))
+        self.max_workers = max(2, int(max_workers))
+        self._tokens = self.burst
+        self._busy = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.busy_skipped = 0
+
+    @classmethod
+    def from_env(cls, hedge_after: Callable[[str], Optional[float]]) -> "Hedger":
+        """Off unless ``BILI_HEDGE_READS=1``; ``BILI_HEDGE_BUDGET`` is the extra-load ratio."""
+        enabled = str(os.getenv("BILI_HEDGE_READS", "0") or "0").strip().lower() in ("1", "true", "yes", "y", "on")
+        budget = float(os.getenv("BILI_HEDGE_BUDGET", DEFAULT_BUDGET_RATIO) or DEFAULT_BUDGET_RATIO)
+        return cls(hedge_after, enabled=enabled, budget_ratio=budget)
+
+    def _hedge_delay(self, endpoint: str) -> Optional[float]:
+        if endpoint not in HEDGEABLE_ENDPOINTS:
+            raise ValueError(f"{endpoint} is not an idempotent read and cannot be hedged")
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.burst, self._tokens + self.budget_ratio)
+        return self._hedge_after(endpoint) if self.enabled else None
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                self.budget_denied += 1
+                return False
+            self._tokens -= 1.0
+            self.hedged += 1
+            return True
+
+    def _submit(self, attempt: Callable[[], T]) -> Optional["Future[T]"]:
+        with self._lock:
+            if self._busy >= self.max_workers:
+                self.busy_skipped += 1
+                return None
+            self._busy += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+
+        def _run() -> T:
+            try:
+                return attempt()
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+        return self._pool.submit(_run)
+
+    def call(self, endpoint: str, attempt: Callable[[], T]) -> T:
+        """``attempt()`` on a worker thread, doubled if it is slower than the p95."""
+        delay = self._hedge_delay(endpoint)
+        primary = self._submit(attempt) if delay is not None else None
+        if primary is None:
+            return attempt()
+        if wait([primary], timeout=delay).done or not self._take_token():
+            return primary.result()
+        hedge = self._submit(attempt)
+        if hedge is None:
+            with self._lock:
+                self._tokens += 1.0
+                self.hedged -= 1
+            return primary.result()
+        pending: Set[Future] = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    async def call_async(self, endpoint: str, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Same as ``call`` for a coroutine factory; the losing attempt is cancelled."""
+        delay = self._hedge_delay(endpoint)
+        if delay is None:
+            return await attempt()
+        primary = asyncio.ensure_future(attempt())
+        pending: Set[asyncio.Future] = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not self._take_token():
+                return await primary
+            hedge = asyncio.ensure_future(attempt())
+            pending.add(hedge)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "endpoints": sorted(HEDGEABLE_ENDPOINTS),
+                "budget_ratio": self.budget_ratio,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "busy_skipped": self.busy_skipped,
+                "extra_load": round(self.hedged / self.calls, 4) if self.calls else 0.0,
+            }
@@ -0,0 +1,213 @@
+"""Append-only, group-committed journal of threeserver request status changes."""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+FSYNC_SAMPLE_WINDOW = 256
+
+
+class JournalLocked(RuntimeError):
+    """Another threeserver process already owns this journal file."""
+
+
+def _lock_file(handle) -> None:
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as error:
+        raise JournalLocked(str(error)) from error
+
+
+def replay_journal(path: str) -> Dict[str, Dict[str, Any]]:
+    """Fold journal lines into the latest known state per request id.
+
+    Later lines override earlier fields; a torn last line from a crash is
+    skipped, as is anything that is not a JSON object with an ``id``.
+    """
+    states: Dict[str, Dict[str, Any]] = {}
+    try:
+        handle = open(path, "rb")
+    except FileNotFoundError:
+        return states
+    with handle:
+        for line in handle:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(entry, dict) or not isinstance(entry.get("id"), str):
+                continue
+            if entry.get("status") == "discarded":
+                states.pop(entry["id"], None)
+                continue
+            states.setdefault(entry["id"], {}).update(entry)
+    return states
+
+
+class SendJournal:
+    """One writer thread; callers append JSON lines and return immediately.
+
+    Whatever accumulates while the writer is busy goes out in the next write
+    with a single ``fsync`` (group commit). ``append(..., durable=True)``
+    waits for that commit, which is what the ``sending`` transition needs:
+    it must be on disk before the provider call so a crash is replayed as
+    uncertain rather than as never sent. When the file grows past
+    ``max_bytes`` the writer rewrites it from ``snapshot()``.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        snapshot: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None,
+        max_bytes: int = 32 * 1024 * 1024,
+        fsync: bool = True,
+    ):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self._snapshot = snapshot
+        self._fsync = fsync
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock_handle = open(path + ".lock", "a+b")
+        try:
+            _lock_file(self._lock_handle)
+        except JournalLocked:
+            self._lock_handle.close()
+            raise
+        self._file = self._open()
+        self._size = self._file.tell()
+        self._io_lock = threading.Lock()
+        self._condition = threading.Condition(threading.Lock())
+        self._pending: List[bytes] = []
+        self._appended = 0
+        self._committed = 0
+        self._closed = False
+        self._commits = 0
+        self._entries = 0
+        self._compactions = 0
+        self._error: Optional[str] = None
+        self._fsync_ms: deque = deque(maxlen=FSYNC_SAMPLE_WINDOW)
+        self._thread = threading.Thread(target=self._run, name="send-journal", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+        handle = os.fdopen(fd, "ab")
+        handle.seek(0, os.SEEK_END)
+        return handle
+
+    def append(self, entry: Dict[str, Any], durable: bool = False) -> bool:
+        """Queue one entry; with ``durable`` block until it is fsynced."""
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._condition:
+            if self._closed:
+                return False
+            self._pending.append(line)
+            self._appended += 1
+            sequence = self._appended
+            self._condition.notify_all()
+            if not durable:
+                return True
+            while self._committed < sequence and not self._closed:
+                self._condition.wait()
+            return self._error is None
+
+    def flush(self) -> None:
+        """Block until everything appended so far has been committed."""
+        with self._condition:
+            target = self._appended
+            while self._committed < target and not self._closed:
+                self._condition.wait()
+
+    def _write(self, batch: List[bytes]) -> None:
+        data = b"".join(batch)
+        self._file.write(data)
+        self._file.flush()
+        if self._fsync:
+            started = time.perf_counter()
+            os.fsync(self._file.fileno())
+            self._fsync_ms.append((time.perf_counter() - started) * 1000.0)
+        self._size += len(data)
+
+    def compact(self) -> None:
+        """Rewrite the file from ``snapshot()`` now (e.g. right after replay)."""
+        if self._snapshot is None:
+            return
+        with self._io_lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        temp_path = self.path + ".tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o600)
+        with os.fdopen(fd, "wb") as handle:
+            for entry in self._snapshot():
+                handle.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+            handle.flush()
+            if self._fsync:
+                os.fsync(handle.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = self._open()
+        self._size = self._file.tell()
+        self._compactions += 1
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, []
+                upto = self._appended
+            try:
+                with self._io_lock:
+                    self._write(batch)
+                    if self._snapshot is not None and self._size > self.max_bytes:
+                        self._compact()
+                error = None
+            except OSError as write_error:
+                error = f"{type(write_error).__name__}: {write_error}"
+            with self._condition:
+                # Release durable waiters even on failure; append() reports it.
+                self._committed = upto
+                self._commits += 1
+                self._entries += len(batch)
+                if error is not None:
+                    self._error = error
+                self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._file.close()
+        self._lock_handle.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            fsync_ms = sorted(self._fsync_ms)
+            commits = self._commits
+            return {
+                "path": self.path,
+                "bytes": self._size,
+                "entries": self._entries,
+                "commits": commits,
+                "entries_per_commit": round(self._entries / commits, 2) if commits else 0.0,
+                "pending": len(self._pending),
+                "compactions": self._compactions,
+                "fsync_p50_ms": round(fsync_ms[len(fsync_ms) // 2], 3) if fsync_ms else 0.0,
+                "fsync_max_ms": round(fsync_ms[-1], 3) if fsync_ms else 0.0,
+                "error": self._error,
+            }
@@ -0,0 +1,245 @@
+"""Per-endpoint provider latency, and the request timeouts derived from it."""
+
+from __future__ import annotations
+
+import atexit
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
+
+Timeout = Tuple[float, float]
+
+DEFAULT_WINDOW = 512
+DEFAULT_MIN_SAMPLES = 20
+# timeout = p99 * MULTIPLIER + MARGIN，再夹在上下限之间
+DEFAULT_MULTIPLIER = 2.0
+DEFAULT_MARGIN_SECONDS = 0.25
+DEFAULT_READ_BOUNDS = (0.5, 8.0)
+DEFAULT_CONNECT_BOUNDS = (0.3, 3.0)
+# fast（偷塔）请求宁愿失败也不要卡死：网络再慢 read 也不超过这个值
+DEFAULT_FAST_READ_CAP = 3.0
+# 非幂等调用：read 超时后结果不确定（礼物可能已送出），自适应 read 超时不低于调用方的固定值
+DEFAULT_NON_IDEMPOTENT = frozenset({"sendGift", "msg/send"})
+# 所有 endpoint 连的是同一个 provider 主机，建连耗时合成一条
+CONNECT = "connect"
+# 最近 min_samples 次调用里超时达到这么多次，才按“等了多久”放宽超时
+DEFAULT_LOOSEN_AFTER = 2
+# percentile 缓存最多落后这么多个样本
+_RECOMPUTE_EVERY = 8
+
+
+class _Endpoint:
+    __slots__ = ("name", "samples", "recent", "calls", "timeouts", "pending", "p50", "p90", "p95", "p99", "default")
+
+    def __init__(self, name: str, window: int, recent: int):
+        self.name = name
+        self.samples: Deque[float] = deque(maxlen=window)
+        # 最近几次调用：超时的记等了多久，完成的记 None
+        self.recent: Deque[Optional[float]] = deque(maxlen=recent)
+        self.calls = 0
+        self.timeouts = 0
+        self.pending = 0
+        self.p50: Optional[float] = None
+        self.p90: Optional[float] = None
+        self.p95: Optional[float] = None
+        self.p99: Optional[float] = None
+        self.default: Optional[Timeout] = None
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _clamp(value: float, bounds: Tuple[float, float]) -> float:
+    return min(bounds[1], max(bounds[0], value))
+
+
+class LatencyTracker:
+    """Streaming latency percentiles per provider endpoint.
+
+    Each endpoint keeps the durations of its last ``window`` completed
+    calls. Once it has ``min_samples`` of them, ``timeout()`` answers
+    ``p99 * multiplier + margin`` clamped to the bounds instead of the
+    caller's fixed default; a connect timeout comes the same way from the
+    ``connect`` series (fed by the DNS cache, which sees every new socket).
+    On a healthy network that is well under a second, so a dead socket
+    costs hundreds of milliseconds rather than seconds.
+
+    Timed-out calls stay out of the percentiles: one stuck socket now and
+    then must not ratchet the timeout up. When ``loosen_after`` of the last
+    ``min_samples`` calls timed out, the network itself got slower, and the
+    longest of those waits is used like a p99 instead, so the timeout at
+    least doubles per round until calls complete again.
+
+    For the ``non_idempotent`` endpoints a read timeout leaves the outcome
+    unknown, so only their connect timeout shrinks: the adaptive read
+    timeout may grow past the caller's default but never drops below it.
+    """
+
+    def __init__(
+        self,
+        *,
+        window: int = DEFAULT_WINDOW,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        multiplier: float = DEFAULT_MULTIPLIER,
+        margin: float = DEFAULT_MARGIN_SECONDS,
+        read_bounds: Tuple[float, float] = DEFAULT_READ_BOUNDS,
+        connect_bounds: Tuple[float, float] = DEFAULT_CONNECT_BOUNDS,
+        fast_read_cap: float = DEFAULT_FAST_READ_CAP,
+        loosen_after: int = DEFAULT_LOOSEN_AFTER,
+        timeout_errors: Tuple[Type[BaseException], ...] = (TimeoutError,),
+        non_idempotent: Iterable[str] = DEFAULT_NON_IDEMPOTENT,
+        enabled: bool = True,
+    ):
+        self.window = max(1, int(window))
+        self.min_samples = max(1, int(min_samples))
+        self.multiplier = float(multiplier)
+        self.margin = float(margin)
+        self.read_bounds = read_bounds
+        self.connect_bounds = connect_bounds
+        self.fast_read_cap = float(fast_read_cap)
+        self.loosen_after = max(1, int(loosen_after))
+        self.timeout_errors = tuple(timeout_errors)
+        self.non_idempotent = frozenset(non_idempotent)
+        self.enabled = enabled
+        self._endpoints: Dict[str, _Endpoint] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> "LatencyTracker":
+        """``BILI_ADAPTIVE_TIMEOUTS=0`` keeps the fixed timeouts (still recording);
+        ``BILI_TIMEOUT_MAX_SECONDS`` is the read timeout ceiling."""
+        enabled = str(os.getenv("BILI_ADAPTIVE_TIMEOUTS", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
+        ceiling = float(os.getenv("BILI_TIMEOUT_MAX_SECONDS", DEFAULT_READ_BOUNDS[1]) or DEFAULT_READ_BOUNDS[1])
+        kwargs.setdefault("read_bounds", (min(DEFAULT_READ_BOUNDS[0], ceiling), ceiling))
+        return cls(enabled=enabled, **kwargs)
+
+    def _endpoint(self, name: str) -> _Endpoint:
+        entry = self._endpoints.get(name)
+        if entry is None:
+            entry = self._endpoints.setdefault(name, _Endpoint(name, self.window, self.min_samples))
+        return entry
+
+    def _record(self, name: str, seconds: float, *, timed_out: bool) -> None:
+        seconds = max(0.0, float(seconds))
+        with self._lock:
+            entry = self._endpoint(name)
+            entry.calls += 1
+            entry.recent.append(seconds if timed_out else None)
+            if timed_out:
+                entry.timeouts += 1
+                return
+            entry.samples.append(seconds)
+            entry.pending += 1
+            if entry.p99 is None or entry.pending >= _RECOMPUTE_EVERY:
+                ordered = sorted(entry.samples)
+                entry.p50 = _percentile(ordered, 0.50)
+                entry.p90 = _percentile(ordered, 0.90)
+                entry.p95 = _percentile(ordered, 0.95)
+                entry.p99 = _percentile(ordered, 0.99)
+                entry.pending = 0
+
+    def observe(self, endpoint: str, seconds: float) -> None:
+        self._record(endpoint, seconds, timed_out=False)
+
+    def observe_timeout(self, endpoint: str, waited: float) -> None:
+        """A call that gave up after ``waited`` seconds."""
+        self._record(endpoint, waited, timed_out=True)
+
+    def observe_connect(self, seconds: float, timed_out: bool = False) -> None:
+        self._record(CONNECT, seconds, timed_out=timed_out)
+
+    @contextmanager
+    def timing(self, endpoint: str) -> Iterator[None]:
+        """Record the duration of the block; a ``timeout_errors`` exception counts as a timeout."""
+        started = time.monotonic()
+        try:
+            yield
+        except self.timeout_errors:
+            self.observe_timeout(endpoint, time.monotonic() - started)
+            raise
+        self.observe(endpoint, time.monotonic() - started)
+
+    def p95(self, endpoint: str) -> Optional[float]:
+        """The endpoint's p95 in seconds; None until it has ``min_samples`` completed calls."""
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None or len(entry.samples) < self.min_samples:
+                return None
+            return entry.p95
+
+    def _derived(self, name: str, bounds: Tuple[float, float]) -> Optional[float]:
+        entry = self._endpoints.get(name)
+        if entry is None:
+            return None
+        basis = entry.p99 if entry.p99 is not None and len(entry.samples) >= self.min_samples else None
+        waits = [waited for waited in entry.recent if waited is not None]
+        if len(waits) >= self.loosen_after:
+            basis = max(waits) if basis is None else max(basis, max(waits))
+        if basis is None:
+            return None
+        return round(_clamp(basis * self.multiplier + self.margin, bounds), 3)
+
+    def timeout(self, endpoint: str, default: Union[float, Timeout], *, fast: bool = False) -> Timeout:
+        """(connect, read) for the next ``endpoint`` call; ``default`` until there are enough samples."""
+        if not isinstance(default, tuple):
+            default = (float(default), float(default))
+        with self._lock:
+            self._endpoint(endpoint).default = default
+            if not self.enabled:
+                return default
+            connect = self._derived(CONNECT, self.connect_bounds)
+            read = self._derived(endpoint, self.read_bounds)
+        if read is not None and fast:
+            read = min(read, self.fast_read_cap)
+        if read is not None and endpoint in self.non_idempotent:
+            read = max(read, default[1])
+        return (default[0] if connect is None else connect, default[1] if read is None else read)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            endpoints = {}
+            for entry in self._endpoints.values():
+                read = self._derived(entry.name, self.connect_bounds if entry.name == CONNECT else self.read_bounds)
+                if read is not None and entry.name in self.non_idempotent and entry.default is not None:
+                    read = max(read, entry.default[1])
+                endpoints[entry.name] = {
+                    "samples": len(entry.samples),
+                    "calls": entry.calls,
+                    "timeouts": entry.timeouts,
+                    "recent_timeouts": sum(1 for waited in entry.recent if waited is not None),
+                    "p50_ms": None if entry.p50 is None else round(entry.p50 * 1000.0, 1),
+                    "p90_ms": None if entry.p90 is None else round(entry.p90 * 1000.0, 1),
+                    "p95_ms": None if entry.p95 is None else round(entry.p95 * 1000.0, 1),
+                    "p99_ms": None if entry.p99 is None else round(entry.p99 * 1000.0, 1),
+                    "default_timeout": entry.default,
+                    "adaptive_timeout": read,
+                }
+            return {
+                "enabled": self.enabled,
+                "min_samples": self.min_samples,
+                "multiplier": self.multiplier,
+                "margin_seconds": self.margin,
+                "read_bounds": self.read_bounds,
+                "connect_bounds": self.connect_bounds,
+                "fast_read_cap": self.fast_read_cap,
+                "loosen_after": self.loosen_after,
+                "endpoints": endpoints,
+            }
+
+
+def report_at_exit(tracker: LatencyTracker, log: Callable[[str], None]) -> None:
+    """Write one line per endpoint (percentiles, timeouts, current timeout) when the process exits."""
+    def _report() -> None:
+        for name, info in tracker.stats()["endpoints"].items():
+            log(
+                f"[耗时] {name}: {info['calls']}次 超时{info['timeouts']}次 "
+                f"p50={info['p50_ms']}ms p90={info['p90_ms']}ms p99={info['p99_ms']}ms "
+                f"当前超时={info['adaptive_timeout'] or info['default_timeout']}"
+            )
+
+    atexit.register(_report)
@@ -0,0 +1,147 @@
+"""Room/get_info results (streamer uid, live status) cached on disk for every worker process."""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+ROOM_ID_PATTERN = re.compile(r"^[0-9]{1,12}$")
+
+# 一次 Room/get_info 就带回 uid 和 live_status；主播 uid 基本不变，开播状态要新鲜
+DEFAULT_UID_TTL_SECONDS = 6 * 3600.0
+DEFAULT_LIVE_TTL_SECONDS = 5.0
+
+
+def default_directory() -> str:
+    configured = (os.getenv("BILI_ROOM_CACHE_DIR") or "").strip()
+    if configured:
+        return configured
+    app_data_dir = os.path.join(os.getenv("LOCALAPPDATA", os.path.expanduser("~")), "BiliPKTool")
+    return os.path.join(app_data_dir, "cache", "rooms")
+
+
+class RoomMetaCache:
+    """One small JSON file per room, shared by checkpk, the PK workers and threeserver.
+
+    ``fetch`` callables return the ``data`` object of a ``Room/get_info``
+    response; whatever process fetched it writes both fields, so checkpk's
+    live check already gives normalpk the streamer uid. Files are replaced
+    atomically and every read or write error is treated as a miss: the
+    cache can only save round-trips, never fail a lookup.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        *,
+        uid_ttl: float = DEFAULT_UID_TTL_SECONDS,
+        live_ttl: float = DEFAULT_LIVE_TTL_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.directory = directory or default_directory()
+        self.uid_ttl = float(uid_ttl)
+        self.live_ttl = float(live_ttl)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.write_errors = 0
+
+    @classmethod
+    def from_env(cls) -> "RoomMetaCache":
+        return cls(
+            uid_ttl=float(os.getenv("BILI_ROOM_UID_TTL_SECONDS", DEFAULT_UID_TTL_SECONDS) or DEFAULT_UID_TTL_SECONDS),
+            live_ttl=float(os.getenv("BILI_ROOM_LIVE_TTL_SECONDS", DEFAULT_LIVE_TTL_SECONDS) or DEFAULT_LIVE_TTL_SECONDS),
+        )
+
+    def _path(self, room_id: str) -> Optional[str]:
+        room_id = str(room_id).strip()
+        if not ROOM_ID_PATTERN.match(room_id):
+            return None
+        return os.path.join(self.directory, f"room-{room_id}.json")
+
+    def read(self, room_id: Any) -> Dict[str, Any]:
+        path = self._path(room_id)
+        if path is None:
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                record = json.load(handle)
+        except (OSError, ValueError):
+            return {}
+        return record if isinstance(record, dict) else {}
+
+    def store(self, room_id: Any, data: Any) -> None:
+        """Record the uid / live_status found in a ``Room/get_info`` ``data`` object."""
+        path = self._path(room_id)
+        if path is None or not isinstance(data, dict):
+            return
+        now = self._clock()
+        record = self.read(room_id)
+        uid = data.get("uid")
+        if isinstance(uid, int) and uid > 0:
+            record.update(uid=uid, uid_ts=now)
+        if isinstance(data.get("live_status"), int):
+            record.update(live_status=data["live_status"], live_ts=now)
+        if "uid_ts" not in record and "live_ts" not in record:
+            return
+        record["room_id"] = str(room_id).strip()
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as handle:
+                json.dump(record, handle)
+            os.replace(temp_path, path)
+        except OSError:
+            # Windows refuses the replace while another process has the file open.
+            with self._lock:
+                self.write_errors += 1
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def cached(self, room_id: Any, field: str) -> Any:
+        """``field`` ("uid" or "live_status") from disk if within its TTL, else None."""
+        ttl, ts_field = (self.uid_ttl, "uid_ts") if field == "uid" else (self.live_ttl, "live_ts")
+        record = self.read(room_id)
+        ts = record.get(ts_field)
+        fresh = field in record and isinstance(ts, (int, float)) and 0 <= self._clock() - ts <= ttl
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return record[field] if fresh else None
+
+    def _get(self, room_id: Any, field: str, fetch: Callable[[], Any]) -> Any:
+        value = self.cached(room_id, field)
+        if value is not None:
+            return value
+        data = fetch()
+        self.store(room_id, data)
+        return data.get(field) if isinstance(data, dict) else None
+
+    def uid(self, room_id: Any, fetch: Callable[[], Any]) -> Optional[int]:
+        """The streamer uid, from disk when fresh, else from ``fetch()``."""
+        uid = self._get(room_id, "uid", fetch)
+        return uid if isinstance(uid, int) and uid > 0 else None
+
+    def live_status(self, room_id: Any, fetch: Callable[[], Any]) -> Optional[int]:
+        status = self._get(room_id, "live_status", fetch)
+        return status if isinstance(status, int) else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "uid_ttl_seconds": self.uid_ttl,
+                "live_ttl_seconds": self.live_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "write_errors": self.write_errors,
+            }
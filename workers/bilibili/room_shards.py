@@ -0,0 +1,236 @@
+"""Per-room send state for a threeserver process that serves several rooms."""
+
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+def _bag_item_count(item: Dict[str, Any]) -> int:
+    # Same precedence as gift_protocol.BagIndex reads it.
+    try:
+        return int(item.get("gift_num") or item.get("num") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class BagCache:
+    """The last bag list of one room, served while a newer one is fetched.
+
+    ``serve`` never blocks: it returns the snapshot (None before the first
+    load) and tells the caller whether to start a background refresh, at
+    most one at a time. Bag sends are subtracted from the snapshot as soon
+    as they return, so the next send does not offer the same items again.
+    A refresh replaces the snapshot with the provider's list minus the
+    sends recorded after that refresh started, which the provider may not
+    have counted yet. A failed refresh keeps the old snapshot.
+    """
+
+    __slots__ = (
+        "_lock", "_items", "_fetched", "_checked", "_refreshing", "_deductions",
+        "refreshes", "refresh_failures", "served_stale", "deducted", "invalidations",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: Optional[List[Dict[str, Any]]] = None
+        self._fetched: Optional[float] = None  # last successful load
+        self._checked: Optional[float] = None  # last load attempt; drives the TTL
+        self._refreshing = False
+        self._deductions: List[Tuple[float, str, int]] = []  # (ts, bag_id, num)
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.served_stale = 0
+        self.deducted = 0
+        self.invalidations = 0
+
+    def items(self) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            return self._items
+
+    def serve(self, now: float, ttl_seconds: float) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+        """``(snapshot, start_refresh)``; a True second value claims the refresh."""
+        with self._lock:
+            stale = self._checked is None or now - self._checked > ttl_seconds
+            if stale and self._items is not None:
+                self.served_stale += 1
+            start = stale and not self._refreshing
+            if start:
+                self._refreshing = True
+            return self._items, start
+
+    def store(self, items: Optional[List[Dict[str, Any]]], started: float, now: float) -> None:
+        """Finish a load that began at ``started``; ``items`` None means it failed."""
+        with self._lock:
+            self._refreshing = False
+            self._checked = now
+            # Sends before the load started are in the provider's answer.
+            self._deductions = [entry for entry in self._deductions if entry[0] >= started]
+            if items is None:
+                self.refresh_failures += 1
+                if self._items is None:
+                    self._items = []
+                return
+            snapshot = [dict(item) for item in items if isinstance(item, dict)]
+            for _ts, bag_id, num in self._deductions:
+                self._deduct(snapshot, bag_id, num)
+            self._items = snapshot
+            self._fetched = now
+            self.refreshes += 1
+
+    @staticmethod
+    def _deduct(items: List[Dict[str, Any]], bag_id: str, num: int) -> None:
+        for item in items:
+            if str(item.get("bag_id") or item.get("id")) != bag_id:
+                continue
+            left = max(0, _bag_item_count(item) - num)
+            for key in ("gift_num", "num"):
+                if key in item:
+                    item[key] = left
+            return
+
+    def record_send(self, bag_id: Any, num: int, *, ok: bool, uncertain: bool, now: float) -> None:
+        """Account for one bag sendGift.
+
+        An uncertain send is counted as spent (sending it again from the bag
+        would be the worse mistake) and, like a rejected one, makes the
+        next ``serve`` revalidate.
+        """
+        bag_id = str(bag_id)
+        with self._lock:
+            if ok or uncertain:
+                self._deductions.append((now, bag_id, int(num)))
+                if self._items is not None:
+                    self._deduct(self._items, bag_id, int(num))
+                self.deducted += int(num)
+            if not ok:
+                self._checked = None
+                self.invalidations += 1
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        with self._lock:
+            items = self._items
+            return {
+                "items": len(items) if items is not None else None,
+                "gifts": sum(_bag_item_count(item) for item in items) if items else 0,
+                "age_seconds": round(now - self._fetched, 3) if self._fetched is not None else None,
+                "refreshing": self._refreshing,
+                "refreshes": self.refreshes,
+                "refresh_failures": self.refresh_failures,
+                "served_stale": self.served_stale,
+                "deducted": self.deducted,
+                "pending_deductions": len(self._deductions),
+                "invalidations": self.invalidations,
+            }
+
+
+class RoomShard:
+    """Everything threeserver keeps for one target room.
+
+    ``session`` is whatever the backend's factory returns: a requests
+    session sharing the process-wide connection pool, or for the async
+    backend (one shared httpx client) the headers dict sent with each
+    request: ``_provider_headers`` for this room plus the account's Cookie.
+    The streamer uid, the bag list and the compiled
+    sendGift forms (by gift id) are cached here and are dropped together
+    with the shard when it is evicted.
+    """
+
+    __slots__ = ("room_id", "session", "ruid", "bag", "forms", "sends", "last_used")
+
+    def __init__(self, room_id: str, session: Any = None):
+        self.room_id = room_id
+        self.session = session
+        self.ruid: Optional[int] = None
+        self.bag = BagCache()
+        self.forms: Dict[str, Any] = {}
+        self.sends = 0
+        self.last_used = 0.0
+
+
+class RoomShards:
+    """Allow-listed room shards, created on first use, least recently used evicted.
+
+    Only rooms in ``allowed`` ever get a shard, so a caller cannot grow the
+    process by naming arbitrary rooms. At most ``max_active`` shards are
+    kept; the primary room is never evicted.
+    """
+
+    def __init__(
+        self,
+        primary: str,
+        allowed: Iterable[str],
+        factory: Callable[[str], Any] = lambda room_id: None,
+        max_active: int = 16,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.primary = str(primary)
+        self.allowed = frozenset([self.primary, *(str(room) for room in allowed)])
+        self.max_active = max(1, int(max_active))
+        self._factory = factory
+        self._clock = clock
+        self._shards: "OrderedDict[str, RoomShard]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._evicted = 0
+
+    def __contains__(self, room_id: object) -> bool:
+        return str(room_id) in self.allowed
+
+    def get(self, room_id: Optional[str] = None) -> Optional[RoomShard]:
+        """Shard for ``room_id`` (primary when None), or None if not allowed."""
+        room_id = self.primary if room_id is None else str(room_id)
+        if room_id not in self.allowed:
+            return None
+        with self._lock:
+            shard = self._shards.get(room_id)
+            if shard is None:
+                shard = RoomShard(room_id, self._factory(room_id))
+                self._shards[room_id] = shard
+                self._created += 1
+                self._evict()
+            else:
+                self._shards.move_to_end(room_id)
+            shard.last_used = self._clock()
+            return shard
+
+    def _evict(self) -> None:
+        while len(self._shards) > self.max_active:
+            for room_id in self._shards:
+                if room_id != self.primary:
+                    del self._shards[room_id]
+                    self._evicted += 1
+                    break
+            else:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        wall = time.time()  # bag timestamps are wall-clock, like the send path's
+        with self._lock:
+            shards = list(self._shards.values())
+            created, evicted = self._created, self._evicted
+        rooms = {}
+        for shard in shards:
+            bag_items = shard.bag.items() or []
+            rooms[shard.room_id] = {
+                "ruid": shard.ruid,
+                "sends": shard.sends,
+                "bag": shard.bag.stats(wall),
+                "sendgift_forms": len(shard.forms),
+                "idle_seconds": round(now - shard.last_used, 3),
+                "approx_bytes": sys.getsizeof(shard) + sys.getsizeof(bag_items)
+                + sum(sys.getsizeof(item) for item in bag_items),
+            }
+        return {
+            "primary": self.primary,
+            "allowed": sorted(self.allowed),
+            "active": len(shards),
+            "max_active": self.max_active,
+            "created": created,
+            "evicted": evicted,
+            "rooms": rooms,
+        }
@@ -0,0 +1,311 @@
+"""Blocking send queue shared by the threeserver HTTP handlers and workers."""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Lanes in strict drain priority: final-second PK sends, ordinary gift
+# requests (wish inventory, legacy bare gift IDs), then danmaku/balance.
+LANE_PK = "pk"
+LANE_GIFT = "gift"
+LANE_CONTROL = "control"
+LANE_ORDER = (LANE_PK, LANE_GIFT, LANE_CONTROL)
+
+WAIT_SAMPLE_WINDOW = 256
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+ADDED_LATENCY_BUCKETS_MS = (0.0, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(fraction * (len(ordered) - 1) + 0.5))
+    return ordered[index]
+
+
+class _Lane:
+    __slots__ = (
+        "name", "max_depth", "items", "waits", "enqueued", "rejected", "expired",
+        "target", "interval", "first_above", "shedding", "shed", "last_sojourn",
+    )
+
+    def __init__(self, name: str, max_depth: int, target: Optional[Tuple[float, float]] = None):
+        self.name = name
+        self.max_depth = int(max_depth)
+        # CoDel-style admission: (target sojourn, interval) in seconds, or None.
+        self.target, self.interval = target if target is not None else (None, None)
+        self.first_above: Optional[float] = None
+        self.shedding = False
+        self.shed = 0
+        self.last_sojourn = 0.0
+        # Heap of (deadline or inf, sequence, enqueued_at, item): earliest
+        # deadline first, FIFO among equal deadlines and deadline-free items.
+        self.items: List[tuple] = []
+        self.waits: deque = deque(maxlen=WAIT_SAMPLE_WINDOW)
+        self.enqueued = 0
+        self.rejected = 0
+        self.expired = 0
+
+
+def _bucket(buckets: tuple, value: float) -> str:
+    for bound in buckets:
+        if value <= bound:
+            return f"<={bound:g}"
+    return f">{buckets[-1]:g}"
+
+
+class BatchWindow:
+    """Self-tuning time ``drain`` lingers after the first item to grow a batch.
+
+    Lingering only pays off when another arrival is expected before the
+    provider would have answered anyway, so the window is a fraction of
+    the provider latency estimate, applied only while the arrival rate
+    predicts at least one more item within it, and capped at ``max_window``.
+    Idle traffic therefore gets no added wait. Both estimates are EWMAs.
+    """
+
+    def __init__(self, max_window: float, latency_fraction: float = 0.1, alpha: float = 0.2):
+        self.max_window = max(0.0, float(max_window))
+        self.latency_fraction = float(latency_fraction)
+        self.alpha = float(alpha)
+        self._interarrival: Optional[float] = None
+        self._last_arrival: Optional[float] = None
+        self._provider_latency: Optional[float] = None
+        self._batch_sizes = {_bucket(BATCH_SIZE_BUCKETS, size): 0 for size in BATCH_SIZE_BUCKETS + (BATCH_SIZE_BUCKETS[-1] + 1,)}
+        self._added_ms = {_bucket(ADDED_LATENCY_BUCKETS_MS, ms): 0 for ms in ADDED_LATENCY_BUCKETS_MS + (ADDED_LATENCY_BUCKETS_MS[-1] + 1,)}
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def note_arrival(self, now: float) -> None:
+        if self._last_arrival is not None:
+            self._interarrival = self._ewma(self._interarrival, max(0.0, now - self._last_arrival))
+        self._last_arrival = now
+
+    def note_provider_latency(self, seconds: float) -> None:
+        self._provider_latency = self._ewma(self._provider_latency, max(0.0, float(seconds)))
+
+    def current(self) -> float:
+        if not self.max_window or self._interarrival is None or self._provider_latency is None:
+            return 0.0
+        window = min(self.max_window, self.latency_fraction * self._provider_latency)
+        if self._interarrival > window:
+            return 0.0
+        return window
+
+    def record(self, batch_size: int, added: float) -> None:
+        self._batch_sizes[_bucket(BATCH_SIZE_BUCKETS, batch_size)] += 1
+        self._added_ms[_bucket(ADDED_LATENCY_BUCKETS_MS, added * 1000.0)] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_window_ms": round(self.max_window * 1000.0, 3),
+            "window_ms": round(self.current() * 1000.0, 3),
+            "interarrival_ms": round((self._interarrival or 0.0) * 1000.0, 3),
+            "provider_latency_ms": round((self._provider_latency or 0.0) * 1000.0, 3),
+            "batch_size_histogram": dict(self._batch_sizes),
+            "added_latency_ms_histogram": dict(self._added_ms),
+        }
+
+
+class SendQueue:
+    """Bounded priority lanes whose consumer sleeps on a condition.
+
+    Producers (Flask request threads) call ``put``; the sender thread calls
+    ``drain`` and is woken by ``notify`` instead of polling, so an idle
+    sender uses no CPU and a new item is seen as soon as it is enqueued.
+    ``drain`` always empties higher lanes before it looks at lower ones and
+    orders each lane earliest-deadline-first. Items whose absolute deadline
+    (``time.time()`` seconds) has passed are handed to ``on_expired`` instead
+    of being returned, so they never reach the provider. With a
+    ``BatchWindow``, ``drain`` may wait a few milliseconds after the first
+    item for more to arrive, but never while a PK item is queued.
+
+    ``lane_targets`` adds delay-based admission to a lane, CoDel style:
+    once every item dequeued for a whole ``interval`` has waited longer than
+    ``target`` (or the oldest queued item has been stuck for target +
+    interval, i.e. nothing is draining), ``offer`` refuses new items for
+    that lane until a dequeued item is back under target or the lane
+    empties. ``max_depth`` stays a hard cap either way.
+    """
+
+    def __init__(
+        self,
+        lane_depths: Dict[str, int],
+        on_expired: Optional[Callable[[Any], None]] = None,
+        window: Optional[BatchWindow] = None,
+        lane_targets: Optional[Dict[str, Tuple[float, float]]] = None,
+    ):
+        unknown = (set(lane_depths) | set(lane_targets or {})) - set(LANE_ORDER)
+        if unknown:
+            raise ValueError(f"unknown send lanes: {sorted(unknown)}")
+        self._lanes = [
+            _Lane(name, lane_depths[name], (lane_targets or {}).get(name))
+            for name in LANE_ORDER if name in lane_depths
+        ]
+        self._by_name = {lane.name: lane for lane in self._lanes}
+        self._on_expired = on_expired
+        self.window = window
+        self._pk_lane = self._by_name.get(LANE_PK)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition(threading.Lock())
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._condition:
+            return sum(len(lane.items) for lane in self._lanes)
+
+    def put(self, item: Any, lane: str = LANE_GIFT, deadline: Optional[float] = None) -> bool:
+        return self.offer(item, lane, deadline)[0] is None
+
+    def offer(
+        self, item: Any, lane: str = LANE_GIFT, deadline: Optional[float] = None,
+    ) -> Tuple[Optional[str], float]:
+        """Like ``put``, but say why an item was refused and when to retry.
+
+        Returns ``(None, 0.0)`` when queued, otherwise ``("full" |
+        "overloaded", retry_after_seconds)``; the hint is the longest of the
+        lane's current standing delay, its last sojourn and one second.
+        """
+        target = self._by_name[lane]
+        key = math.inf if deadline is None else float(deadline)
+        with self._condition:
+            now = time.monotonic()
+            standing = now - min(entry[2] for entry in target.items) if target.items else 0.0
+            retry_after = max(1.0, standing, target.last_sojourn)
+            if self._closed or len(target.items) >= target.max_depth:
+                target.rejected += 1
+                return "full", retry_after
+            if target.target is not None and (
+                target.shedding or standing > target.target + target.interval
+            ):
+                target.shed += 1
+                return "overloaded", retry_after
+            heapq.heappush(target.items, (key, next(self._sequence), now, item))
+            target.enqueued += 1
+            if self.window is not None:
+                self.window.note_arrival(now)
+            self._condition.notify()
+            return None, 0.0
+
+    def drain(self, timeout: Optional[float] = None, max_items: Optional[int] = None) -> List[Any]:
+        """Block until at least one item is queued and return it in lane order.
+
+        Every queued PK item is returned; ``max_items`` only caps how many
+        lower-lane items ride along. Returns an empty list when ``timeout``
+        elapses or the queue is closed.
+        """
+        wait_until = None if timeout is None else time.monotonic() + timeout
+        expired: List[Any] = []
+        items: List[Any] = []
+        while not items:
+            with self._condition:
+                while not self._closed and not any(lane.items for lane in self._lanes):
+                    if wait_until is None:
+                        self._condition.wait()
+                        continue
+                    remaining = wait_until - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                added = self._linger(max_items)
+                now = time.monotonic()
+                wall_now = time.time()
+                for lane in self._lanes:
+                    while lane.items and (
+                        lane.name == LANE_PK or max_items is None or len(items) < max_items
+                    ):
+                        deadline, _sequence, enqueued_at, item = heapq.heappop(lane.items)
+                        if deadline <= wall_now:
+                            lane.expired += 1
+                            expired.append(item)
+                            continue
+                        lane.waits.append(now - enqueued_at)
+                        self._observe_sojourn(lane, now - enqueued_at, now)
+                        items.append(item)
+                    if not lane.items:
+                        lane.first_above = None
+                        lane.shedding = False
+                if items and self.window is not None:
+                    self.window.record(len(items), added)
+                stop = self._closed or (wait_until is not None and time.monotonic() >= wait_until)
+            self._report_expired(expired)
+            expired = []
+            if stop:
+                break
+        return items
+
+    @staticmethod
+    def _observe_sojourn(lane: _Lane, sojourn: float, now: float) -> None:
+        lane.last_sojourn = sojourn
+        if lane.target is None:
+            return
+        if sojourn <= lane.target:
+            lane.first_above = None
+            lane.shedding = False
+        elif lane.first_above is None:
+            lane.first_above = now + lane.interval
+        elif now >= lane.first_above:
+            lane.shedding = True
+
+    def _linger(self, max_items: Optional[int]) -> float:
+        """Hold the batch open for the window (caller holds the condition)."""
+        if self.window is None or self._closed or (self._pk_lane is not None and self._pk_lane.items):
+            return 0.0
+        window = self.window.current()
+        if window <= 0.0:
+            return 0.0
+        started = time.monotonic()
+        until = started + window
+        while not self._closed and not (self._pk_lane is not None and self._pk_lane.items):
+            queued = sum(len(lane.items) for lane in self._lanes)
+            remaining = until - time.monotonic()
+            if not queued or (max_items is not None and queued >= max_items) or remaining <= 0:
+                break
+            self._condition.wait(remaining)
+        return time.monotonic() - started
+
+    def _report_expired(self, expired: List[Any]) -> None:
+        if self._on_expired is None:
+            return
+        for item in expired:
+            self._on_expired(item)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def window_stats(self) -> Optional[Dict[str, Any]]:
+        with self._condition:
+            return self.window.stats() if self.window is not None else None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._condition:
+            snapshot = {}
+            for lane in self._lanes:
+                waits = sorted(lane.waits)
+                snapshot[lane.name] = {
+                    "depth": len(lane.items),
+                    "max_depth": lane.max_depth,
+                    "enqueued": lane.enqueued,
+                    "rejected": lane.rejected,
+                    "expired": lane.expired,
+                    "shed": lane.shed,
+                    "shedding": lane.shedding,
+                    "target_ms": round(lane.target * 1000.0, 3) if lane.target is not None else None,
+                    "oldest_wait_ms": round(
+                        (now - min(entry[2] for entry in lane.items)) * 1000.0, 3
+                    ) if lane.items else 0.0,
+                    "wait_p50_ms": round(_percentile(waits, 0.50) * 1000.0, 3),
+                    "wait_p99_ms": round(_percentile(waits, 0.99) * 1000.0, 3),
+                    "wait_max_ms": round((waits[-1] if waits else 0.0) * 1000.0, 3),
+                }
+            return snapshot
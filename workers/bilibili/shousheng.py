@@ -8,6 +8,11 @@ import json
 import hashlib
 from decimal import Decimal, ROUND_HALF_UP
 
+from dns_cache import pin_provider_hosts
+from hedge import Hedger
+from latency import LatencyTracker, report_at_exit
+from room_meta import RoomMetaCache
+
 def check_pk_duration_and_exit(pk_start_time, exit_code, reason=""):
     """检查PK持续时间并决定退出码"""
     pk_duration = time.time() - pk_start_time
@@ -56,6 +61,28 @@ if not config:
     print("ERROR: 无法加载配置文件")
     exit(1)
 
+# 预先解析 api.live.bilibili.com 并固定地址，轮询和查房间信息时新建连接不再等系统解析器
+PROVIDER_DNS = pin_provider_hosts(["api.live.bilibili.com"], log=print)
+# 超时按本进程观测到的接口耗时 p99 自适应；5 / 8 秒只是样本不够时的起步值
+PROVIDER_LATENCY = LatencyTracker.from_env(timeout_errors=(requests.Timeout,))
+if PROVIDER_DNS is not None:
+    PROVIDER_DNS.on_connect = PROVIDER_LATENCY.observe_connect
+report_at_exit(PROVIDER_LATENCY, print)
+# BILI_HEDGE_READS=1：只读接口慢过 p95 时再发一份，先回来的算数
+PROVIDER_HEDGE = Hedger.from_env(PROVIDER_LATENCY.p95)
+
+
+def provider_get(endpoint, url, headers, default_timeout):
+    """GET 一个只读 provider 接口（get_info / pk/info）：超时自适应，按需对冲"""
+    def attempt():
+        with PROVIDER_LATENCY.timing(endpoint):
+            return requests.get(url, headers=headers, timeout=PROVIDER_LATENCY.timeout(endpoint, default_timeout))
+
+    return PROVIDER_HEDGE.call(endpoint, attempt)
+
+
+ROOM_META = RoomMetaCache.from_env()
+
 # 从配置文件读取礼物池
 GIFT_POOL = {}
 DISABLED_GIFT_IDS = set(str(x) for x in (config.get("禁用礼物ID", []) or []))
@@ -86,6 +113,27 @@ PK_EVENT_ID = (sys.argv[2].strip() if len(sys.argv) > 2 else os.getenv("PK_EVENT
 if not PK_EVENT_ID:
     PK_EVENT_ID = f"manual-{os.getpid()}-{time.time_ns()}"
 
+# 送礼截止时间（本地时钟）= PK结束时间 + 宽限；threeserver 会丢弃排队超过截止时间的请求，不再迟发
+PK_SEND_GRACE_SECONDS = float(config.get("PK配置", {}).get("送礼截止宽限秒", 2.3) or 2.3)
+pk_send_deadline = None
+
+def note_pk_deadline(pk_data):
+    """根据PK数据刷新送礼截止时间（用API毫秒时间换算成本地时钟，避免时钟偏差）"""
+    global pk_send_deadline
+    pk_basic = pk_data.get("pk_basic", {}) if isinstance(pk_data, dict) else {}
+    end_ts = pk_basic.get("end_time", 0)
+    if pk_basic.get("status") != 201 or not end_ts:
+        return
+    mill_timestamp = pk_data.get("mill_timestamp", 0)
+    api_now = mill_timestamp / 1000 if mill_timestamp > 0 else time.time()
+    pk_send_deadline = time.time() + (end_ts - api_now) + PK_SEND_GRACE_SECONDS
+
+def send_payload(ids, phase):
+    payload = {"gifts": ids, "operationId": send_operation_id(phase), "lane": "pk"}
+    if pk_send_deadline is not None:
+        payload["deadline"] = pk_send_deadline
+    return payload
+
 def send_operation_id(phase):
     return hashlib.sha256(f"{PK_EVENT_ID}\0{phase}".encode("utf-8")).hexdigest()
 
@@ -114,14 +162,16 @@ def calc_ticket_count(gift_ids):
     tickets = (total * Decimal("10")).quantize(Decimal("1"), rounding=ROUND_HALF_UP)
     return int(tickets)
 
+def fetch_room_info(room_id):
+    url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={room_id}"
+    headers = {"User-Agent": "Mozilla/5.0"}
+    resp = provider_get("get_info", url, headers, 5)
+    return resp.json().get("data", {})
+
 def get_room_host_uid(room_id):
-    """获取房间主播的UID"""
+    """获取房间主播的UID（先读 checkpk / threeserver 写下的本地缓存）"""
     try:
-        url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={room_id}"
-        headers = {"User-Agent": "Mozilla/5.0"}
-        resp = requests.get(url, headers=headers, timeout=5)
-        data = resp.json()
-        uid = data.get("data", {}).get("uid")
+        uid = ROOM_META.uid(room_id, lambda: fetch_room_info(room_id))
         if uid:
             print(f"[配置] 获取到监控房间 {room_id} 的主播UID: {uid}")
             return uid
@@ -148,7 +198,7 @@ def get_pk_info(room_id, retry_count=3, delay=2):
 
     for attempt in range(retry_count):
         try:
-            resp = requests.get(url, headers=headers, timeout=8)
+            resp = provider_get("pk/info", url, headers, 8)
             if resp.status_code != 200 or not resp.text.strip().startswith("{"):
                 if attempt < retry_count - 1:
                     print(f"[网络] 接口响应异常，{delay}秒后重试 ({attempt+1}/{retry_count})")
@@ -162,6 +212,7 @@ def get_pk_info(room_id, retry_count=3, delay=2):
             if data.get("code") != 0:
                 print(f"[ERROR] 接口返回错误：{data.get('message')}")
                 return None
+            note_pk_deadline(data.get("data") or {})
             return data.get("data", {})
 
         except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionResetError) as e:
@@ -221,7 +272,7 @@ def call_send(gift_ids, phase):
             print(f"[时间] 🚀 {t0} 开始HTTP请求: {ids}")
             resp = requests.post(
                 SEND_URL,
-                json={"gifts": ids, "operationId": send_operation_id(phase)},
+                json=send_payload(ids, phase),
                 timeout=10,
             )
             t1 = datetime.now().strftime("%H:%M:%S.%f")[:-3]
@@ -333,7 +384,7 @@ def call_send_script(combo, phase):
             print(f"[时间] 🚀 {t0} 开始HTTP请求: {ids}")
             resp = requests.post(
                 SEND_URL,
-                json={"gifts": ids, "operationId": send_operation_id(phase)},
+                json=send_payload(ids, phase),
                 timeout=10,
             )
             t1 = datetime.now().strftime("%H:%M:%S.%f")[:-3]
@@ -0,0 +1,406 @@
+"""TTL-indexed request status records for threeserver ``/send`` and ``/result``."""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+# Approximate size of one (expires_at, sequence, request_id) heap entry.
+_EXPIRY_ENTRY_BYTES = sys.getsizeof((0.0, 0, "")) + sys.getsizeof(0.0) + sys.getsizeof(0)
+# The expiry heap is rebuilt from the live records once it holds more than
+# this many entries per record (plus the slack): discarded and re-touched
+# records leave stale entries that would otherwise wait out the whole TTL.
+_EXPIRY_COMPACT_FACTOR = 2
+_EXPIRY_COMPACT_SLACK = 64
+
+# What a journaled state means after a restart: a request that was only
+# queued never reached the provider; one that was sending may have.
+RECOVERED_STATUS = {"queued": ("abandoned", False), "sending": ("interrupted", True)}
+
+# Every other status is final: the request will not change again.
+ACTIVE_STATUSES = frozenset({"queued", "sending"})
+DEFAULT_FEED_PENDING = 256
+MAX_FEEDS = 64
+
+
+class RequestRecord:
+    """One ``/send`` request. Results are kept here and nowhere else."""
+
+    __slots__ = (
+        "request_id", "status", "results", "created_ts", "updated_ts",
+        "sending_ts", "done_ts", "backend", "confirm", "deadline", "total",
+        "expires_at", "recovered", "outcome_uncertain",
+    )
+
+    def __init__(self, request_id: str, now: float, *, backend: str, confirm: str,
+                 deadline: Optional[float], total: int):
+        self.request_id = request_id
+        self.status = "queued"
+        self.results: List[Dict[str, Any]] = []
+        self.created_ts = now
+        self.updated_ts = now
+        self.sending_ts: Optional[float] = None
+        self.done_ts: Optional[float] = None
+        self.backend = backend
+        self.confirm = confirm
+        self.deadline = deadline
+        self.total = total
+        self.expires_at = 0.0
+        self.recovered = False
+        self.outcome_uncertain: Optional[bool] = None
+
+    @property
+    def success_count(self) -> int:
+        return sum(1 for result in self.results if result.get("success"))
+
+    @property
+    def failed_count(self) -> int:
+        return len(self.results) - self.success_count
+
+    def to_dict(self) -> Dict[str, Any]:
+        state = {
+            "status": self.status,
+            "results": self.results,
+            "created_ts": self.created_ts,
+            "updated_ts": self.updated_ts,
+            "received_ts": self.created_ts,
+            "sending_ts": self.sending_ts,
+            "done_ts": self.done_ts,
+            "backend": self.backend,
+            "confirm": self.confirm,
+            "deadline": self.deadline,
+        }
+        if self.recovered:
+            state["recovered"] = True
+            if self.outcome_uncertain is not None:
+                state["outcome_uncertain"] = self.outcome_uncertain
+        return state
+
+    def journal_entry(self) -> Dict[str, Any]:
+        entry = {
+            "id": self.request_id, "status": self.status, "ts": self.updated_ts,
+            "created_ts": self.created_ts, "sending_ts": self.sending_ts, "done_ts": self.done_ts,
+            "backend": self.backend, "confirm": self.confirm, "deadline": self.deadline,
+            "total": self.total, "results": self.results,
+        }
+        if self.recovered:
+            entry["recovered"] = True
+            entry["outcome_uncertain"] = self.outcome_uncertain
+        return entry
+
+
+class StatusFeed:
+    """Status transitions pushed by a ``StatusStore`` to one subscriber.
+
+    With ``request_ids`` only those requests are followed, and ``finished``
+    turns true once each of them has reached a final status (or was not
+    found). At most ``max_pending`` undelivered events are kept; older ones
+    are dropped and counted in ``dropped``, and the reader should fall back
+    to ``/result``. ``wake``, if set, is called after every push from the
+    pushing thread, for readers that do not block in ``take``.
+    """
+
+    def __init__(self, request_ids: Optional[Iterable[str]] = None, max_pending: int = DEFAULT_FEED_PENDING):
+        self.request_ids = frozenset(request_ids) if request_ids is not None else None
+        self.max_pending = max(1, int(max_pending))
+        self.dropped = 0
+        self.wake: Optional[Callable[[], None]] = None
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._open = set(self.request_ids) if self.request_ids is not None else None
+        self._condition = threading.Condition()
+
+    def wants(self, request_id: str) -> bool:
+        return self.request_ids is None or request_id in self.request_ids
+
+    @property
+    def finished(self) -> bool:
+        return self._open is not None and not self._open
+
+    def push(self, event: Dict[str, Any]) -> None:
+        with self._condition:
+            if len(self._events) >= self.max_pending:
+                self._events.popleft()
+                self.dropped += 1
+            self._events.append(event)
+            if self._open is not None and event["status"] not in ACTIVE_STATUSES:
+                self._open.discard(event["request_id"])
+            self._condition.notify()
+        wake = self.wake
+        if wake is not None:
+            wake()
+
+    def take(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Every pending event, waiting up to ``timeout`` for one (None: do not wait)."""
+        with self._condition:
+            if not self._events and timeout and not self.finished:
+                self._condition.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+class StatusStore:
+    """Bounded request records that expire ``ttl_seconds`` after their last update.
+
+    Expiry uses a heap of ``(expires_at, sequence, request_id)``: an update
+    pushes a fresh entry and the stale one is skipped when it surfaces, so
+    ``create`` only pops what is actually due instead of scanning every record.
+    Stale entries are bounded: past ``_EXPIRY_COMPACT_FACTOR`` per live record
+    the heap is rebuilt, so a flood of rejected-then-discarded requests does
+    not grow it for a whole TTL.
+
+    With a journal attached (anything with ``append(entry, durable=False)``),
+    every transition is appended after the in-memory update; ``sending`` is
+    appended durably so it is on disk before the caller contacts the provider.
+    Subscribed feeds get each transition as it happens, in order.
+    """
+
+    def __init__(self, capacity: int, ttl_seconds: float, clock: Callable[[], float] = time.time):
+        self.capacity = int(capacity)
+        self.ttl_seconds = float(ttl_seconds)
+        self._clock = clock
+        self._records: Dict[str, RequestRecord] = {}
+        self._expiry: List[tuple] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._reaped = 0
+        self._rejected = 0
+        self._feeds: List[StatusFeed] = []
+        self.max_feeds = MAX_FEEDS
+        self.journal = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def _touch(self, record: RequestRecord, now: float) -> None:
+        record.updated_ts = now
+        record.expires_at = now + self.ttl_seconds
+        heapq.heappush(self._expiry, (record.expires_at, next(self._sequence), record.request_id))
+        self._compact_expiry()
+
+    def _compact_expiry(self) -> None:
+        if len(self._expiry) <= _EXPIRY_COMPACT_FACTOR * len(self._records) + _EXPIRY_COMPACT_SLACK:
+            return
+        self._expiry = [
+            (record.expires_at, next(self._sequence), request_id) for request_id, record in self._records.items()
+        ]
+        heapq.heapify(self._expiry)
+
+    def _publish(self, record: RequestRecord) -> None:
+        # Under the lock, so every feed sees one request's transitions in order.
+        if not self._feeds:
+            return
+        event = {"request_id": record.request_id, **record.to_dict()}
+        for feed in self._feeds:
+            if feed.wants(record.request_id):
+                feed.push(event)
+
+    def subscribe(self, request_ids: Optional[Iterable[str]] = None,
+                  max_pending: int = DEFAULT_FEED_PENDING) -> Optional[StatusFeed]:
+        """A feed of transitions from now on; a filtered one starts with each request's current state.
+
+        None when ``max_feeds`` feeds are already subscribed.
+        """
+        feed = StatusFeed(request_ids, max_pending)
+        with self._lock:
+            if len(self._feeds) >= self.max_feeds:
+                return None
+            self._feeds.append(feed)
+            for request_id in sorted(feed.request_ids or ()):
+                record = self._records.get(request_id)
+                if record is not None:
+                    feed.push({"request_id": request_id, **record.to_dict()})
+                else:
+                    feed.push({"request_id": request_id, "status": "not_found"})
+        return feed
+
+    def unsubscribe(self, feed: StatusFeed) -> None:
+        with self._lock:
+            if feed in self._feeds:
+                self._feeds.remove(feed)
+
+    def _expire(self, now: float) -> int:
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, _sequence, request_id = heapq.heappop(self._expiry)
+            record = self._records.get(request_id)
+            if record is not None and record.expires_at == expires_at:
+                del self._records[request_id]
+                removed += 1
+        self._reaped += removed
+        return removed
+
+    def create(self, request_id: str, **fields: Any) -> Optional[RequestRecord]:
+        """Add a queued record, or return None when the store is full."""
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            if len(self._records) >= self.capacity:
+                self._rejected += 1
+                return None
+            record = RequestRecord(request_id, now, **fields)
+            self._records[request_id] = record
+            self._touch(record, now)
+            self._publish(record)
+        if self.journal is not None:
+            self.journal.append({
+                "id": request_id, "status": "queued", "ts": now, "created_ts": now,
+                "backend": record.backend, "confirm": record.confirm,
+                "deadline": record.deadline, "total": record.total,
+            })
+        return record
+
+    def get(self, request_id: str) -> Optional[RequestRecord]:
+        with self._lock:
+            return self._records.get(request_id)
+
+    def snapshot(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(request_id)
+            return record.to_dict() if record is not None else None
+
+    def snapshot_many(self, request_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """``snapshot`` of each id, all read under one acquisition of the lock."""
+        states: Dict[str, Optional[Dict[str, Any]]] = {}
+        with self._lock:
+            for request_id in request_ids:
+                record = self._records.get(request_id)
+                states[request_id] = record.to_dict() if record is not None else None
+        return states
+
+    def discard(self, request_id: str) -> None:
+        with self._lock:
+            if self._records.pop(request_id, None) is not None:
+                self._compact_expiry()
+                for feed in self._feeds:
+                    if feed.wants(request_id):
+                        feed.push({"request_id": request_id, "status": "discarded"})
+        if self.journal is not None:
+            self.journal.append({"id": request_id, "status": "discarded"})
+
+    def mark_sending(self, *request_ids: str) -> None:
+        """Mark requests as sending; returns once the journal has them on disk."""
+        now = self._clock()
+        marked = []
+        with self._lock:
+            for request_id in request_ids:
+                record = self._records.get(request_id)
+                if record is None:
+                    continue
+                record.status = "sending"
+                record.sending_ts = record.sending_ts or now
+                self._touch(record, now)
+                self._publish(record)
+                marked.append(request_id)
+        if self.journal is not None:
+            # Commits are in append order, so waiting on the last one covers all.
+            for index, request_id in enumerate(marked):
+                self.journal.append(
+                    {"id": request_id, "status": "sending", "ts": now, "sending_ts": now},
+                    durable=index == len(marked) - 1,
+                )
+
+    def finish(self, request_id: str, results: List[Dict[str, Any]], status: str = "done") -> None:
+        now = self._clock()
+        with self._lock:
+            record = self._records.get(request_id)
+            if record is None:
+                return
+            record.status = status
+            record.results = results
+            record.done_ts = now
+            self._touch(record, now)
+            self._publish(record)
+        if self.journal is not None:
+            self.journal.append({"id": request_id, "status": status, "ts": now, "done_ts": now, "results": results})
+
+    def restore(self, states: Iterable[Dict[str, Any]]) -> int:
+        """Load replayed journal states; queued/sending become abandoned/interrupted.
+
+        Records past their TTL are dropped and, if more than ``capacity``
+        remain, only the most recently updated are kept.
+        """
+        now = self._clock()
+        live = [
+            state for state in states
+            if float(state.get("ts") or 0) + self.ttl_seconds > now
+        ]
+        live.sort(key=lambda state: float(state.get("ts") or 0))
+        with self._lock:
+            for state in live[-self.capacity:]:
+                created_ts = float(state.get("created_ts") or state.get("ts"))
+                record = RequestRecord(
+                    state["id"], created_ts, backend=str(state.get("backend") or ""),
+                    confirm=str(state.get("confirm") or ""), deadline=state.get("deadline"),
+                    total=int(state.get("total") or 0),
+                )
+                status = str(state.get("status") or "queued")
+                record.recovered = True
+                record.outcome_uncertain = state.get("outcome_uncertain")
+                if status in RECOVERED_STATUS:
+                    status, record.outcome_uncertain = RECOVERED_STATUS[status]
+                record.status = status
+                record.results = state.get("results") if isinstance(state.get("results"), list) else []
+                record.sending_ts = state.get("sending_ts")
+                record.done_ts = state.get("done_ts")
+                self._records[record.request_id] = record
+                self._touch(record, float(state.get("ts")))
+            return len(self._records)
+
+    def journal_entries(self) -> List[Dict[str, Any]]:
+        """Current state of every live record, for journal compaction."""
+        with self._lock:
+            return [record.journal_entry() for record in self._records.values()]
+
+    def reap(self) -> int:
+        with self._lock:
+            return self._expire(self._clock())
+
+    def start_reaper(self, interval: float = 30.0) -> threading.Thread:
+        def _run() -> None:
+            while True:
+                time.sleep(interval)
+                self.reap()
+
+        thread = threading.Thread(target=_run, name="status-reaper", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self) -> Dict[str, Any]:
+        """Counts plus an approximate byte size (records, result dicts, indexes)."""
+        with self._lock:
+            records = list(self._records.values())
+            index_bytes = (
+                sys.getsizeof(self._records) + sys.getsizeof(self._expiry)
+                + len(self._expiry) * _EXPIRY_ENTRY_BYTES
+            )
+            expiry_entries = len(self._expiry)
+            reaped, rejected = self._reaped, self._rejected
+            feeds = len(self._feeds)
+        record_bytes = 0
+        result_bytes = 0
+        for record in records:
+            record_bytes += sys.getsizeof(record) + sys.getsizeof(record.request_id)
+            results = record.results
+            result_bytes += sys.getsizeof(results) + sum(sys.getsizeof(result) for result in results)
+        return {
+            "records": len(records),
+            "capacity": self.capacity,
+            "ttl_seconds": self.ttl_seconds,
+            "expiry_entries": expiry_entries,
+            "reaped": reaped,
+            "rejected": rejected,
+            "feeds": feeds,
+            "approx_bytes": {
+                "records": record_bytes,
+                "results": result_bytes,
+                "index": index_bytes,
+                "total": record_bytes + result_bytes + index_bytes,
+            },
+        }
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from threading import Thread
 import time
 import sys
@@ -10,8 +10,11 @@ from datetime import datetime
 import threading
 import random
 import hmac
-from collections import deque
-from typing import Any, Dict, List, Optional, Tuple, Union
+import math
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 try:
     from playwright.sync_api import sync_playwright
@@ -19,7 +22,35 @@ except Exception as _e:  # Playwright 可选（HTTP giftsend 后端不需要）
     sync_playwright = None
     _playwright_import_error = _e
 
+try:
+    import httpx
+except Exception as _e:  # httpx 可选（仅 async 后端需要）
+    httpx = None
+    _httpx_import_error = _e
+
+import importlib.util
 import requests
+from urllib.parse import urlsplit
+from urllib3.exceptions import NewConnectionError
+
+from coalesce import coalesce_requests, group_jobs, split_result
+from danmaku import DanmakuLane
+from dns_cache import DnsCache, install_urllib3
+from event_server import PARKING_ENVIRON_KEY, EventLoopServer
+from dispatch_pool import PriorityPool
+from breaker import CircuitBreakers, ProviderUnavailable
+from hedge import Hedger
+from gift_protocol import (
+    FORM_CONTENT_TYPE, PROVIDER_UNAVAILABLE, BagPlan, GiftPost, PostOutcome, SendGiftForm, gift_send_steps, plan_bag_sends,
+)
+from accounts import ACCOUNT_ID_PATTERN, DEFAULT_ACCOUNT, Account, AccountRegistry
+from room_meta import RoomMetaCache
+from room_shards import RoomShard, RoomShards
+from send_queue import LANE_CONTROL, LANE_GIFT, LANE_ORDER, LANE_PK, BatchWindow, SendQueue
+from journal import JournalLocked, SendJournal, replay_journal
+from latency import LatencyTracker
+from status_store import RequestRecord, StatusStore
+from warmup import Warmup
 
 def force_utf8_stdio():
     try:
@@ -39,11 +70,7 @@ def force_utf8_stdio():
 force_utf8_stdio()
 
 app = Flask(__name__)
-gift_queue = deque()
-gift_queue_lock = threading.Lock()
 balance_lock = threading.Lock()
-request_lock = threading.Lock()
-request_status = {}  # request_id -> {status, results, created_ts, updated_ts}
 
 LOCAL_TOKEN = (os.getenv("THREESERVER_LOCAL_TOKEN") or "").strip()
 if len(LOCAL_TOKEN.encode("utf-8")) < 32:
@@ -56,11 +83,65 @@ ALLOWED_GIFT_IDS = {
 if not ALLOWED_GIFT_IDS:
     raise RuntimeError("THREESERVER_ALLOWED_GIFT_IDS must not be empty")
 MAX_QUEUE_DEPTH = 100
+MAX_PK_QUEUE_DEPTH = 20
+MAX_CONTROL_QUEUE_DEPTH = 50
 MAX_REQUEST_STATUS = 5000
 REQUEST_STATUS_TTL_SECONDS = 3600
 MAX_GIFTS_PER_REQUEST = 100
 MAX_GIFT_COUNT_PER_ITEM = 100
 MAX_TOTAL_GIFT_COUNT = 1000
+MAX_DEADLINE_HORIZON_SECONDS = 86400
+
+
+def deadline_passed(item, now=None):
+    deadline = item.get("deadline") if isinstance(item, dict) else None
+    return deadline is not None and deadline <= (now or time.time())
+
+
+def expire_queued_item(item):
+    """Finish a queued send whose caller deadline passed before dispatch."""
+    if not isinstance(item, dict):
+        return
+    req_id = item.get("request_id")
+    if req_id:
+        status_store.finish(req_id, [], status="expired")
+    accounts.release(item.get("account"))
+    event = item.get("result_event")
+    if event:
+        event.set()
+
+
+# Upper bound for how long a drain may wait to grow a batch under load
+# (coalescing / browser batches); 0 disables. PK sends never wait.
+BATCH_WINDOW_MS = min(50.0, max(0.0, float(os.getenv("THREESERVER_BATCH_WINDOW_MS", "5") or 0)))
+
+# Delay-based admission for the gift and control lanes: once queued sends
+# have waited longer than TARGET for a whole INTERVAL, new ones get 503 +
+# Retry-After instead of joining a queue they would only expire in.
+# MAX_QUEUE_DEPTH stays the hard cap; the PK lane is never shed.
+QUEUE_TARGET_MS = max(1.0, float(os.getenv("THREESERVER_QUEUE_TARGET_MS", "500") or 500))
+QUEUE_INTERVAL_MS = max(1.0, float(os.getenv("THREESERVER_QUEUE_INTERVAL_MS", "500") or 500))
+_LANE_TARGET = (QUEUE_TARGET_MS / 1000.0, QUEUE_INTERVAL_MS / 1000.0)
+
+# Workers block on this queue's condition instead of polling it. PK sends
+# get their own lane so a wish-inventory burst cannot delay a final-second send.
+send_queue = SendQueue({
+    LANE_PK: MAX_PK_QUEUE_DEPTH,
+    LANE_GIFT: MAX_QUEUE_DEPTH,
+    LANE_CONTROL: MAX_CONTROL_QUEUE_DEPTH,
+}, on_expired=expire_queued_item, window=BatchWindow(BATCH_WINDOW_MS / 1000.0),
+    lane_targets={LANE_GIFT: _LANE_TARGET, LANE_CONTROL: _LANE_TARGET})
+LANE_RANK = {lane: rank for rank, lane in enumerate(LANE_ORDER)}
+
+
+def _queue_rejected(error: str, rejection: str, retry_after: float):
+    seconds = max(1, int(math.ceil(retry_after)))
+    if rejection == "overloaded":
+        error = "sender_overloaded"
+    response = jsonify({"error": error, "retry_after_seconds": seconds})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(seconds)
+    return response
 
 
 @app.before_request
@@ -71,44 +152,84 @@ def require_local_capability():
     return None
 
 
-def enqueue_item(item):
-    with gift_queue_lock:
-        if len(gift_queue) >= MAX_QUEUE_DEPTH:
-            return False
-        gift_queue.append(item)
-        return True
-
+# request_id -> RequestRecord; expires REQUEST_STATUS_TTL_SECONDS after the
+# last update. Admission pops only due entries; a reaper thread handles idle periods.
+status_store = StatusStore(MAX_REQUEST_STATUS, REQUEST_STATUS_TTL_SECONDS)
 
-def drain_queue():
-    items = []
-    with gift_queue_lock:
-        while gift_queue:
-            items.append(gift_queue.popleft())
-    return items
+# 送礼状态日志（追加写 + 组提交）：重启后回放，/result/<id> 仍能回答重启前的请求。
+# 重启前只排队未发送的记为 abandoned（确定没送），发送中的记为 interrupted（不确定）。
+JOURNAL_ENABLED = str(os.getenv("THREESERVER_JOURNAL", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
+send_journal: Optional[SendJournal] = None
+journal_recovery: Dict[str, Any] = {}
 
 
-def cleanup_request_status(now=None):
-    current = now or time.time()
-    with request_lock:
-        expired = [
-            request_id for request_id, state in request_status.items()
-            if current - float(state.get("updated_ts") or state.get("created_ts") or current)
-            > REQUEST_STATUS_TTL_SECONDS
-        ]
-        for request_id in expired:
-            request_status.pop(request_id, None)
-        if len(request_status) >= MAX_REQUEST_STATUS:
-            return False
-    return True
+def open_send_journal():
+    global send_journal
+    if not JOURNAL_ENABLED:
+        return
+    path = os.getenv("THREESERVER_JOURNAL_PATH") or os.path.join(APP_DATA_DIR, "journal", f"threeserver-{ROOM_ID}.jsonl")
+    try:
+        journal = SendJournal(path, snapshot=status_store.journal_entries)
+    except (JournalLocked, OSError) as error:
+        logger.warning(f"⚠️ 送礼状态日志不可用，本次不记录: {type(error).__name__}")
+        return
+    started = time.perf_counter()
+    states = replay_journal(path)
+    restored = status_store.restore(states.values())
+    journal.compact()
+    journal_recovery.update({
+        "replayed": len(states),
+        "restored": restored,
+        "ms": round((time.perf_counter() - started) * 1000.0, 1),
+    })
+    status_store.journal = journal
+    send_journal = journal
+    print(f"📒 送礼状态日志: {path}（恢复 {restored} 条）")
 
 # Only the HTTP backend receives an explicit provider response code. The
 # Playwright backend remains available for diagnostics but cannot assert that a
 # dispatched click was accepted by Bilibili.
 THREESERVER_BACKEND = (os.getenv("THREESERVER_BACKEND") or "http").strip().lower()
+# Backends that talk to the provider API directly. "async" is the HTTP backend
+# on an asyncio event loop with httpx (HTTP/2 multiplexed when h2 is installed).
+API_BACKENDS = ("http", "giftsend", "api", "async")
+
+# HTTP backend: independent requests and distinct gifts within a request are
+# sent concurrently, with at most this many provider calls in flight.
+DISPATCH_CONCURRENCY = min(32, max(1, int(os.getenv("THREESERVER_DISPATCH_CONCURRENCY", "4") or 4)))
+provider_pool: Optional[PriorityPool] = None
+dispatch_stats_lock = threading.Lock()
+dispatch_stats = {"active_requests": 0, "coalesced_jobs": 0, "coalesced_requests": 0, "coalesced_calls_saved": 0}
+
+# 可选合并：同一轮从队列取出的多个 /send 请求中相同礼物合并成一次 sendGift
+# （num=N），结果按请求拆回；任一部分结果不确定，则所有参与的请求都标为不确定。
+COALESCE_ENABLED = str(os.getenv("THREESERVER_COALESCE", "0") or "0").strip().lower() in ("1", "true", "yes", "y", "on")
+COALESCE_MAX_REQUESTS = 16
+
+# async backend: requests in flight and provider calls in flight. With HTTP/2
+# these share one connection as separate streams instead of one socket each.
+ASYNC_MAX_STREAMS = min(100, max(1, int(os.getenv("THREESERVER_ASYNC_MAX_STREAMS", "32") or 32)))
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+async_client = None
+
+# Provider origin. Overridable only with a loopback address, for local
+# stand-in providers in benchmarks; the cookie is sent to this origin.
+PROVIDER_BASE_URL = "https://api.live.bilibili.com"
+_provider_override = (os.getenv("THREESERVER_PROVIDER_BASE_URL") or "").strip().rstrip("/")
+if _provider_override:
+    _provider_parts = urlsplit(_provider_override)
+    if _provider_parts.scheme not in ("http", "https") or _provider_parts.hostname not in ("127.0.0.1", "::1", "localhost") or _provider_parts.path:
+        raise RuntimeError("THREESERVER_PROVIDER_BASE_URL must be a loopback origin")
+    PROVIDER_BASE_URL = _provider_override
 
 APP_DATA_DIR = os.path.join(os.getenv("LOCALAPPDATA", os.path.expanduser("~")), "BiliPKTool")
 LOG_DIR = os.path.join(APP_DATA_DIR, "logs")
 
+# 与 checkpk / normalpk / shousheng 共用的房间 uid 缓存；本地替身 provider 的数据不能混进去
+room_meta = RoomMetaCache.from_env()
+if _provider_override:
+    room_meta.directory = os.path.join(room_meta.directory, "loopback")
+
 # Hard-send mode: disable any "balance/insufficient" DOM probing by default.
 # Set BALANCE_CHECK_ENABLED=1 if you want to re-enable it.
 BALANCE_CHECK_ENABLED = str(os.getenv("BALANCE_CHECK_ENABLED", "0") or "0").strip().lower() in (
@@ -152,13 +273,14 @@ def request_balance_check(timeout=5):
         request_id = str(time.time())
         result_event = threading.Event()
         result_storage = {"balance": None, "success": False}
-        if not enqueue_item(
+        if not send_queue.put(
             {
                 "check_balance": True,
                 "request_id": request_id,
                 "result_event": result_event,
                 "result_storage": result_storage,
-            }
+            },
+            LANE_CONTROL,
         ):
             return None
         if not result_event.wait(timeout=timeout):
@@ -211,6 +333,8 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+# httpx (async 后端) 每个请求都打 INFO，会刷屏
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # 简化单房间配置
 def load_config():
@@ -282,6 +406,28 @@ if ROOM_ID == "0":
     print("ERROR: 送礼房间配置为0，请修改配置文件")
     sys.exit(1)
 
+# 额外允许的送礼房间（仅 API 后端）：/send 可带 room_id 路由到对应分片，
+# 同一进程共用连接池；不在名单里的房间一律拒绝。
+EXTRA_ROOM_IDS = [
+    room.strip() for room in (os.getenv("THREESERVER_ROOM_IDS") or "").split(",")
+    if room.strip()
+]
+if any(not room.isdigit() or len(room) > 12 for room in EXTRA_ROOM_IDS):
+    print("ERROR: THREESERVER_ROOM_IDS 只能是逗号分隔的房间号")
+    sys.exit(1)
+SEND_ROOM_IDS = frozenset([str(ROOM_ID), *(EXTRA_ROOM_IDS if THREESERVER_BACKEND in API_BACKENDS else [])])
+MAX_ROOM_SHARDS = min(256, max(1, int(os.getenv("THREESERVER_MAX_ROOM_SHARDS", "16") or 16)))
+
+# 多账号（仅 API 后端）：/send 可带 account，对应 THREESERVER_ACCOUNTS_DIR/<account>.txt
+# 的 cookie 文件；首次使用时加载并预热，空闲超时后释放。不带 account 时用 COOKIE_FILE。
+# 每账号排队配额默认等于礼物通道深度（默认账号不会比原来更早被拒），PK 通道不受配额限制。
+ACCOUNTS_DIR = (os.getenv("THREESERVER_ACCOUNTS_DIR") or "").strip()
+MAX_ACCOUNTS = min(1024, max(1, int(os.getenv("THREESERVER_MAX_ACCOUNTS", "64") or 64)))
+MAX_ACCOUNT_QUEUED = min(
+    MAX_QUEUE_DEPTH, max(1, int(os.getenv("THREESERVER_ACCOUNT_QUEUE_DEPTH", MAX_QUEUE_DEPTH) or MAX_QUEUE_DEPTH)),
+)
+ACCOUNT_IDLE_SECONDS = max(10.0, float(os.getenv("THREESERVER_ACCOUNT_IDLE_SECONDS", "600") or 600))
+
 print(f"配置加载完成 - 送礼房间: {ROOM_ID}")
 print(f"配置加载完成 - Cookie文件: {COOKIE_FILE}")
 
@@ -302,340 +448,868 @@ def load_cookie_kv_from_txt(file_path: str) -> Dict[str, str]:
     from cookie_store import load_cookie_values
     return load_cookie_values(file_path)
 
-def _make_requests_session(cookie_file: str) -> Tuple[requests.Session, Dict[str, str]]:
-    cookie_kv = load_cookie_kv_from_txt(cookie_file)
-    sess = requests.Session()
+def _provider_headers(room_id: Optional[str] = None) -> Dict[str, str]:
     ua = (os.getenv("BILI_USER_AGENT") or "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0 Safari/537.36").strip()
-    sess.headers.update(
-        {
-            "User-Agent": ua,
-            # 禁用 brotli，避免部分 Python / 环境组合的 br 解码问题
-            "Accept-Encoding": "gzip, deflate",
-            "Referer": f"https://live.bilibili.com/{ROOM_ID}",
-            "Origin": "https://live.bilibili.com",
-        }
-    )
+    return {
+        "User-Agent": ua,
+        # 禁用 brotli，避免部分 Python / 环境组合的 br 解码问题
+        "Accept-Encoding": "gzip, deflate",
+        "Referer": f"https://live.bilibili.com/{room_id or ROOM_ID}",
+        "Origin": "https://live.bilibili.com",
+    }
+
+# provider 域名在后台解析并固定地址：新建连接不再等系统解析器（Windows 上偶尔几百毫秒），
+# 解析失败时继续用上次成功的地址。async 后端走 httpx，不经过 urllib3，这里只管 requests。
+DNS_CACHE_ENABLED = str(os.getenv("BILI_DNS_CACHE", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
+PROVIDER_HOST = urlsplit(PROVIDER_BASE_URL).hostname or ""
+provider_dns = (
+    DnsCache([PROVIDER_HOST], ttl=float(os.getenv("BILI_DNS_TTL_SECONDS", "60") or 60))
+    if DNS_CACHE_ENABLED and THREESERVER_BACKEND in API_BACKENDS and THREESERVER_BACKEND != "async" and PROVIDER_HOST
+    else None
+)
+
+# 每个 provider endpoint 的耗时分位数；超时按观测到的 p99 加余量给，而不是写死
+provider_latency = LatencyTracker.from_env(
+    timeout_errors=(requests.Timeout,) + ((httpx.TimeoutException,) if httpx is not None else ()),
+)
+if provider_dns is not None:
+    provider_dns.on_connect = provider_latency.observe_connect
+# 只读接口（get_info / bag_list）慢过 p95 时再发一份，先回来的算数；sendGift 永远不会走这里
+provider_hedge = Hedger.from_env(provider_latency.p95)
+
+def _is_connect_failure(error: BaseException) -> bool:
+    """The request never reached the provider: refused, unreachable, DNS or connect timeout."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if httpx is not None and isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+# provider 连不上时按 endpoint 熔断：排队的请求直接得到 provider_unavailable（确定没发出去），
+# 不再每个都等满超时；冷却后放一个探测请求过去，连上了就恢复
+provider_breakers = CircuitBreakers.from_env(_is_connect_failure)
+
+# One pooled connection per concurrent provider call (see DISPATCH_CONCURRENCY),
+# shared by every room's session: all rooms talk to the same provider host.
+_http_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(10, DISPATCH_CONCURRENCY))
+
+def _make_requests_session(cookie_kv: Dict[str, str], room_id: str) -> requests.Session:
+    sess = requests.Session()
+    sess.mount("https://", _http_adapter)
+    sess.mount("http://", _http_adapter)
+    sess.headers.update(_provider_headers(room_id))
     if cookie_kv:
         sess.cookies.update(cookie_kv)
-    return sess, cookie_kv
+    return sess
 
 def _get_csrf(cookie_kv: Dict[str, str]) -> str:
     return (cookie_kv.get("bili_jct") or "").strip()
 
-_http_session_lock = threading.Lock()
-_http_session: Optional[requests.Session] = None
-_http_cookie_kv: Dict[str, str] = {}
-_room_uid_cache: Dict[str, int] = {}
-_bag_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}  # room_id -> (ts, items)
-
-def _get_http_session() -> Tuple[requests.Session, Dict[str, str]]:
-    global _http_session, _http_cookie_kv
-    with _http_session_lock:
-        if _http_session is None:
-            _http_session, _http_cookie_kv = _make_requests_session(COOKIE_FILE)
-        return _http_session, _http_cookie_kv
-
-def _http_timeout(fast: bool = False) -> Tuple[float, float]:
-    # “偷塔”场景：宁愿失败也不要卡死；fast 模式再缩短
-    if fast:
-        return (0.8, 1.8)
-    return (1.2, 3.0)
-
-def _get_room_uid(session: requests.Session, room_id: str, *, fast: bool = False) -> Optional[int]:
-    if room_id in _room_uid_cache:
-        return _room_uid_cache[room_id]
-    try:
-        url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={room_id}"
-        resp = session.get(url, timeout=_http_timeout(fast))
-        data = resp.json()
-        uid = data.get("data", {}).get("uid")
+def _account_cookie_path(account_id: str) -> Optional[str]:
+    if account_id == DEFAULT_ACCOUNT:
+        return COOKIE_FILE
+    if not ACCOUNTS_DIR or THREESERVER_BACKEND not in API_BACKENDS:
+        return None
+    path = os.path.join(ACCOUNTS_DIR, f"{account_id}.txt")
+    return path if os.path.isfile(path) else None
+
+def _make_account_shards(account: Account) -> RoomShards:
+    def _make_room_session(room_id: str) -> Any:
+        if THREESERVER_BACKEND == "async":
+            # async 后端共用一个 httpx client：分片里只放这个账号+房间的请求头。
+            # 显式 Cookie 头优先于 client 的 cookie jar，账号之间不会串 cookie。
+            return {**_provider_headers(room_id), "Cookie": account.cookie_header}
+        return _make_requests_session(account.cookie_kv, room_id)
+
+    return RoomShards(
+        ROOM_ID,
+        SEND_ROOM_IDS,
+        factory=_make_room_session,
+        max_active=MAX_ROOM_SHARDS,
+    )
+
+def _warm_account(account: Account) -> bool:
+    """Resolve the primary room's uid and bag list so the first send skips both."""
+    shard = account.shards.get()
+    if THREESERVER_BACKEND == "async":
+        # Flask may take the first request before run_async_worker has a loop.
+        if not _async_ready.wait(timeout=10):
+            return False
+        future = asyncio.run_coroutine_threadsafe(_warm_shard_async(shard), _async_loop)
+        return bool(future.result(timeout=10)) and _compile_sendgift_forms(shard, account.cookie_kv)
+    ruid = _get_room_uid(shard)
+    if ruid and PREFER_BAG:
+        _fetch_bag_list(shard)
+    return bool(ruid) and _compile_sendgift_forms(shard, account.cookie_kv)
+
+accounts = AccountRegistry(
+    _account_cookie_path,
+    load_cookie_kv_from_txt,
+    _make_account_shards,
+    warm=_warm_account if THREESERVER_BACKEND in API_BACKENDS else None,
+    max_accounts=MAX_ACCOUNTS,
+    max_queued=MAX_ACCOUNT_QUEUED,
+    idle_seconds=ACCOUNT_IDLE_SECONDS,
+)
+
+def _http_timeout(endpoint: str, fast: bool = False) -> Tuple[float, float]:
+    # “偷塔”场景：宁愿失败也不要卡死；fast 模式再缩短。
+    # 这两组只是样本不够时的起步值，之后按该 endpoint 的 p99 自适应（见 latency.py）
+    default = (0.8, 1.8) if fast else (1.2, 3.0)
+    return provider_latency.timeout(endpoint, default, fast=fast)
+
+def _remember_room_uid(shard: RoomShard, body: Dict[str, Any]) -> Optional[int]:
+    data = body.get("data", {})
+    uid = data.get("uid")
+    if isinstance(uid, int) and uid > 0:
+        if shard.ruid != uid:
+            room_meta.store(shard.room_id, data)
+            shard.forms.clear()
+        shard.ruid = uid
+        return uid
+    return None
+
+def _cached_room_uid(shard: RoomShard) -> Optional[int]:
+    if not shard.ruid:
+        uid = room_meta.cached(shard.room_id, "uid")
         if isinstance(uid, int) and uid > 0:
-            _room_uid_cache[room_id] = uid
-            return uid
+            shard.ruid = uid
+    return shard.ruid
+
+def _get_room_uid(shard: RoomShard, *, fast: bool = False) -> Optional[int]:
+    if _cached_room_uid(shard):
+        return shard.ruid
+    url = f"{PROVIDER_BASE_URL}/room/v1/Room/get_info?room_id={shard.room_id}"
+
+    def _get() -> requests.Response:
+        with provider_breakers.guard("get_info"), provider_latency.timing("get_info"):
+            return shard.session.get(url, timeout=_http_timeout("get_info", fast))
+
+    try:
+        return _remember_room_uid(shard, provider_hedge.call("get_info", _get).json())
     except Exception:
         return None
-    return None
+
+def _danmaku_payload(csrf: str, room_id: str, text: str) -> Dict[str, str]:
+    return {
+        "bubble": "0",
+        "msg": text,
+        "color": "16777215",
+        "mode": "1",
+        "fontsize": "25",
+        "rnd": str(int(time.time())),
+        "roomid": str(room_id),
+        "csrf": csrf,
+        "csrf_token": csrf,
+    }
 
 def _send_danmaku_http(session: requests.Session, cookie_kv: Dict[str, str], room_id: str, text: str, *, fast: bool = False) -> Dict[str, Any]:
     csrf = _get_csrf(cookie_kv)
     if not csrf:
         return {"success": False, "error": "missing_csrf(bili_jct)"}
     try:
-        url = "https://api.live.bilibili.com/msg/send"
-        payload = {
-            "bubble": "0",
-            "msg": text,
-            "color": "16777215",
-            "mode": "1",
-            "fontsize": "25",
-            "rnd": str(int(time.time())),
-            "roomid": str(room_id),
-            "csrf": csrf,
-            "csrf_token": csrf,
-        }
-        resp = session.post(url, data=payload, timeout=_http_timeout(fast))
+        url = f"{PROVIDER_BASE_URL}/msg/send"
+        with provider_breakers.guard("msg/send"), provider_latency.timing("msg/send"):
+            resp = session.post(url, data=_danmaku_payload(csrf, room_id, text), timeout=_http_timeout("msg/send", fast))
         j = resp.json()
         ok = (j.get("code") == 0)
         return {"success": ok, "status_code": resp.status_code, "raw": j}
+    except ProviderUnavailable:
+        return {"success": False, "error": PROVIDER_UNAVAILABLE}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def _fetch_bag_list(session: requests.Session, room_id: str, *, fast: bool = False) -> List[Dict[str, Any]]:
-    # 简单缓存：避免每次送礼都拉一遍
-    cache_ttl_s = float(os.getenv("BILI_BAG_CACHE_TTL", "2.0") or 2.0)
-    now = time.time()
-    cached = _bag_cache.get(room_id)
-    if cached and now - cached[0] <= cache_ttl_s:
-        return cached[1]
-
-    endpoints = [
-        "https://api.live.bilibili.com/xlive/revenue/v1/gift/bag_list",
-        "https://api.live.bilibili.com/gift/v2/live/bag_list",
-    ]
-    for ep in endpoints:
+# 弹幕走单独的一条线：自己的线程、自己的连接、自己的发送间隔，和送礼互不排队。
+# 10030/10031 是 msg/send 的“发送频率过快”，这时拉长间隔后重发一次。
+DANMAKU_RATE_LIMIT_CODES = (10030, 10031)
+DANMAKU_MIN_INTERVAL_SECONDS = float(
+    os.getenv("BILI_DANMAKU_INTERVAL_SECONDS")
+    or (int(os.getenv("DANMAKU_POST_DELAY_MS", "0") or 0) / 1000.0)
+    or 1.0
+)
+_danmaku_adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+_danmaku_session_state: Dict[str, Any] = {}
+
+def _danmaku_session(cookie_kv: Dict[str, str]) -> requests.Session:
+    # 只在弹幕线程里用；账号 cookie 重新加载后是新的 dict，跟着重建
+    if _danmaku_session_state.get("cookie_kv") is not cookie_kv:
+        sess = requests.Session()
+        sess.mount("https://", _danmaku_adapter)
+        sess.mount("http://", _danmaku_adapter)
+        sess.headers.update(_provider_headers(ROOM_ID))
+        sess.cookies.update(cookie_kv)
+        _danmaku_session_state.update(session=sess, cookie_kv=cookie_kv)
+    return _danmaku_session_state["session"]
+
+def _send_danmaku_lane(text: str) -> Dict[str, Any]:
+    account = accounts.get()
+    if account is None:
+        return {"success": False, "error": "account_unavailable"}
+    res = _send_danmaku_http(_danmaku_session(account.cookie_kv), account.cookie_kv, ROOM_ID, text, fast=True)
+    if (res.get("raw") or {}).get("code") in DANMAKU_RATE_LIMIT_CODES:
+        res["rate_limited"] = True
+    return res
+
+danmaku_lane = DanmakuLane(
+    _send_danmaku_lane, min_interval=DANMAKU_MIN_INTERVAL_SECONDS, max_pending=MAX_CONTROL_QUEUE_DEPTH,
+)
+
+def _danmaku_lane_usable() -> bool:
+    if THREESERVER_BACKEND in API_BACKENDS:
+        return True
+    # 浏览器后端：cookie 里有 bili_jct 就直接调 msg/send；没有的话只能在页面里输入，仍走送礼线程
+    account = accounts.get()
+    return account is not None and bool(_get_csrf(account.cookie_kv))
+
+PREFER_BAG = str(os.getenv("BILI_GIFTSEND_PREFER_BAG", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
+
+BAG_LIST_PATHS = ("/xlive/revenue/v1/gift/bag_list", "/gift/v2/live/bag_list")
+
+def _bag_cache_ttl() -> float:
+    # 过了 TTL 仍先用旧快照送，同时后台重新拉；送出的背包礼物已在本地扣减
+    return float(os.getenv("BILI_BAG_CACHE_TTL", "2.0") or 2.0)
+
+def _note_bag_send(shard: RoomShard, post: GiftPost, outcome: PostOutcome) -> None:
+    if post.bag_id == "0":
+        return
+    ok, _status_code, _body, outcome_uncertain = outcome
+    shard.bag.record_send(post.bag_id, post.num, ok=ok, uncertain=outcome_uncertain, now=time.time())
+
+def _bag_items_from_body(body: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    data = body.get("data") or {}
+    items = data.get("list") or data.get("bag_list") or []
+    return items if isinstance(items, list) else None
+
+def _load_bag_list(shard: RoomShard, *, fast: bool = False) -> Optional[List[Dict[str, Any]]]:
+    """Fetch the bag list into the shard cache; None when no endpoint answered."""
+    started = time.time()
+    for path in BAG_LIST_PATHS:
+        def _get(path: str = path) -> requests.Response:
+            with provider_breakers.guard("bag_list"), provider_latency.timing("bag_list"):
+                return shard.session.get(
+                    f"{PROVIDER_BASE_URL}{path}", params={"room_id": shard.room_id}, timeout=_http_timeout("bag_list", fast),
+                )
+
         try:
-            resp = session.get(ep, params={"room_id": str(room_id)}, timeout=_http_timeout(fast))
-            j = resp.json()
-            data = j.get("data") or {}
-            items = data.get("list") or data.get("bag_list") or []
-            if isinstance(items, list):
-                _bag_cache[room_id] = (now, items)
+            resp = provider_hedge.call("bag_list", _get)
+            items = _bag_items_from_body(resp.json())
+            if items is not None:
+                shard.bag.store(items, started, time.time())
                 return items
         except Exception:
             continue
-    _bag_cache[room_id] = (now, [])
-    return []
+    shard.bag.store(None, started, time.time())
+    return None
+
+_bag_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bag-refresh")
+
+def _fetch_bag_list(shard: RoomShard, *, fast: bool = False) -> List[Dict[str, Any]]:
+    items, refresh = shard.bag.serve(time.time(), _bag_cache_ttl())
+    if items is None:
+        # 还没有任何快照（预热没拿到）：只能同步拉一次，否则背包礼物会被当成付费礼物直接送
+        return _load_bag_list(shard, fast=fast) or []
+    if refresh:
+        _bag_refresher.submit(_load_bag_list, shard)
+    return items
+
+SENDGIFT_URL = f"{PROVIDER_BASE_URL}/xlive/revenue/v1/gift/sendGift"
+
+def _sendgift_form(shard: RoomShard, cookie_kv: Dict[str, str], ruid: int, gift_id: str) -> Optional[SendGiftForm]:
+    """The shard's compiled sendGift form for ``gift_id``; None without a csrf token.
+
+    Forms are built at warm-up for every allowed gift (a send for one that
+    was missed builds it here) and dropped when the room's ruid changes.
+    """
+    form = shard.forms.get(gift_id)
+    if form is None:
+        csrf = _get_csrf(cookie_kv)
+        if not csrf:
+            return None
+        # async 后端的 shard.session 就是整份请求头（含 Cookie），一起预先合好
+        headers = {**shard.session, "Content-Type": FORM_CONTENT_TYPE} if THREESERVER_BACKEND == "async" else None
+        form = SendGiftForm(csrf=csrf, room_id=shard.room_id, ruid=ruid, gift_id=gift_id, headers=headers)
+        shard.forms[gift_id] = form
+    return form
+
+def _compile_sendgift_forms(shard: RoomShard, cookie_kv: Dict[str, str]) -> bool:
+    if not shard.ruid:
+        return False
+    return all([_sendgift_form(shard, cookie_kv, shard.ruid, gift_id) is not None for gift_id in sorted(ALLOWED_GIFT_IDS)])
+
+def _post_sendgift(session: requests.Session, form: SendGiftForm, post: GiftPost, *, fast: bool) -> PostOutcome:
+    try:
+        started = time.monotonic()
+        with provider_breakers.guard("sendGift"), provider_latency.timing("sendGift"):
+            resp = session.post(SENDGIFT_URL, data=post.body, headers=form.headers, timeout=_http_timeout("sendGift", fast))
+        send_queue.window.note_provider_latency(time.monotonic() - started)
+        try:
+            body = resp.json()
+        except Exception:
+            return False, resp.status_code, {"code": -1, "message": "invalid_provider_response"}, True
+        if body.get("code") == 0:
+            return True, resp.status_code, body, False
+        return False, resp.status_code, body, False
+    except ProviderUnavailable:
+        # The breaker kept the call from going out: a certain non-send.
+        return False, 0, {"code": -1, "message": PROVIDER_UNAVAILABLE}, False
+    except Exception as error:
+        # A timeout or broken response can happen after the provider has
+        # accepted the gift. Retrying another endpoint could send twice.
+        return False, 0, {"code": -1, "message": type(error).__name__}, True
 
 def _send_gift_http(
-    session: requests.Session,
+    shard: RoomShard,
     cookie_kv: Dict[str, str],
     *,
-    room_id: str,
     ruid: int,
     gift_id: str,
     count: int,
     fast: bool,
+    bag_plan: BagPlan,
 ) -> Dict[str, Any]:
-    csrf = _get_csrf(cookie_kv)
-    if not csrf:
+    form = _sendgift_form(shard, cookie_kv, ruid, gift_id)
+    if form is None:
         return {"id": str(gift_id), "count": count, "success": False, "error": "missing_csrf(bili_jct)"}
 
-    # 先尝试用背包（如果有），避免走付费路径
-    prefer_bag = str(os.getenv("BILI_GIFTSEND_PREFER_BAG", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
-    bag_items = _fetch_bag_list(session, room_id, fast=fast) if prefer_bag else []
-
-    remaining = int(count)
-    results: List[Dict[str, Any]] = []
-
-    def _provider_transaction_id(body: Dict[str, Any]) -> Optional[str]:
-        data = body.get("data") if isinstance(body, dict) else None
-        candidates = [body, data] if isinstance(data, dict) else [body]
-        for candidate in candidates:
-            if not isinstance(candidate, dict):
-                continue
-            for key in ("transaction_id", "transactionId", "order_id", "orderId", "tid"):
-                value = candidate.get(key)
-                if isinstance(value, (str, int)) and 1 <= len(str(value)) <= 200:
-                    return str(value)
-        return None
+    # 背包部分已由 _plan_bag 为整批算好，这里只按计划发送
+    steps = gift_send_steps(form=form, count=count, bag_plan=bag_plan)
+    try:
+        post = next(steps)
+        while True:
+            outcome = _post_sendgift(shard.session, form, post, fast=fast)
+            _note_bag_send(shard, post, outcome)
+            post = steps.send(outcome)
+    except StopIteration as finished:
+        return finished.value
+
+def _parse_gift_item(item: Any) -> Tuple[str, int]:
+    if isinstance(item, dict):
+        gid = str(item.get("id") or item.get("gift_id") or item.get("giftId") or item.get("gid") or "")
+        return gid, int(item.get("count") or 1)
+    return str(item), 1
+
+def _provider_unavailable_results(gift_list: List[Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": str(item.get("id") if isinstance(item, dict) else item), "success": False,
+            "error": PROVIDER_UNAVAILABLE, "outcome_uncertain": False,
+        }
+        for item in gift_list
+    ]
 
-    def _post_sendgift(payload: Dict[str, Any]) -> Tuple[bool, int, Dict[str, Any], bool]:
-        endpoint = "https://api.live.bilibili.com/xlive/revenue/v1/gift/sendGift"
-        try:
-            resp = session.post(endpoint, data=payload, timeout=_http_timeout(fast))
-            try:
-                body = resp.json()
-            except Exception:
-                return False, resp.status_code, {"code": -1, "message": "invalid_provider_response"}, True
-            if body.get("code") == 0:
-                return True, resp.status_code, body, False
-            return False, resp.status_code, body, False
-        except Exception as error:
-            # A timeout or broken response can happen after the provider has
-            # accepted the gift. Retrying another endpoint could send twice.
-            return False, 0, {"code": -1, "message": type(error).__name__}, True
+def _missing_room_uid_results(gift_list: List[Any]) -> List[Dict[str, Any]]:
+    return [{"id": str(item.get("id") if isinstance(item, dict) else item), "success": False, "error": "missing_room_uid"} for item in gift_list]
 
-    # 使用背包分片发送
-    if bag_items and remaining > 0:
-        for it in bag_items:
-            try:
-                if str(it.get("gift_id")) != str(gift_id):
-                    continue
-                bag_id = it.get("bag_id") or it.get("id")
-                gift_num = int(it.get("gift_num") or it.get("num") or 0)
-                if not bag_id or gift_num <= 0:
-                    continue
-                n = min(remaining, gift_num)
-                payload = {
-                    "gift_id": str(gift_id),
-                    "room_id": str(room_id),
-                    "roomid": str(room_id),
-                    "ruid": str(ruid),
-                    "num": str(n),
-                    "gift_num": str(n),
-                    "bag_id": str(bag_id),
-                    "biz_id": str(room_id),
-                    "platform": "pc",
-                    "csrf": csrf,
-                    "csrf_token": csrf,
-                }
-                ok, status_code, raw, outcome_uncertain = _post_sendgift(payload)
-                results.append({
-                    "id": str(gift_id), "count": n, "success": ok,
-                    "status_code": status_code, "mode": "bag",
-                    "provider_transaction_id": _provider_transaction_id(raw),
-                    "outcome_uncertain": outcome_uncertain,
-                })
-                if ok:
-                    remaining -= n
-                else:
-                    # Never fall through to a paid send after an ambiguous bag
-                    # response; that would be an automatic duplicate attempt.
-                    if outcome_uncertain:
-                        remaining = 0
-                    break
-                if remaining <= 0:
-                    break
-            except Exception:
-                continue
-
-    # 剩余数量：尝试直接 sendGift（可能会消耗电池/或被拒）
-    if remaining > 0:
-        payload = {
-            "gift_id": str(gift_id),
-            "room_id": str(room_id),
-            "roomid": str(room_id),
-            "ruid": str(ruid),
-            "num": str(remaining),
-            "gift_num": str(remaining),
-            "bag_id": "0",
-            "biz_id": str(room_id),
-            "platform": "pc",
-            "csrf": csrf,
-            "csrf_token": csrf,
-        }
-        ok, status_code, raw, outcome_uncertain = _post_sendgift(payload)
-        results.append({
-            "id": str(gift_id), "count": remaining, "success": ok,
-            "status_code": status_code, "mode": "direct",
-            "provider_transaction_id": _provider_transaction_id(raw),
-            "outcome_uncertain": outcome_uncertain,
-        })
+def _account_unavailable_results(gift_list: List[Any]) -> List[Dict[str, Any]]:
+    return [{"id": str(item.get("id") if isinstance(item, dict) else item), "success": False, "error": "account_unavailable"} for item in gift_list]
 
-    # 兼容 threeserver 既有返回格式：单个礼物也返回一条（或多条分片）
-    if len(results) == 1:
-        return results[0]
-    return {
-        "id": str(gift_id),
-        "count": count,
-        "success": all(r.get("success") for r in results),
-        "outcome_uncertain": any(r.get("outcome_uncertain") for r in results),
-        "mode": "split",
-        "provider_transaction_ids": [
-            r.get("provider_transaction_id") for r in results
-            if r.get("provider_transaction_id")
-        ],
-        "parts": results,
-    }
+def _plan_bag(
+    bag_items: List[Dict[str, Any]], groups: Dict[str, List[Tuple[int, int]]],
+) -> Dict[int, BagPlan]:
+    """Bag plan per gift_list index: one pass over the snapshot for the whole batch."""
+    indexed = [(index, gid, cnt) for gid, entries in groups.items() for index, cnt in entries]
+    plans = plan_bag_sends(bag_items, [(gid, cnt) for _index, gid, cnt in indexed])
+    return {index: plan for (index, _gid, _cnt), plan in zip(indexed, plans)}
 
-def _send_gifts_batch_http(gift_list: List[Any], *, fast: bool = False) -> List[Dict[str, Any]]:
-    session, cookie_kv = _get_http_session()
-    room_id = str(ROOM_ID)
-    ruid = _get_room_uid(session, room_id, fast=fast)
+def _group_gift_items(gift_list: List[Any], results: List[Optional[Dict[str, Any]]]) -> Dict[str, List[Tuple[int, int]]]:
+    groups: Dict[str, List[Tuple[int, int]]] = {}
+    for index, item in enumerate(gift_list):
+        gid, cnt = _parse_gift_item(item)
+        if not gid:
+            results[index] = {"id": "", "count": cnt, "success": False, "error": "missing_gift_id"}
+            continue
+        groups.setdefault(gid, []).append((index, cnt))
+    return groups
+
+def _mark_group_uncertain(gift_list: List[Any], results: List[Optional[Dict[str, Any]]], entries: List[Tuple[int, int]], error: BaseException) -> None:
+    # The provider may already have accepted part of this group.
+    for index, cnt in entries:
+        if results[index] is None:
+            results[index] = {
+                "id": _parse_gift_item(gift_list[index])[0], "count": cnt, "success": False,
+                "outcome_uncertain": True, "error": type(error).__name__,
+            }
+
+def _send_gifts_batch_http(
+    gift_list: List[Any], *, account: Optional[Account] = None, room_id: Optional[str] = None,
+    fast: bool = False, priority: int = LANE_RANK[LANE_GIFT],
+) -> List[Dict[str, Any]]:
+    account = account or accounts.get()
+    if account is None:
+        return _account_unavailable_results(gift_list)
+    if provider_breakers.retry_after("sendGift", reject=True) is not None:
+        return _provider_unavailable_results(gift_list)
+    shard = account.shards.get(room_id)
+    cookie_kv = account.cookie_kv
+    ruid = _get_room_uid(shard, fast=fast)
     if not ruid:
-        return [{"id": str(item.get("id") if isinstance(item, dict) else item), "success": False, "error": "missing_room_uid"} for item in gift_list]
+        return _missing_room_uid_results(gift_list)
+    shard.sends += 1
 
-    results: List[Dict[str, Any]] = []
-    for item in gift_list:
-        if isinstance(item, dict):
-            gid = str(item.get("id") or item.get("gift_id") or item.get("giftId") or item.get("gid") or "")
-            cnt = int(item.get("count") or 1)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(gift_list)
+    groups = _group_gift_items(gift_list, results)
+    # 先尝试用背包（如果有），避免走付费路径
+    plans = _plan_bag(_fetch_bag_list(shard, fast=fast) if PREFER_BAG else [], groups)
+
+    def _send_group(gid: str, entries: List[Tuple[int, int]]) -> None:
+        for index, cnt in entries:
+            results[index] = _send_gift_http(
+                shard, cookie_kv, ruid=int(ruid), gift_id=gid, count=cnt, fast=fast, bag_plan=plans[index],
+            )
+
+    # 不同礼物并发发送；同一礼物在本请求内保持顺序，避免自己和自己抢同一个背包堆叠。
+    # 每个分片各自只发一次，失败或 outcome_uncertain 都不会重试。
+    futures = [
+        (entries, provider_pool.submit(priority, _send_group, gid, entries))
+        for gid, entries in groups.items()
+    ]
+    for entries, future in futures:
+        try:
+            future.result()
+        except Exception as error:
+            _mark_group_uncertain(gift_list, results, entries, error)
+    return [result for result in results if result is not None]
+
+def _mark_request_sending(*items: Dict[str, Any]) -> None:
+    status_store.mark_sending(*(item["request_id"] for item in items if item.get("request_id")))
+
+def _finish_http_request(item: Dict[str, Any], results: List[Dict[str, Any]]) -> None:
+    req_id = item.get("request_id")
+    if req_id:
+        status_store.finish(req_id, results)
+    accounts.release(item.get("account"), results)
+    event = item.get("result_event")
+    if event:
+        event.set()
+
+def _process_http_request(item: Dict[str, Any]) -> None:
+    _mark_request_sending(item)
+    # HTTP backend already waits for B站接口返回；confirm 参数仅用于标注
+    results = _send_gifts_batch_http(
+        item.get("gifts", []), account=item.get("account"), room_id=item.get("room_id"), fast=bool(item.get("fast")),
+        priority=LANE_RANK.get(item.get("lane"), LANE_RANK[LANE_GIFT]),
+    )
+    _finish_http_request(item, results)
+
+def _dispatch_jobs(items: List[Any]) -> List[Any]:
+    """Turn drained items into dispatch jobs; with coalescing on, gift requests
+    in the same lane, with the same deadline, timeout class, account and room
+    become one list job (see coalesce.coalesce_key)."""
+    if not COALESCE_ENABLED:
+        return items
+    return group_jobs(items, LANE_RANK, LANE_GIFT)
+
+def _coalesce_plan(items: List[Dict[str, Any]]):
+    live = []
+    for item in items:
+        if deadline_passed(item):
+            expire_queued_item(item)
         else:
-            gid = str(item)
-            cnt = 1
-        if not gid:
-            results.append({"id": "", "count": cnt, "success": False, "error": "missing_gift_id"})
-            continue
-        results.append(_send_gift_http(session, cookie_kv, room_id=room_id, ruid=int(ruid), gift_id=gid, count=cnt, fast=fast))
-    return results
+            live.append(item)
+    entries = [[_parse_gift_item(gift) for gift in item.get("gifts", [])] for item in live]
+    # 合并后的单次 sendGift 不超过 /send 自身单项上限，合并只省调用次数
+    merged = coalesce_requests(entries, MAX_GIFT_COUNT_PER_ITEM)
+    with dispatch_stats_lock:
+        dispatch_stats["coalesced_jobs"] += 1
+        dispatch_stats["coalesced_requests"] += len(live)
+        dispatch_stats["coalesced_calls_saved"] += sum(len(e) for e in entries) - len(merged)
+    return live, entries, merged
+
+def _finish_coalesced(live, entries, merged, batch_results: List[Dict[str, Any]]) -> None:
+    per_request: List[List[Optional[Dict[str, Any]]]] = [[None] * len(e) for e in entries]
+    for gift, result in zip(merged, batch_results):
+        for share, share_result in zip(gift.shares, split_result(result, gift)):
+            per_request[share.request_index][share.entry_index] = share_result
+    for item, results in zip(live, per_request):
+        _finish_http_request(item, [result for result in results if result is not None])
+
+def _process_coalesced_http(items: List[Dict[str, Any]]) -> None:
+    live, entries, merged = _coalesce_plan(items)
+    if not live:
+        return
+    _mark_request_sending(*live)
+    results = _send_gifts_batch_http(
+        [{"id": gift.gift_id, "count": gift.count} for gift in merged],
+        account=live[0].get("account"), room_id=live[0].get("room_id"), fast=bool(live[0].get("fast")),
+        priority=min(LANE_RANK.get(item.get("lane"), LANE_RANK[LANE_GIFT]) for item in live),
+    )
+    _finish_coalesced(live, entries, merged, results)
+
+def _dispatch_http_item(item: Any) -> None:
+    if isinstance(item, list):
+        _process_coalesced_http(item)
+    elif isinstance(item, dict) and "gifts" in item:
+        if deadline_passed(item):
+            expire_queued_item(item)
+            return
+        _process_http_request(item)
+    elif isinstance(item, dict):
+        # 余额检查等控制项：HTTP 后端不处理。弹幕在 API 后端只走 danmaku_lane，不进送礼队列。
+        pass
+    else:
+        # 兼容旧逻辑：队列里直接塞 gift_id
+        _send_gifts_batch_http([item], fast=False)
 
 def run_http_worker():
     """
     HTTP giftsend 后端：不依赖 Playwright，直接用 B站接口送礼/发弹幕。
     其他脚本仍然走 threeserver 的 /send、/danmaku，不用改调用方。
     """
+    global provider_pool
     print("✅ Three server 启动：HTTP giftsend 后端")
     print(f"🎯 当前送礼房间: {ROOM_ID}")
     print(f"🍪 cookie来源: {COOKIE_FILE}")
+    print(f"🔀 并发发送: {DISPATCH_CONCURRENCY}")
+
+    provider_pool = PriorityPool(DISPATCH_CONCURRENCY, name="provider")
+    request_threads = ThreadPoolExecutor(DISPATCH_CONCURRENCY, thread_name_prefix="request")
+    request_slots = threading.BoundedSemaphore(DISPATCH_CONCURRENCY)
+
+    def _run_item(item: Any) -> None:
+        with dispatch_stats_lock:
+            dispatch_stats["active_requests"] += 1
+        try:
+            _dispatch_http_item(item)
+        except Exception as error:
+            logger.error(f"❌ 发送任务异常: {type(error).__name__}")
+        finally:
+            with dispatch_stats_lock:
+                dispatch_stats["active_requests"] -= 1
+            request_slots.release()
 
     while True:
-        if gift_queue:
-            gifts_to_send: List[Any] = []
-            special_items: List[Any] = []
-            batch_requests: List[Dict[str, Any]] = []
+        # Take work only when a request slot is free, so lane priority (not
+        # the executor's FIFO) decides what runs next. One lower-lane item per
+        # pass: a PK send enqueued during a wish burst is picked up next.
+        request_slots.acquire()
+        items = send_queue.drain(max_items=COALESCE_MAX_REQUESTS if COALESCE_ENABLED else 1)
+        if not items:
+            request_slots.release()
+            continue
+        for index, job in enumerate(_dispatch_jobs(items)):
+            if index > 0:
+                request_slots.acquire()
+            request_threads.submit(_run_item, job)
+
+# async 后端：provider 调用跑在单个 asyncio 事件循环线程上（httpx.AsyncClient），
+# 队列、状态记录、送礼协议（gift_protocol）与 HTTP 后端共用。
+_async_streams: Optional[asyncio.Semaphore] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_ready = threading.Event()
+
+def _async_timeout(endpoint: str, fast: bool = False):
+    connect, read = _http_timeout(endpoint, fast)
+    return httpx.Timeout(read, connect=connect)
+
+def _make_async_client():
+    # Cookies go per request in each account's shard headers.
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        headers=_provider_headers(),
+        limits=httpx.Limits(max_connections=ASYNC_MAX_STREAMS, max_keepalive_connections=ASYNC_MAX_STREAMS),
+        # 每个请求都会带自己的 timeout；这里只是兜底
+        timeout=httpx.Timeout(3.0, connect=1.2),
+    )
 
-            for item in drain_queue():
-                if isinstance(item, dict):
-                    if "gifts" in item:
-                        batch_requests.append(item)
-                        continue
-                    special_items.append(item)
-                else:
-                    gifts_to_send.append(item)
+async def _get_room_uid_async(shard: RoomShard, *, fast: bool = False) -> Optional[int]:
+    if _cached_room_uid(shard):
+        return shard.ruid
 
-            # 优先处理送礼（降低排队延迟）
-            for item in batch_requests:
-                gift_list = item.get("gifts", [])
-                req_id = item.get("request_id")
-                fast = bool(item.get("fast"))
-                _confirm = str(item.get("confirm") or "click").strip().lower()
-                if req_id:
-                    with request_lock:
-                        st = request_status.get(req_id)
-                        if st is not None:
-                            st["status"] = "sending"
-                            st["sending_ts"] = st.get("sending_ts") or time.time()
-                            st["updated_ts"] = time.time()
-
-                # HTTP backend already waits for B站接口返回；confirm 参数仅用于标注
-                results = _send_gifts_batch_http(gift_list, fast=fast)
-                storage = item.get("result_storage")
-                if storage is not None:
-                    storage["results"] = results
-                    storage["success_count"] = sum(1 for r in results if r.get("success"))
-                    storage["failed_count"] = len(results) - storage["success_count"]
+    async def _get():
+        async with _async_streams:
+            with provider_breakers.guard("get_info"), provider_latency.timing("get_info"):
+                return await async_client.get(
+                    f"{PROVIDER_BASE_URL}/room/v1/Room/get_info?room_id={shard.room_id}",
+                    headers=shard.session, timeout=_async_timeout("get_info", fast),
+                )
 
-                if req_id:
-                    with request_lock:
-                        st = request_status.get(req_id)
-                        if st is not None:
-                            st["status"] = "done"
-                            st["results"] = results
-                            st["done_ts"] = time.time()
-                            st["updated_ts"] = time.time()
+    try:
+        return _remember_room_uid(shard, (await provider_hedge.call_async("get_info", _get)).json())
+    except Exception:
+        return None
 
-                event = item.get("result_event")
-                if event:
-                    event.set()
+async def _load_bag_list_async(shard: RoomShard, *, fast: bool = False) -> Optional[List[Dict[str, Any]]]:
+    started = time.time()
+    for path in BAG_LIST_PATHS:
+        async def _get(path: str = path):
+            async with _async_streams:
+                with provider_breakers.guard("bag_list"), provider_latency.timing("bag_list"):
+                    return await async_client.get(
+                        f"{PROVIDER_BASE_URL}{path}", params={"room_id": shard.room_id},
+                        headers=shard.session, timeout=_async_timeout("bag_list", fast),
+                    )
 
-            # 兼容旧逻辑：队列里直接塞 gift_id
-            if gifts_to_send:
-                _send_gifts_batch_http(gifts_to_send, fast=False)
+        try:
+            resp = await provider_hedge.call_async("bag_list", _get)
+            items = _bag_items_from_body(resp.json())
+            if items is not None:
+                shard.bag.store(items, started, time.time())
+                return items
+        except Exception:
+            continue
+    shard.bag.store(None, started, time.time())
+    return None
 
-            # 弹幕/余额等
-            session, cookie_kv = _get_http_session()
-            for item in special_items:
-                if isinstance(item, dict) and "danmaku" in item:
-                    text = str(item["danmaku"])
-                    res = _send_danmaku_http(session, cookie_kv, str(ROOM_ID), text, fast=True)
-                    ok = res.get("success")
-                    if ok:
-                        print("✅ 弹幕发送成功")
-                    else:
-                        print(f"❌ 弹幕发送失败: {res}")
-                # balance checks: noop in HTTP backend
-        else:
-            time.sleep(0.001)
+# 后台刷新背包的任务；留引用，避免还没跑完就被回收
+_bag_refresh_tasks: set = set()
+
+async def _fetch_bag_list_async(shard: RoomShard, *, fast: bool = False) -> List[Dict[str, Any]]:
+    items, refresh = shard.bag.serve(time.time(), _bag_cache_ttl())
+    if items is None:
+        return await _load_bag_list_async(shard, fast=fast) or []
+    if refresh:
+        task = asyncio.ensure_future(_load_bag_list_async(shard))
+        _bag_refresh_tasks.add(task)
+        task.add_done_callback(_bag_refresh_tasks.discard)
+    return items
+
+async def _post_sendgift_async(form: SendGiftForm, post: GiftPost, *, fast: bool) -> PostOutcome:
+    try:
+        async with _async_streams:
+            started = time.monotonic()
+            with provider_breakers.guard("sendGift"), provider_latency.timing("sendGift"):
+                resp = await async_client.post(
+                    SENDGIFT_URL, content=post.body, headers=form.headers, timeout=_async_timeout("sendGift", fast),
+                )
+            send_queue.window.note_provider_latency(time.monotonic() - started)
+        try:
+            body = resp.json()
+        except Exception:
+            return False, resp.status_code, {"code": -1, "message": "invalid_provider_response"}, True
+        if body.get("code") == 0:
+            return True, resp.status_code, body, False
+        return False, resp.status_code, body, False
+    except ProviderUnavailable:
+        return False, 0, {"code": -1, "message": PROVIDER_UNAVAILABLE}, False
+    except Exception as error:
+        # Same rule as _post_sendgift: the provider may have accepted it.
+        return False, 0, {"code": -1, "message": type(error).__name__}, True
+
+async def _warm_shard_async(shard: RoomShard) -> bool:
+    ruid = await _get_room_uid_async(shard)
+    if ruid and PREFER_BAG:
+        await _fetch_bag_list_async(shard)
+    return bool(ruid)
+
+async def _send_gift_async(
+    shard: RoomShard, cookie_kv: Dict[str, str], *, ruid: int, gift_id: str, count: int, fast: bool, bag_plan: BagPlan,
+) -> Dict[str, Any]:
+    form = _sendgift_form(shard, cookie_kv, ruid, gift_id)
+    if form is None:
+        return {"id": str(gift_id), "count": count, "success": False, "error": "missing_csrf(bili_jct)"}
+    steps = gift_send_steps(form=form, count=count, bag_plan=bag_plan)
+    try:
+        post = next(steps)
+        while True:
+            outcome = await _post_sendgift_async(form, post, fast=fast)
+            _note_bag_send(shard, post, outcome)
+            post = steps.send(outcome)
+    except StopIteration as finished:
+        return finished.value
+
+async def _send_gifts_batch_async(
+    gift_list: List[Any], *, account: Optional[Account] = None, room_id: Optional[str] = None, fast: bool = False,
+) -> List[Dict[str, Any]]:
+    account = account or accounts.get()
+    if account is None:
+        return _account_unavailable_results(gift_list)
+    if provider_breakers.retry_after("sendGift", reject=True) is not None:
+        return _provider_unavailable_results(gift_list)
+    shard = account.shards.get(room_id)
+    ruid = await _get_room_uid_async(shard, fast=fast)
+    if not ruid:
+        return _missing_room_uid_results(gift_list)
+    shard.sends += 1
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(gift_list)
+    groups = _group_gift_items(gift_list, results)
+    plans = _plan_bag(await _fetch_bag_list_async(shard, fast=fast) if PREFER_BAG else [], groups)
+
+    async def _send_group(gid: str, entries: List[Tuple[int, int]]) -> None:
+        for index, cnt in entries:
+            results[index] = await _send_gift_async(
+                shard, account.cookie_kv, ruid=int(ruid), gift_id=gid, count=cnt, fast=fast, bag_plan=plans[index],
+            )
+
+    # 与 HTTP 后端相同：不同礼物并发，同一礼物保持顺序，不重试。
+    outcomes = await asyncio.gather(
+        *(_send_group(gid, entries) for gid, entries in groups.items()),
+        return_exceptions=True,
+    )
+    for entries, outcome in zip(groups.values(), outcomes):
+        if isinstance(outcome, BaseException):
+            _mark_group_uncertain(gift_list, results, entries, outcome)
+    return [result for result in results if result is not None]
+
+async def _dispatch_async_item(item: Any) -> None:
+    if isinstance(item, list):
+        live, entries, merged = _coalesce_plan(item)
+        if not live:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, _mark_request_sending, *live)
+        results = await _send_gifts_batch_async(
+            [{"id": gift.gift_id, "count": gift.count} for gift in merged],
+            account=live[0].get("account"), room_id=live[0].get("room_id"), fast=bool(live[0].get("fast")),
+        )
+        _finish_coalesced(live, entries, merged, results)
+    elif isinstance(item, dict) and "gifts" in item:
+        if deadline_passed(item):
+            expire_queued_item(item)
+            return
+        # Waits for the journal's fsync, so keep it off the event loop.
+        await asyncio.get_running_loop().run_in_executor(None, _mark_request_sending, item)
+        results = await _send_gifts_batch_async(
+            item.get("gifts", []), account=item.get("account"), room_id=item.get("room_id"), fast=bool(item.get("fast")),
+        )
+        _finish_http_request(item, results)
+    elif isinstance(item, dict):
+        pass  # 控制项：同 HTTP 后端，弹幕只走 danmaku_lane
+    else:
+        await _send_gifts_batch_async([item], fast=False)
+
+def run_async_worker():
+    """
+    async 后端：和 HTTP 后端同一套接口与语义，provider 调用改为单线程事件循环 +
+    httpx.AsyncClient。装了 h2 时走 HTTP/2，多个请求复用一条连接的多个 stream。
+    """
+    global _async_loop
+    if httpx is None:
+        raise RuntimeError(f"httpx not available: {_httpx_import_error}")
+    print("✅ Three server 启动：async giftsend 后端")
+    print(f"🎯 当前送礼房间: {ROOM_ID}")
+    print(f"🍪 cookie来源: {COOKIE_FILE}")
+    print(f"🔀 并发 stream: {ASYNC_MAX_STREAMS} ({'HTTP/2' if HTTP2_AVAILABLE else 'HTTP/1.1'})")
+
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, name="async-provider", daemon=True).start()
+
+    async def _open_client() -> None:
+        global async_client, _async_streams
+        _async_streams = asyncio.Semaphore(ASYNC_MAX_STREAMS)
+        async_client = _make_async_client()
+
+    asyncio.run_coroutine_threadsafe(_open_client(), loop).result()
+    _async_loop = loop
+    _async_ready.set()
+    request_slots = threading.BoundedSemaphore(ASYNC_MAX_STREAMS)
+
+    async def _run_item(item: Any) -> None:
+        with dispatch_stats_lock:
+            dispatch_stats["active_requests"] += 1
+        try:
+            await _dispatch_async_item(item)
+        except Exception as error:
+            logger.error(f"❌ 发送任务异常: {type(error).__name__}")
+        finally:
+            with dispatch_stats_lock:
+                dispatch_stats["active_requests"] -= 1
+            request_slots.release()
+
+    while True:
+        # Same admission as run_http_worker: a free slot first, then one
+        # lower-lane item per drain so lane priority decides what starts next.
+        request_slots.acquire()
+        items = send_queue.drain(max_items=COALESCE_MAX_REQUESTS if COALESCE_ENABLED else 1)
+        if not items:
+            request_slots.release()
+            continue
+        for index, job in enumerate(_dispatch_jobs(items)):
+            if index > 0:
+                request_slots.acquire()
+            asyncio.run_coroutine_threadsafe(_run_item(job), loop)
+
+# 启动预热：先建好 provider 连接、解析 ruid、拉一次背包，再在 / 报告 ready；
+# 之后定期保活连接、刷新背包缓存。listener 等 ready 再把首个送礼交给我们。
+WARMUP_TIMEOUT_SECONDS = min(60.0, max(1.0, float(os.getenv("THREESERVER_WARMUP_TIMEOUT_SECONDS", "8") or 8)))
+KEEPALIVE_SECONDS = max(0.0, float(os.getenv("THREESERVER_KEEPALIVE_SECONDS", "15") or 0))
+WARMUP_ENABLED = str(os.getenv("THREESERVER_WARMUP", "1") or "1").strip().lower() not in ("0", "false", "no", "n", "off")
+WARMUP_CONNECTIONS = 4
+
+def _on_provider_loop(make_coro: Callable[[], Any]) -> Any:
+    """Run a coroutine on the async backend's loop from a warm-up thread."""
+    if not _async_ready.wait(timeout=WARMUP_TIMEOUT_SECONDS):
+        raise TimeoutError("async provider loop not started")
+    return asyncio.run_coroutine_threadsafe(make_coro(), _async_loop).result(timeout=WARMUP_TIMEOUT_SECONDS)
+
+def _warm_shards() -> List[RoomShard]:
+    account = accounts.get()
+    if account is None:
+        return []
+    return [account.shards.get(room_id) for room_id in sorted(SEND_ROOM_IDS, key=lambda room: room != str(ROOM_ID))]
+
+def _ping_provider(shard: RoomShard) -> bool:
+    """One room info GET: opens or keeps alive a pooled connection and refreshes the ruid."""
+    url = f"{PROVIDER_BASE_URL}/room/v1/Room/get_info?room_id={shard.room_id}"
+    if THREESERVER_BACKEND == "async":
+        async def _get():
+            async with _async_streams:
+                with provider_latency.timing("get_info"):
+                    return await async_client.get(url, headers=shard.session, timeout=_async_timeout("get_info"))
+        resp = _on_provider_loop(_get)
+    else:
+        with provider_latency.timing("get_info"):
+            resp = shard.session.get(url, timeout=_http_timeout("get_info"))
+    return _remember_room_uid(shard, resp.json()) is not None
+
+def _warm_dns() -> bool:
+    # 同步解析一次，后面预热的连接就已经连到固定地址上。
+    if provider_dns is None or PROVIDER_HOST not in provider_dns:
+        return True
+    return provider_dns.refresh(PROVIDER_HOST)
+
+def _warm_connections() -> bool:
+    shards = _warm_shards()
+    if not shards:
+        return False
+    # Overlapping requests so the pool ends up holding several live sockets
+    # (with HTTP/2 they are streams on one connection).
+    count = min(WARMUP_CONNECTIONS, ASYNC_MAX_STREAMS if THREESERVER_BACKEND == "async" else DISPATCH_CONCURRENCY)
+    with ThreadPoolExecutor(count, thread_name_prefix="warmup") as pool:
+        return all(list(pool.map(lambda _: _ping_provider(shards[0]), range(count))))
+
+def _warm_room_uids() -> bool:
+    shards = _warm_shards()
+    return bool(shards) and all([bool(_cached_room_uid(shard)) or _ping_provider(shard) for shard in shards])
+
+def _warm_sendgift_forms() -> bool:
+    account = accounts.get()
+    shards = _warm_shards()
+    return bool(shards) and all([_compile_sendgift_forms(shard, account.cookie_kv) for shard in shards])
+
+def _warm_bag_lists() -> bool:
+    shards = _warm_shards()
+    if THREESERVER_BACKEND == "async":
+        loaded = [_on_provider_loop(lambda shard=shard: _load_bag_list_async(shard)) for shard in shards]
+    else:
+        loaded = [_load_bag_list(shard) for shard in shards]
+    return bool(shards) and all(items is not None for items in loaded)
+
+def _keepalive() -> bool:
+    shards = _warm_shards()
+    return bool(shards) and _ping_provider(shards[0])
+
+def _make_warmup() -> Warmup:
+    if THREESERVER_BACKEND not in API_BACKENDS or not WARMUP_ENABLED:
+        return Warmup.skipped()
+    steps = [
+        ("cookies", lambda: accounts.get() is not None),
+        ("dns", _warm_dns),
+        ("connections", _warm_connections),
+        ("room_uid", _warm_room_uids),
+        ("sendgift_forms", _warm_sendgift_forms),
+    ]
+    refresh = [("keepalive", _keepalive)]
+    if PREFER_BAG:
+        steps.append(("bag_list", _warm_bag_lists))
+        refresh.append(("bag_list", _warm_bag_lists))
+    return Warmup(
+        steps, refresh if KEEPALIVE_SECONDS > 0 else [],
+        interval=KEEPALIVE_SECONDS or 15.0, timeout=WARMUP_TIMEOUT_SECONDS,
+    )
+
+warmup = _make_warmup()
 
 def check_balance_insufficient(page):
     """检测页面是否出现余额不足提示或读取当前余额"""
@@ -840,7 +1514,18 @@ def send_gifts():
     gifts = data.get("gifts", [])
     wait = bool(data.get("wait", True))
     fast = bool(data.get("fast", False) or (not wait))
+    # PK 通道由 lane 显式指定，与 fast（更短的供应商超时）互不影响
+    lane = LANE_PK if data.get("lane") == LANE_PK else LANE_GIFT
     confirm = str(data.get("confirm") or data.get("wait_mode") or "click").strip().lower()
+    # Optional absolute epoch-seconds deadline (e.g. the PK end time); the
+    # dispatcher drops the request as expired instead of sending it late.
+    deadline = data.get("deadline")
+    if deadline is not None and (
+        isinstance(deadline, bool) or not isinstance(deadline, (int, float))
+        or not math.isfinite(deadline)
+        or abs(deadline - time.time()) > MAX_DEADLINE_HORIZON_SECONDS
+    ):
+        return jsonify({"error": "invalid_deadline"}), 400
     if not isinstance(gifts, list) or not 1 <= len(gifts) <= MAX_GIFTS_PER_REQUEST:
         return jsonify({"error": "invalid_gifts"}), 400
 
@@ -864,46 +1549,59 @@ def send_gifts():
     gifts = normalized_gifts
     if confirm not in ("click", "api"):
         return jsonify({"error": "invalid_confirmation_mode"}), 400
-    if not cleanup_request_status():
-        return jsonify({"error": "request_status_capacity_reached"}), 503
-
-    # 简化：直接添加到队列，不考虑房间ID（硬送：不做余额/不足检查）
+    # 可选目标房间：必须在 THREESERVER_ROOM_IDS 白名单里，省略时送到主房间（硬送：不做余额/不足检查）
+    room_id = data.get("room_id")
+    if room_id is not None:
+        room_id = str(room_id).strip()
+        if room_id not in SEND_ROOM_IDS:
+            return jsonify({"error": "room_not_allowed"}), 400
+        if room_id == str(ROOM_ID):
+            room_id = None
+    # 可选账号：API 后端按账号隔离 cookie/会话/排队配额
+    account = None
+    account_id = data.get("account")
+    if account_id is not None and (not isinstance(account_id, str) or not ACCOUNT_ID_PATTERN.match(account_id)):
+        return jsonify({"error": "invalid_account"}), 400
+    if THREESERVER_BACKEND in API_BACKENDS:
+        account = accounts.get(account_id)
+        if account is None:
+            return jsonify({"error": "account_unavailable"}), 503
+        if not accounts.admit(account, exempt=lane == LANE_PK):
+            return _queue_rejected("account_queue_full", "full", 1.0)
+    elif account_id not in (None, DEFAULT_ACCOUNT):
+        return jsonify({"error": "account_not_supported_by_backend"}), 400
 
     import threading
+    # 事件循环服务器下，等结果的请求只是一个挂起的 future，不占线程
+    parking = request.environ.get(PARKING_ENVIRON_KEY) if wait else None
+    result_event = parking.event() if parking is not None else threading.Event()
+    if result_event is None:
+        accounts.release(account)
+        return _queue_rejected("too_many_waiting", "full", 1.0)
     request_id = str(uuid.uuid4())
-    result_event = threading.Event()
     # total 兼容：既支持 ["33988","33988"] 也支持 [{"id":"33988","count":100}]
-    result_storage = {
-        "request_id": request_id,
-        "total": total_count,
-        "results": [],
-        "success_count": 0,
-        "failed_count": 0
-    }
-    created_ts = time.time()
-    with request_lock:
-        request_status[request_id] = {
-            "status": "queued",
-            "results": [],
-            "created_ts": created_ts,
-            "updated_ts": created_ts,
-            "received_ts": created_ts,
-            "sending_ts": None,
-            "done_ts": None,
-            "backend": THREESERVER_BACKEND,
-            "confirm": confirm,
-        }
-    if not enqueue_item({
+    record = status_store.create(
+        request_id, backend=THREESERVER_BACKEND, confirm=confirm, deadline=deadline, total=total_count,
+    )
+    if record is None:
+        accounts.release(account)
+        return jsonify({"error": "request_status_capacity_reached"}), 503
+    created_ts = record.created_ts
+    rejection, retry_after = send_queue.offer({
         "gifts": gifts,
         "request_id": request_id,
+        "room_id": room_id,
+        "account": account,
         "fast": fast,
+        "lane": lane,
         "confirm": confirm,
+        "deadline": deadline,
         "result_event": result_event if wait else None,
-        "result_storage": result_storage
-    }):
-        with request_lock:
-            request_status.pop(request_id, None)
-        return jsonify({"error": "sender_queue_full"}), 503
+    }, lane, deadline)
+    if rejection is not None:
+        status_store.discard(request_id)
+        accounts.release(account)
+        return _queue_rejected("sender_queue_full", rejection, retry_after)
 
     from datetime import datetime
     receive_time = datetime.now().strftime("%H:%M:%S.%f")[:-3]
@@ -914,8 +1612,40 @@ def send_gifts():
         return jsonify({"success": True, "status": "queued", "request_id": request_id, "timing": {"received_ts": created_ts}}), 202
 
     wait_timeout = 20 if confirm == "api" else 10
-    if result_event.wait(timeout=wait_timeout):
-        results_list = result_storage.get("results") or []
+    if parking is not None:
+        # 事件循环服务器：等待不占线程，送完后由它调用 _send_outcome 回复
+        parking.defer(wait_timeout, functools.partial(_send_outcome, record, request_id, created_ts))
+        return "", 204
+    body, status = _send_outcome(record, request_id, created_ts, result_event.wait(timeout=wait_timeout))
+    return jsonify(body), status
+
+
+def _nothing_sent(item: Any) -> bool:
+    """A breaker-rejected result none of whose parts went (or may have gone) out."""
+    if not isinstance(item, dict) or item.get("error") != PROVIDER_UNAVAILABLE or item.get("outcome_uncertain"):
+        return False
+    return not any(
+        isinstance(part, dict) and (part.get("success") or part.get("outcome_uncertain"))
+        for part in item.get("parts") or ()
+    )
+
+
+def _send_outcome(record: RequestRecord, request_id: str, created_ts: float, completed: bool) -> Tuple[Dict[str, Any], int]:
+    """The /send answer once the request finished (``completed``) or the wait ran out."""
+    if completed:
+        if record.status == "expired":
+            timing = {"received_ts": record.created_ts, "done_ts": record.done_ts}
+            # Nothing reached the provider, so this is a certain non-send.
+            return {
+                "success": False,
+                "status": "expired",
+                "error": "deadline_expired",
+                "request_id": request_id,
+                "results": [],
+                "outcome_uncertain": False,
+                "timing": timing,
+            }, 200
+        results_list = record.results
         outcome_uncertain = any(
             isinstance(item, dict) and (
                 item.get("outcome_uncertain")
@@ -926,16 +1656,15 @@ def send_gifts():
             )
             for item in results_list
         )
+        failed_count = record.failed_count
         all_success = bool(results_list) \
-            and result_storage["failed_count"] == 0 \
+            and failed_count == 0 \
             and not outcome_uncertain
-        with request_lock:
-            st = request_status.get(request_id) or {}
-            timing = {
-                "received_ts": st.get("received_ts") or st.get("created_ts"),
-                "sending_ts": st.get("sending_ts"),
-                "done_ts": st.get("done_ts"),
-            }
+        timing = {
+            "received_ts": record.created_ts,
+            "sending_ts": record.sending_ts,
+            "done_ts": record.done_ts,
+        }
         if all_success:
             transaction_ids = []
             for item in results_list:
@@ -944,45 +1673,168 @@ def send_gifts():
                 if item.get("provider_transaction_id"):
                     transaction_ids.append(str(item["provider_transaction_id"]))
                 transaction_ids.extend(str(value) for value in item.get("provider_transaction_ids", []) if value)
-            return jsonify({
+            return {
                 "success": True,
                 "status": "ok",
                 "request_id": request_id,
-                "results": result_storage["results"],
+                "results": results_list,
                 "provider_transaction_ids": list(dict.fromkeys(transaction_ids)),
                 "provider_transaction_id": transaction_ids[0] if len(transaction_ids) == 1 else None,
                 "timing": timing,
-            })
+            }, 200
+        if results_list and all(_nothing_sent(item) for item in results_list):
+            # 熔断中，一个都没发出去：确定没送，调用方可以稍后再发
+            return {
+                "success": False,
+                "status": PROVIDER_UNAVAILABLE,
+                "error": PROVIDER_UNAVAILABLE,
+                "request_id": request_id,
+                "results": results_list,
+                "outcome_uncertain": False,
+                "retry_after_seconds": provider_breakers.retry_after("sendGift"),
+                "timing": timing,
+            }, 200
         # Keep the provider result in JSON. Callers must not automatically
         # retry a partial or uncertain external mutation.
-        return jsonify({
+        return {
             "success": False,
             "status": "partial_failed",
             "error": "部分礼物发送失败",
             "request_id": request_id,
-            "results": result_storage["results"],
-            "failed_count": result_storage["failed_count"],
+            "results": results_list,
+            "failed_count": failed_count,
             "outcome_uncertain": outcome_uncertain,
             "timing": timing,
-        }), 200
+        }, 200
 
-    return jsonify({
+    return {
         "success": False,
         "error": "送礼超时",
         "outcome_uncertain": True,
         "request_id": request_id,
-        "results": result_storage["results"],
+        "results": record.results,
         "timing": {"received_ts": created_ts},
-    }), 504
+    }, 504
 
 
 @app.route("/result/<request_id>", methods=["GET"])
 def get_send_result(request_id: str):
-    with request_lock:
-        st = request_status.get(request_id)
-        if not st:
-            return jsonify({"success": False, "error": "not_found", "request_id": request_id}), 404
-        return jsonify({"success": True, "request_id": request_id, **st})
+    st = status_store.snapshot(request_id)
+    if not st:
+        return jsonify({"success": False, "error": "not_found", "request_id": request_id}), 404
+    return jsonify({"success": True, "request_id": request_id, **st})
+
+
+# POST /results {"request_ids": [...]}：一次查多个请求的状态（对账用），同一把锁下读出，
+# 每项与 GET /result/<id> 的返回一致，按请求顺序（去重）排列。
+MAX_RESULTS_REQUEST_IDS = 500
+
+
+@app.route("/results", methods=["POST"])
+def get_send_results():
+    data = request.get_json(silent=True) or {}
+    request_ids = data.get("request_ids") if isinstance(data, dict) else None
+    if (
+        not isinstance(request_ids, list)
+        or not 1 <= len(request_ids) <= MAX_RESULTS_REQUEST_IDS
+        or not all(isinstance(request_id, str) and request_id for request_id in request_ids)
+    ):
+        return jsonify({
+            "success": False, "error": "invalid_request_ids", "max_ids": MAX_RESULTS_REQUEST_IDS,
+        }), 400
+    states = status_store.snapshot_many(dict.fromkeys(request_ids))
+    answers = []
+    for request_id, st in states.items():
+        if st is None:
+            answers.append({"success": False, "error": "not_found", "request_id": request_id})
+        else:
+            answers.append({"success": True, "request_id": request_id, **st})
+    return jsonify({
+        "success": True,
+        "results": answers,
+        "not_found": sum(1 for st in states.values() if st is None),
+    })
+
+
+# GET /events：SSE 推送 request_status 的每次状态变化（queued → sending → done/expired ...），
+# 带计时字段，省掉 wait=false 之后对 /result/<id> 的轮询。?ids=a,b 只推这些请求：先推各自
+# 当前状态（未知的推 not_found），全部结束后发 end 并关闭。不带 ids 推所有请求，直到
+# ?timeout= 秒（默认 300）。积压过多时丢最旧的并发 dropped 事件，调用方应回退到 /result。
+MAX_STREAM_REQUEST_IDS = 500
+STATUS_STREAM_TIMEOUT_SECONDS = 300.0
+MAX_STATUS_STREAM_TIMEOUT_SECONDS = 3600.0
+STATUS_STREAM_KEEPALIVE_SECONDS = 15.0
+SSE_KEEPALIVE = b": keep-alive\n\n"
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+
+def _status_stream(feed, until: float) -> Callable[[Optional[float]], Optional[bytes]]:
+    """poll(timeout): SSE bytes ready within ``timeout`` (b"" for none), None once the stream is over."""
+    seen_dropped = 0
+    ended = False
+
+    def poll(timeout: Optional[float] = None) -> Optional[bytes]:
+        nonlocal seen_dropped, ended
+        if ended:
+            return None
+        # Read before take(): once finished, every final event is already queued.
+        finished = feed.finished
+        events = feed.take(timeout)
+        parts = []
+        if feed.dropped != seen_dropped:
+            parts.append(_sse("dropped", {"dropped": feed.dropped - seen_dropped}))
+            seen_dropped = feed.dropped
+        parts.extend(_sse("status", event) for event in events)
+        if finished or time.time() >= until:
+            ended = True
+            parts.append(_sse("end", {"finished": finished}))
+        return "".join(parts).encode("utf-8")
+
+    return poll
+
+
+@app.route("/events", methods=["GET"])
+def stream_request_status():
+    request_ids = [part.strip() for part in request.args.get("ids", "").split(",") if part.strip()] or None
+    if request_ids is not None and len(request_ids) > MAX_STREAM_REQUEST_IDS:
+        return jsonify({"success": False, "error": "too_many_ids", "max_ids": MAX_STREAM_REQUEST_IDS}), 400
+    try:
+        timeout = float(request.args.get("timeout", STATUS_STREAM_TIMEOUT_SECONDS))
+    except ValueError:
+        timeout = math.nan
+    if not math.isfinite(timeout) or timeout < 0:
+        return jsonify({"success": False, "error": "invalid_timeout"}), 400
+    timeout = min(timeout, MAX_STATUS_STREAM_TIMEOUT_SECONDS)
+
+    feed = status_store.subscribe(request_ids)
+    if feed is None:
+        return jsonify({"success": False, "error": "too_many_streams"}), 503
+    until = time.time() + timeout
+    poll = _status_stream(feed, until)
+    parking = request.environ.get(PARKING_ENVIRON_KEY)
+    if parking is not None:
+        feed.wake = parking.stream(
+            poll,
+            content_type="text/event-stream; charset=utf-8",
+            on_close=functools.partial(status_store.unsubscribe, feed),
+            keepalive=SSE_KEEPALIVE,
+            keepalive_seconds=min(STATUS_STREAM_KEEPALIVE_SECONDS, max(timeout, 0.01)),
+        ).set
+        return "", 204
+
+    def generate():
+        while True:
+            chunk = poll(min(STATUS_STREAM_KEEPALIVE_SECONDS, max(until - time.time(), 0.01)))
+            if chunk is None:
+                return
+            yield chunk or SSE_KEEPALIVE
+
+    response = Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+    response.call_on_close(functools.partial(status_store.unsubscribe, feed))
+    return response
 
 @app.route("/danmaku", methods=["POST"])
 def send_danmaku():
@@ -991,19 +1843,56 @@ def send_danmaku():
     if not text:
         return jsonify({"error": "Empty text"}), 400
 
-    if len(text) > 100 or not enqueue_item({"danmaku": text}):
+    if len(text) > 100:
         return jsonify({"error": "sender_queue_full_or_invalid"}), 503
+    if _danmaku_lane_usable():
+        if not danmaku_lane.offer(text):
+            return _queue_rejected("sender_queue_full_or_invalid", "full", danmaku_lane.min_interval)
+        print(f"收到弹幕请求: {text}")
+        return jsonify({"status": "ok", "text": text})
+    # 仅浏览器后端且 cookie 无 bili_jct：只能在页面里输入，交给浏览器线程
+    rejection, retry_after = send_queue.offer({"danmaku": text}, LANE_CONTROL)
+    if rejection is not None:
+        return _queue_rejected("sender_queue_full_or_invalid", rejection, retry_after)
     print(f"收到弹幕请求: {text}")
     return jsonify({"status": "ok", "text": text})
 
 @app.route("/", methods=["GET"])
 def health_check():
+    default_account = accounts.peek()
     return jsonify({
         "status": "running",
+        "ready": warmup.ready,
+        "warmup": warmup.stats(),
         "backend": THREESERVER_BACKEND,
         "room_id": ROOM_ID,
+        "rooms": default_account.shards.stats() if default_account is not None else None,
+        "accounts": accounts.stats(),
+        "dns": provider_dns.stats() if provider_dns is not None else None,
+        "room_meta": room_meta.stats(),
+        "latency": provider_latency.stats(),
+        "hedge": provider_hedge.stats(),
+        "breakers": provider_breakers.stats(),
+        "danmaku": danmaku_lane.stats(),
+        "serving": event_server.stats() if event_server is not None else {"server": SERVING_MODE},
         "balance_check_enabled": BALANCE_CHECK_ENABLED,
-        "queue_length": len(gift_queue)
+        "queue_length": len(send_queue),
+        "queue_lanes": send_queue.stats(),
+        "batch_window": send_queue.window_stats(),
+        "request_status": status_store.stats(),
+        "journal": {**send_journal.stats(), "recovery": journal_recovery} if send_journal is not None else None,
+        "dispatch": {
+            "concurrency": ASYNC_MAX_STREAMS if THREESERVER_BACKEND == "async" else DISPATCH_CONCURRENCY,
+            "http2": THREESERVER_BACKEND == "async" and HTTP2_AVAILABLE,
+            "active_requests": dispatch_stats["active_requests"],
+            "coalesce": {
+                "enabled": COALESCE_ENABLED,
+                "jobs": dispatch_stats["coalesced_jobs"],
+                "requests": dispatch_stats["coalesced_requests"],
+                "calls_saved": dispatch_stats["coalesced_calls_saved"],
+            },
+            "provider_pool": provider_pool.stats() if provider_pool is not None else None,
+        },
     })
 
 @app.route("/balance", methods=["GET"])
@@ -1019,7 +1908,7 @@ def reset_balance_status():
 @app.route("/current_balance", methods=["GET"])
 def get_current_balance_api():
     """获取当前页面显示的电池余额（实时查询）"""
-    if THREESERVER_BACKEND in ("http", "giftsend", "api"):
+    if THREESERVER_BACKEND in API_BACKENDS:
         return jsonify({"success": False, "error": "not_supported_in_http_backend"}), 503
     if not BALANCE_CHECK_ENABLED:
         return jsonify({"success": False, "error": "balance_check_disabled"}), 503
@@ -1033,12 +1922,12 @@ def get_current_balance_api():
         balance_result = {"balance": None, "success": False}
 
         # 请求浏览器线程查询余额
-        if not enqueue_item({
+        if not send_queue.put({
             "check_balance": True,
             "request_id": request_id,
             "result_event": result_event,
             "result_storage": balance_result
-        }):
+        }, LANE_CONTROL):
             return jsonify({"success": False, "error": "sender_queue_full"}), 503
 
         # 等待结果（最多等待5秒）
@@ -1070,8 +1959,25 @@ def get_current_balance_api():
             "timestamp": int(time.time())
         }), 500
 
+# flask：开发服务器，每个等待中的 /send 占一个线程；async：事件循环服务器，
+# 等待中的请求不占线程，连接数/挂起数/应用线程数可配置
+SERVING_MODE = (os.getenv("THREESERVER_SERVER") or "flask").strip().lower()
+event_server: Optional[EventLoopServer] = None
+
 def run_flask():
+    global event_server
     port = int(os.getenv("THREESERVER_PORT", "9876"))
+    if SERVING_MODE == "async":
+        event_server = EventLoopServer(
+            app, host="127.0.0.1", port=port,
+            max_connections=int(os.getenv("THREESERVER_MAX_CONNECTIONS", "1000") or 1000),
+            max_waiting=int(os.getenv("THREESERVER_MAX_WAITING", "1000") or 1000),
+            app_threads=int(os.getenv("THREESERVER_APP_THREADS", "8") or 8),
+            dumps=app.json.dumps,
+        )
+        print(f"🌐 事件循环服务器: 127.0.0.1:{port}")
+        event_server.serve_forever()
+        return
     app.run(host="127.0.0.1", port=port)  # 使用IP地址
 
 def run_browser():
@@ -1586,92 +2492,87 @@ def run_browser():
 
         # 主循环 - 批量处理模式
         while True:
-            if gift_queue:
-                # 批量提取礼物，避免逐个处理的开销
-                gifts_to_send = []
-                special_items = []
-                batch_requests = []
+            items = send_queue.drain()
+            # 批量提取礼物，避免逐个处理的开销
+            gifts_to_send = []
+            special_items = []
+            batch_requests = []
 
-                # 一次性处理队列中的所有项目
-                for item in drain_queue():
+            # 一次性处理队列中的所有项目
+            for item in items:
 
-                    # 分类处理
-                    if isinstance(item, dict):
-                        if "gifts" in item:
-                            batch_requests.append(item)
-                            continue
-                        special_items.append(item)
-                    else:
-                        gifts_to_send.append(item)
-
-                # 先处理特殊项目（余额检查、弹幕等）
-                # 优先处理送礼（降低“检测到→真实送出”的排队延迟）
-                for item in batch_requests:
-                    gift_list = item.get("gifts", [])
-                    req_id = item.get("request_id")
-                    fast = bool(item.get("fast"))
-                    confirm = str(item.get("confirm") or "click").strip().lower()
-                    if req_id:
-                        with request_lock:
-                            st = request_status.get(req_id)
-                            if st is not None:
-                                st["status"] = "sending"
-                                st["sending_ts"] = st.get("sending_ts") or time.time()
-                                st["updated_ts"] = time.time()
-                    results = send_gifts_batch(gift_list, fast=fast, confirm=confirm)
-                    storage = item.get("result_storage")
-                    if storage is not None:
-                        storage["results"] = results
-                        storage["success_count"] = sum(1 for r in results if r.get("success"))
-                        storage["failed_count"] = len(results) - storage["success_count"]
-                    if req_id:
-                        with request_lock:
-                            st = request_status.get(req_id)
-                            if st is not None:
-                                st["status"] = "done"
-                                st["results"] = results
-                                st["done_ts"] = time.time()
-                                st["updated_ts"] = time.time()
-                    event = item.get("result_event")
-                    if event:
-                        event.set()
-
-                # 批量快速发送礼物 - JavaScript一次性处理
-                if gifts_to_send:
-                    send_gifts_batch(gifts_to_send)
-
-                # 再处理特殊项目（弹幕等），避免阻塞送礼队列
-                danmaku_post_delay_ms = int(os.getenv("DANMAKU_POST_DELAY_MS", "0") or 0)
-                if danmaku_post_delay_ms < 0:
-                    danmaku_post_delay_ms = 0
-                for item in special_items:
-                    if "check_balance" in item:
-                        # balance checks are disabled by default in hard-send mode
-                        result_event = item.get("result_event")
-                        result_storage = item.get("result_storage")
-                        if result_storage is not None:
-                            result_storage["success"] = False
-                        if result_event:
-                            result_event.set()
+                # 分类处理
+                if isinstance(item, dict):
+                    if "gifts" in item:
+                        batch_requests.append(item)
                         continue
+                    special_items.append(item)
+                else:
+                    gifts_to_send.append(item)
 
-                    if "danmaku" in item:
-                        text = item["danmaku"]
-                        print(f"💬 发送弹幕：{text}")
-                        try:
-                            page.fill("textarea", text)
-                            page.keyboard.press("Enter")
-                            print("✅ 弹幕发送成功")
-                        except Exception as e:
-                            print(f"❌ 弹幕发送失败: {e}")
-                        if danmaku_post_delay_ms:
-                            time.sleep(danmaku_post_delay_ms / 1000.0)
-            else:
-                time.sleep(0.001)  # 极短轮询间隔
+            # 先处理特殊项目（余额检查、弹幕等）
+            # 优先处理送礼（降低“检测到→真实送出”的排队延迟）
+            for item in batch_requests:
+                if deadline_passed(item):
+                    expire_queued_item(item)
+                    continue
+                gift_list = item.get("gifts", [])
+                req_id = item.get("request_id")
+                fast = bool(item.get("fast"))
+                confirm = str(item.get("confirm") or "click").strip().lower()
+                if req_id:
+                    status_store.mark_sending(req_id)
+                results = send_gifts_batch(gift_list, fast=fast, confirm=confirm)
+                if req_id:
+                    status_store.finish(req_id, results)
+                event = item.get("result_event")
+                if event:
+                    event.set()
+
+            # 批量快速发送礼物 - JavaScript一次性处理
+            if gifts_to_send:
+                send_gifts_batch(gifts_to_send)
+
+            # 再处理特殊项目（弹幕等），避免阻塞送礼队列
+            danmaku_post_delay_ms = int(os.getenv("DANMAKU_POST_DELAY_MS", "0") or 0)
+            if danmaku_post_delay_ms < 0:
+                danmaku_post_delay_ms = 0
+            for item in special_items:
+                if "check_balance" in item:
+                    # balance checks are disabled by default in hard-send mode
+                    result_event = item.get("result_event")
+                    result_storage = item.get("result_storage")
+                    if result_storage is not None:
+                        result_storage["success"] = False
+                    if result_event:
+                        result_event.set()
+                    continue
+
+                if "danmaku" in item:
+                    text = item["danmaku"]
+                    print(f"💬 发送弹幕：{text}")
+                    try:
+                        page.fill("textarea", text)
+                        page.keyboard.press("Enter")
+                        print("✅ 弹幕发送成功")
+                    except Exception as e:
+                        print(f"❌ 弹幕发送失败: {e}")
+                    if danmaku_post_delay_ms:
+                        time.sleep(danmaku_post_delay_ms / 1000.0)
 
 if __name__ == "__main__":
+    open_send_journal()
+    status_store.start_reaper()
+    accounts.start_reaper()
+    if provider_dns is not None:
+        install_urllib3(provider_dns)
+        provider_dns.start()
+    warmup.start()
+    danmaku_lane.start()
     Thread(target=run_flask, daemon=True).start()
-    if THREESERVER_BACKEND in ("http", "giftsend", "api"):
+    if THREESERVER_BACKEND == "async":
+        run_async_worker()
+    elif THREESERVER_BACKEND in API_BACKENDS:
         run_http_worker()
     else:
         run_browser()
@@ -0,0 +1,130 @@
+"""Startup warm-up steps and periodic refreshes for the threeserver send path."""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+Step = Tuple[str, Callable[[], bool]]
+
+
+class Warmup:
+    """Run ``steps`` once in order, then ``refresh`` every ``interval`` seconds.
+
+    The state goes ``pending`` -> ``warming`` -> ``ready`` when every step
+    returned true, or ``degraded`` when one failed, raised, or the steps
+    together ran past ``timeout``. Either final state counts as ready: a
+    sender that could not warm up is still better than none, and health
+    reports which step failed. A step still running at the timeout keeps
+    running; it just no longer holds readiness back.
+    """
+
+    def __init__(self, steps: Sequence[Step], refresh: Sequence[Step] = (), *,
+                 interval: float = 15.0, timeout: float = 8.0):
+        self._steps = list(steps)
+        self._refresh = list(refresh)
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.state = "pending"
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._refreshes = 0
+        self._refresh_failures = 0
+        self._last_refresh: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    @staticmethod
+    def _run_step(fn: Callable[[], bool]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            ok, error = bool(fn()), None
+        except Exception as step_error:
+            ok, error = False, type(step_error).__name__
+        outcome: Dict[str, Any] = {"ok": ok, "ms": round((time.perf_counter() - started) * 1000.0, 3)}
+        if error:
+            outcome["error"] = error
+        return outcome
+
+    def _finish(self, state: str) -> None:
+        with self._lock:
+            if self._ready.is_set():
+                return
+            self.state = state
+            self._finished = time.time()
+            self._ready.set()
+
+    def run_steps(self) -> bool:
+        """Run the startup steps on this thread; returns whether all succeeded."""
+        with self._lock:
+            self.state = "warming"
+            self._started = time.time()
+        timer = threading.Timer(self.timeout, self._finish, args=("degraded",))
+        timer.daemon = True
+        timer.start()
+        all_ok = True
+        try:
+            for name, fn in self._steps:
+                outcome = self._run_step(fn)
+                with self._lock:
+                    self._results[name] = outcome
+                all_ok = all_ok and outcome["ok"]
+        finally:
+            timer.cancel()
+        self._finish("ready" if all_ok else "degraded")
+        return all_ok
+
+    def refresh_once(self) -> None:
+        for name, fn in self._refresh:
+            outcome = self._run_step(fn)
+            with self._lock:
+                self._last_refresh[name] = {**outcome, "ts": time.time()}
+                self._refresh_failures += 0 if outcome["ok"] else 1
+        with self._lock:
+            self._refreshes += 1
+
+    def start(self) -> threading.Thread:
+        def _run() -> None:
+            self.run_steps()
+            while self._refresh:
+                time.sleep(self.interval)
+                self.refresh_once()
+
+        thread = threading.Thread(target=_run, name="warmup", daemon=True)
+        thread.start()
+        return thread
+
+    @classmethod
+    def skipped(cls) -> "Warmup":
+        """A warm-up with nothing to do (e.g. the browser backend): ready at once."""
+        warmup = cls([])
+        warmup.state = "skipped"
+        warmup._ready.set()
+        return warmup
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "ready": self._ready.is_set(),
+                "started_ts": self._started,
+                "finished_ts": self._finished,
+                "timeout_seconds": self.timeout,
+                "steps": {name: dict(outcome) for name, outcome in self._results.items()},
+                "refresh": {
+                    "interval_seconds": self.interval,
+                    "runs": self._refreshes,
+                    "failures": self._refresh_failures,
+                    "last": {name: dict(outcome) for name, outcome in self._last_refresh.items()},
+                },
+            }
+